@@ -0,0 +1,151 @@
+"""
+Import-time budget of modules QGIS loads on startup with GTFS-GO enabled.
+
+QGIS imports the plugin package, gtfs_go and, from initGui(), the Processing
+provider on every startup. Those must import Qt and QGIS classes only: the
+dialog, pandas, gtfs_parser and the Japan DPF client load on the first run.
+Each check runs in a fresh interpreter with Qt and QGIS already imported, as
+they are in QGIS, and fails if a heavy module is imported or the import took
+longer than the budget. Run with the Python of QGIS:
+
+    python benchmarks/import_budget.py --budget-ms 50
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# imported by QGIS itself before plugins
+PRELOADED = (
+    "qgis.core",
+    "qgis.gui",
+    "qgis.PyQt.QtCore",
+    "qgis.PyQt.QtGui",
+    "qgis.PyQt.QtWidgets",
+)
+
+# plugin modules imported on startup
+STARTUP_MODULES = ("gtfs_go", "gtfs_go_processing")
+
+# must not be imported on startup, prefixes of module names
+HEAVY_MODULES = (
+    "numpy",
+    "osgeo",
+    "pandas",
+    "pyarrow",
+    "{package}.gtfs_go_dialog",
+    "{package}.gtfs_go_pipeline",
+    "{package}.gtfs_go_task",
+    "{package}.gtfs_parser",
+    "{package}.repository",
+)
+
+CHILD = """
+import importlib, json, sys, time
+sys.path.insert(0, {parent!r})
+for name in {preloaded!r}:
+    importlib.import_module(name)
+before = set(sys.modules)
+# lines of -X importtime before this are of preloaded modules
+print("import_budget: begin", file=sys.stderr, flush=True)
+begin = time.perf_counter()
+for name in {modules!r}:
+    importlib.import_module({package!r} + "." + name)
+seconds = time.perf_counter() - begin
+print(json.dumps({{
+    "seconds": seconds,
+    "modules": sorted(set(sys.modules) - before),
+}}))
+"""
+
+
+def measure(package: str, modules: tuple) -> dict:
+    """
+    import modules of the plugin in a new interpreter
+
+    Returns:
+        dict: seconds, newly imported modules and the slowest of them
+    """
+    code = CHILD.format(
+        parent=os.path.dirname(PLUGIN_DIR),
+        preloaded=PRELOADED,
+        modules=modules,
+        package=package,
+    )
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1])
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+
+    # "import time: self [us] | cumulative | imported package"
+    lines = completed.stderr.split("import_budget: begin", 1)[-1].splitlines()
+    slowest = []
+    for line in lines:
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        slowest.append((int(cumulative), name.strip()))
+    result["slowest"] = [
+        {"module": name, "ms": round(us / 1000, 1)}
+        for us, name in sorted(slowest, reverse=True)[:10]
+    ]
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check import time of GTFS-GO")
+    parser.add_argument("--budget-ms", type=float, default=50.0)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("-o", "--output", help="JSON file of results")
+    args = parser.parse_args(argv)
+
+    package = os.path.basename(PLUGIN_DIR)
+    runs = [measure(package, STARTUP_MODULES) for _ in range(args.repeat)]
+    # the first run may compile bytecode, the median is reported
+    milliseconds = statistics.median(run["seconds"] for run in runs) * 1000
+    heavy = [
+        module
+        for module in runs[-1]["modules"]
+        if any(
+            module == prefix or module.startswith(prefix + ".")
+            for prefix in (p.format(package=package) for p in HEAVY_MODULES)
+        )
+    ]
+
+    print("%-32s %9.1fms" % ("startup imports", milliseconds), file=sys.stderr)
+    for slow in runs[-1]["slowest"]:
+        print("  %-30s %9.1fms" % (slow["module"], slow["ms"]), file=sys.stderr)
+    results = {
+        "budget_ms": args.budget_ms,
+        "milliseconds": round(milliseconds, 1),
+        "heavy_modules": heavy,
+        "slowest": runs[-1]["slowest"],
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    failed = False
+    if heavy:
+        print("imported on startup: " + ", ".join(heavy), file=sys.stderr)
+        failed = True
+    if milliseconds > args.budget_ms:
+        print(
+            "over budget: %.1fms > %.1fms" % (milliseconds, args.budget_ms),
+            file=sys.stderr,
+        )
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,265 @@
+"""
+Benchmarks of GTFS-GO stages on synthetic feeds, without QGIS.
+
+Each stage is timed on a feed from synthetic_gtfs.py and reported with wall
+time, peak RSS while the stage ran and throughput in stop_times rows per
+second. Results are written as JSON, and compared with an earlier result by
+--baseline, e.g. to check a commit against its parent:
+
+    python benchmarks/run_benchmarks.py --scale medium -o after.json \\
+        --baseline before.json
+
+Stages of gtfs_parser are skipped when the submodule is not checked out.
+"""
+
+import argparse
+import importlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import synthetic_gtfs
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_plugin(module: str):
+    """import a module of the plugin directory as a package, as QGIS does"""
+    if os.path.dirname(PLUGIN_DIR) not in sys.path:
+        sys.path.insert(0, os.path.dirname(PLUGIN_DIR))
+    package = importlib.import_module(os.path.basename(PLUGIN_DIR))
+    return importlib.import_module(package.__name__ + "." + module)
+
+
+class Runner:
+    def __init__(self, rows: int, repeat: int):
+        """
+        Args:
+            rows (int): stop_times rows of the feed, for throughput
+            repeat (int): runs of each stage, the fastest is reported
+        """
+        self.rows = rows
+        self.repeat = repeat
+        self.results = []
+
+    def stage(self, name: str, func, *args, **kwargs):
+        """run func(*args, **kwargs) as a stage and return its result"""
+        report = import_plugin("gtfs_go_report")
+        seconds = []
+        peak = 0
+        for _ in range(self.repeat):
+            with report.PeakRSS() as rss:
+                begin = time.perf_counter()
+                result = func(*args, **kwargs)
+                seconds.append(time.perf_counter() - begin)
+            peak = max(peak, rss.peak)
+        self.results.append(
+            {
+                "stage": name,
+                "seconds": min(seconds),
+                "peak_rss_mb": round(peak / 2**20, 1),
+                "rows_per_second": round(self.rows / max(min(seconds), 1e-9)),
+            }
+        )
+        print(
+            "%-24s %9.3fs %9.1fMB" % (name, min(seconds), peak / 2**20),
+            file=sys.stderr,
+        )
+        return result
+
+    def skip(self, name: str, reason: str):
+        self.results.append({"stage": name, "skipped": reason})
+        print("%-24s skipped: %s" % (name, reason), file=sys.stderr)
+
+
+def load_all(feed_module, zip_path: str, cache_dir: str):
+    gtfs = feed_module.load_gtfs(zip_path, cache_dir, 1)
+    gtfs.preload(list(gtfs))
+    return gtfs
+
+
+def run_stages(runner: Runner, zip_path: str, work_dir: str, params: dict):
+    feed = import_plugin("gtfs_go_feed")
+    calendar = import_plugin("gtfs_go_calendar")
+    frequency = import_plugin("gtfs_go_frequency")
+    unify = import_plugin("gtfs_go_unify")
+    stoptimes = import_plugin("gtfs_go_stoptimes")
+    segments = import_plugin("gtfs_go_segments")
+    timebins = import_plugin("gtfs_go_timebins")
+    try:
+        gtfs_parser = import_plugin("gtfs_parser.gtfs_parser")
+    except ImportError:
+        gtfs_parser = None
+
+    # a new cache directory on each run, not to read tables of the last one
+    runner.stage(
+        "load_cold", lambda: load_all(feed, zip_path, tempfile.mkdtemp(dir=work_dir))
+    )
+    cache_dir = os.path.join(work_dir, "parsed")
+    load_all(feed, zip_path, cache_dir)
+    gtfs = runner.stage("load_warm", load_all, feed, zip_path, cache_dir)
+
+    if gtfs_parser is None:
+        runner.skip("read_routes", "gtfs_parser not found")
+        runner.skip("read_stops", "gtfs_parser not found")
+    else:
+        runner.stage(
+            "read_routes", lambda: list(gtfs_parser.parse.read_routes(gtfs, False))
+        )
+        runner.stage(
+            "read_stops", lambda: list(gtfs_parser.parse.read_stops(gtfs, False))
+        )
+
+    unified = runner.stage(
+        "unify_stops", unify.unify_stops, gtfs["stops"], params["delimiter"]
+    )
+    # of the whole feed, filtered by masks of the date and time
+    compact = runner.stage(
+        "compact_stop_times",
+        stoptimes.CompactStopTimes.from_table,
+        gtfs["stop_times"],
+    )
+    aggregated = runner.stage(
+        "frequency",
+        frequency.Frequency,
+        gtfs,
+        unified,
+        yyyymmdd=params["date"],
+        begin_time=params["begin_time"],
+        end_time=params["end_time"],
+        compact=compact,
+    )
+    runner.stage(
+        "read_route_frequency", lambda: list(aggregated.read_route_frequency())
+    )
+    runner.stage(
+        "read_interpolated_stops",
+        lambda: list(aggregated.read_interpolated_stops()),
+    )
+
+    gtfs = unify.apply_unification(gtfs, unified)
+    # built, not read from the cache of an earlier run
+    runner.stage(
+        "calendar_index",
+        calendar.CalendarIndex.build,
+        gtfs.get("calendar"),
+        gtfs.get("calendar_dates"),
+    )
+    gtfs = runner.stage("filter_by_date", calendar.filter_by_date, gtfs, params["date"])
+    runner.stage("build_segments", segments.build_segments, gtfs)
+
+    runner.stage(
+        "time_bins_stops",
+        lambda: list(timebins.read_binned_stops(gtfs, 60, yyyymmdd=params["date"])),
+    )
+    runner.stage(
+        "time_bins_routes",
+        lambda: list(timebins.read_binned_routes(gtfs, 60, yyyymmdd=params["date"])),
+    )
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=PLUGIN_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def compare(results: dict, baseline: dict):
+    before = {
+        stage["stage"]: stage for stage in baseline["stages"] if "seconds" in stage
+    }
+    print(
+        "%-24s %9s %9s %7s" % ("stage", "baseline", "current", "ratio"),
+        file=sys.stderr,
+    )
+    for stage in results["stages"]:
+        if "seconds" not in stage or stage["stage"] not in before:
+            continue
+        seconds = before[stage["stage"]]["seconds"]
+        print(
+            "%-24s %8.3fs %8.3fs %6.2fx"
+            % (
+                stage["stage"],
+                seconds,
+                stage["seconds"],
+                stage["seconds"] / max(seconds, 1e-9),
+            ),
+            file=sys.stderr,
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark GTFS-GO stages")
+    parser.add_argument("--scale", choices=synthetic_gtfs.SCALES, default="small")
+    parser.add_argument("--feed", help="GTFS zip to use instead of a synthetic one")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--date", default="20240105", help="YYYYMMDD")
+    parser.add_argument("--delimiter", default="")
+    parser.add_argument("-o", "--output", help="JSON file of results")
+    parser.add_argument("--baseline", help="JSON file of results to compare with")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        zip_path = args.feed
+        if zip_path is None:
+            zip_path = os.path.join(work_dir, "feed.zip")
+            begin = time.perf_counter()
+            rows = synthetic_gtfs.generate(
+                zip_path, *synthetic_gtfs.SCALES[args.scale], seed=args.seed
+            )
+            print(
+                "generated %s in %.1fs" % (rows, time.perf_counter() - begin),
+                file=sys.stderr,
+            )
+        else:
+            feed = import_plugin("gtfs_go_feed")
+            rows = {
+                name: len(df)
+                for name, df in load_all(
+                    feed, zip_path, os.path.join(work_dir, "rows")
+                ).items()
+            }
+
+        runner = Runner(rows["stop_times"], args.repeat)
+        params = {
+            "date": args.date,
+            "delimiter": args.delimiter,
+            "begin_time": "",
+            "end_time": "",
+        }
+        run_stages(runner, zip_path, work_dir, params)
+
+    results = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "scale": args.scale if args.feed is None else os.path.basename(args.feed),
+        "rows": rows,
+        "stages": runner.results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+"""
+Synthetic GTFS feed generator for benchmarks.
+
+Stops are scattered on a grid around Tokyo, each route runs a fixed pattern
+of consecutive stops with a shape and trips spread over the day by three
+services (weekday, saturday, sunday). Stops come in pairs of the same name a
+few meters apart, so that stop unification has work to do. Output depends
+only on the arguments and the seed.
+
+    python benchmarks/synthetic_gtfs.py -o feed.zip --scale large
+"""
+
+import argparse
+import functools
+import io
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+# name: (stops, routes, trips per route, stops per trip)
+SCALES = {
+    "small": (1000, 20, 50, 20),
+    "medium": (10000, 200, 100, 30),
+    "large": (50000, 1000, 200, 40),
+    "xlarge": (200000, 4000, 250, 50),
+}
+
+SERVICES = ("weekday", "saturday", "sunday")
+
+# stop_times rows written at once, bounds memory of huge feeds
+CHUNK_TRIPS = 20000
+
+
+@functools.lru_cache(maxsize=1)
+def time_table() -> np.ndarray:
+    """HH:MM:SS of every second of 2 days"""
+    return np.array(
+        [
+            "%02d:%02d:%02d" % (s // 3600, s // 60 % 60, s % 60)
+            for s in range(2 * 24 * 3600)
+        ]
+    )
+
+
+def format_times(seconds: np.ndarray) -> np.ndarray:
+    table = time_table()
+    return table[np.clip(seconds, 0, len(table) - 1)]
+
+
+def write_csv(z: zipfile.ZipFile, name: str, chunks):
+    with z.open(name + ".txt", "w", force_zip64=True) as f:
+        text = io.TextIOWrapper(f, encoding="utf-8", newline="")
+        for i, df in enumerate(chunks):
+            df.to_csv(text, index=False, header=i == 0)
+        text.flush()
+        text.detach()
+
+
+def make_stops(n_stops: int, rng: np.random.Generator) -> pd.DataFrame:
+    pairs = (n_stops + 1) // 2
+    side = int(np.ceil(np.sqrt(pairs)))
+    codes = np.arange(pairs)
+    # about 300m between grid points
+    lon = 139.5 + (codes % side) * 0.003 + rng.uniform(-0.001, 0.001, pairs)
+    lat = 35.5 + (codes // side) * 0.003 + rng.uniform(-0.001, 0.001, pairs)
+    # two poles of the same stop, 10-20m apart
+    offsets = rng.uniform(0.0001, 0.0002, n_stops)
+    pair_of = np.arange(n_stops) // 2
+    return pd.DataFrame(
+        {
+            "stop_id": ["S%d_%d" % (p, i % 2) for i, p in enumerate(pair_of)],
+            "stop_name": ["Stop %d" % p for p in pair_of],
+            "stop_lat": np.round(lat[pair_of] + offsets, 6),
+            "stop_lon": np.round(lon[pair_of] + offsets, 6),
+        }
+    )
+
+
+def make_patterns(
+    stops: pd.DataFrame, n_routes: int, stops_per_trip: int, rng
+) -> np.ndarray:
+    """(routes, stops_per_trip) stop codes, a random walk on the grid of pairs"""
+    pairs = (len(stops) + 1) // 2
+    side = int(np.ceil(np.sqrt(pairs)))
+    steps = np.array([1, -1, side, -side])
+    walk = rng.choice(steps, size=(n_routes, stops_per_trip))
+    walk[:, 0] = rng.integers(0, pairs, n_routes)
+    pair_codes = np.cumsum(walk, axis=1) % pairs
+    # one pole of each pair by direction of route
+    poles = (np.arange(n_routes) % 2)[:, None]
+    return np.minimum(pair_codes * 2 + poles, len(stops) - 1)
+
+
+def make_shapes(stops: pd.DataFrame, patterns: np.ndarray) -> pd.DataFrame:
+    """two vertices per stop: the stop and a point off the straight line"""
+    lon = stops["stop_lon"].values[patterns]
+    lat = stops["stop_lat"].values[patterns]
+    mid_lon = (lon + np.roll(lon, -1, axis=1)) / 2 + 0.0003
+    mid_lat = (lat + np.roll(lat, -1, axis=1)) / 2
+    vertices_lon = np.stack([lon, mid_lon], axis=2).reshape(len(patterns), -1)[:, :-1]
+    vertices_lat = np.stack([lat, mid_lat], axis=2).reshape(len(patterns), -1)[:, :-1]
+    n_routes, n_vertices = vertices_lon.shape
+    return pd.DataFrame(
+        {
+            "shape_id": np.repeat(["SH%d" % r for r in range(n_routes)], n_vertices),
+            "shape_pt_lat": np.round(vertices_lat.ravel(), 6),
+            "shape_pt_lon": np.round(vertices_lon.ravel(), 6),
+            "shape_pt_sequence": np.tile(np.arange(n_vertices), n_routes),
+        }
+    )
+
+
+def stop_times_chunks(
+    trips: pd.DataFrame,
+    patterns: np.ndarray,
+    stop_ids: np.ndarray,
+    first_departures: np.ndarray,
+    rng,
+):
+    stops_per_trip = patterns.shape[1]
+    route_codes = trips["route_code"].values
+    for begin in range(0, len(trips), CHUNK_TRIPS):
+        end = min(begin + CHUNK_TRIPS, len(trips))
+        n = end - begin
+        # 1-3 minutes between stops
+        intervals = rng.integers(60, 181, size=(n, stops_per_trip))
+        intervals[:, 0] = 0
+        seconds = first_departures[begin:end, None] + np.cumsum(intervals, axis=1)
+        times = format_times(seconds.ravel())
+        yield pd.DataFrame(
+            {
+                "trip_id": np.repeat(
+                    trips["trip_id"].to_numpy()[begin:end], stops_per_trip
+                ),
+                "arrival_time": times,
+                "departure_time": times,
+                "stop_id": stop_ids[patterns[route_codes[begin:end]]].ravel(),
+                "stop_sequence": np.tile(np.arange(1, stops_per_trip + 1), n),
+            }
+        )
+
+
+def generate(
+    path: str,
+    n_stops: int,
+    n_routes: int,
+    trips_per_route: int,
+    stops_per_trip: int,
+    seed=0,
+) -> dict:
+    """
+    write a synthetic GTFS zip
+
+    Returns:
+        dict: number of rows of each table
+    """
+    rng = np.random.default_rng(seed)
+    stops = make_stops(n_stops, rng)
+    patterns = make_patterns(stops, n_routes, stops_per_trip, rng)
+
+    routes = pd.DataFrame(
+        {
+            "route_id": ["R%d" % r for r in range(n_routes)],
+            "agency_id": "A1",
+            "route_short_name": [str(r) for r in range(n_routes)],
+            "route_long_name": ["Route %d" % r for r in range(n_routes)],
+            "route_type": 3,
+        }
+    )
+
+    route_codes = np.repeat(np.arange(n_routes), trips_per_route)
+    trip_codes = np.arange(len(route_codes))
+    trips = pd.DataFrame(
+        {
+            "route_id": routes["route_id"].values[route_codes],
+            "service_id": np.array(SERVICES)[trip_codes % len(SERVICES)],
+            "trip_id": ["T%d" % t for t in trip_codes],
+            "direction_id": route_codes % 2,
+            "shape_id": ["SH%d" % r for r in route_codes],
+            "route_code": route_codes,
+        }
+    )
+    # 05:00 to 23:00, evenly by trip of each route
+    order = np.tile(np.arange(trips_per_route), n_routes)
+    first_departures = 5 * 3600 + order * (18 * 3600 // max(trips_per_route, 1))
+
+    calendar = pd.DataFrame(
+        {
+            "service_id": SERVICES,
+            "monday": [1, 0, 0],
+            "tuesday": [1, 0, 0],
+            "wednesday": [1, 0, 0],
+            "thursday": [1, 0, 0],
+            "friday": [1, 0, 0],
+            "saturday": [0, 1, 0],
+            "sunday": [0, 0, 1],
+            "start_date": "20240101",
+            "end_date": "20241231",
+        }
+    )
+    # new year's holidays run on sunday timetable
+    calendar_dates = pd.DataFrame(
+        {
+            "service_id": ["weekday", "sunday", "weekday", "sunday"],
+            "date": ["20240102", "20240102", "20240103", "20240103"],
+            "exception_type": [2, 1, 2, 1],
+        }
+    )
+    agency = pd.DataFrame(
+        {
+            "agency_id": ["A1"],
+            "agency_name": ["Synthetic Transit"],
+            "agency_url": ["https://example.com"],
+            "agency_timezone": ["Asia/Tokyo"],
+        }
+    )
+
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as z:
+        write_csv(z, "agency", [agency])
+        write_csv(z, "stops", [stops])
+        write_csv(z, "routes", [routes])
+        write_csv(z, "trips", [trips.drop(columns="route_code")])
+        write_csv(z, "calendar", [calendar])
+        write_csv(z, "calendar_dates", [calendar_dates])
+        write_csv(z, "shapes", [make_shapes(stops, patterns)])
+        write_csv(
+            z,
+            "stop_times",
+            stop_times_chunks(
+                trips, patterns, stops["stop_id"].to_numpy(), first_departures, rng
+            ),
+        )
+
+    return {
+        "stops": len(stops),
+        "routes": n_routes,
+        "trips": len(trips),
+        "stop_times": len(trips) * stops_per_trip,
+        "shapes": n_routes * (2 * stops_per_trip - 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a synthetic GTFS zip")
+    parser.add_argument("-o", "--output", required=True)
+    parser.add_argument("--scale", choices=SCALES, default="small")
+    parser.add_argument("--stops", type=int, help="overrides --scale")
+    parser.add_argument("--routes", type=int, help="overrides --scale")
+    parser.add_argument("--trips-per-route", type=int, help="overrides --scale")
+    parser.add_argument("--stops-per-trip", type=int, help="overrides --scale")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    n_stops, n_routes, trips_per_route, stops_per_trip = SCALES[args.scale]
+    rows = generate(
+        args.output,
+        args.stops or n_stops,
+        args.routes or n_routes,
+        args.trips_per_route or trips_per_route,
+        args.stops_per_trip or stops_per_trip,
+        seed=args.seed,
+    )
+    print(rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -26,9 +26,7 @@ import os
 from qgis.PyQt.QtCore import QSettings, QTranslator, QCoreApplication, Qt
 from qgis.PyQt.QtGui import QIcon
 from qgis.PyQt.QtWidgets import QAction
-
-# Import the code for the DockWidget
-from .gtfs_go_dialog import GTFSGoDialog
+from qgis.core import QgsApplication
 
 
 class GTFSGo:
@@ -71,6 +69,7 @@ class GTFSGo:
 
         self.pluginIsActive = False
         self.dialog = None
+        self.provider = None
 
     # noinspection PyMethodMayBeStatic
 
@@ -173,6 +172,11 @@ class GTFSGo:
             parent=self.iface.mainWindow(),
             add_to_menu=True)
 
+        # only Qt and QGIS classes, algorithms import the pipeline when run
+        from .gtfs_go_processing import GTFSGoProvider
+        self.provider = GTFSGoProvider()
+        QgsApplication.processingRegistry().addProvider(self.provider)
+
     # --------------------------------------------------------------------------
 
     def onClosePlugin(self):
@@ -204,10 +208,17 @@ class GTFSGo:
         # remove the toolbar
         del self.toolbar
 
+        if self.provider is not None:
+            QgsApplication.processingRegistry().removeProvider(self.provider)
+            self.provider = None
+
     # --------------------------------------------------------------------------
 
     def run(self):
         """Run method that loads and starts the plugin"""
         if self.dialog is None:
+            # the dialog, gtfs_parser and the DPF client load on the first run
+            # so that they don't slow QGIS startup
+            from .gtfs_go_dialog import GTFSGoDialog
             self.dialog = GTFSGoDialog(self.iface)
         self.dialog.show()
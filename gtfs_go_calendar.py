@@ -0,0 +1,290 @@
+"""
+Service-day calendar index.
+
+Which service_ids run on which date is resolved once per feed from
+calendar.txt and calendar_dates.txt into a bitset per service_id over the
+validity range of the feed, and cached next to the parsed tables and in
+memory for the session. Filtering by date then is a lookup of one column of
+the bitset and a vectorized mask over trips.
+"""
+
+import os
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from .gtfs_go_feed import read_table
+from .gtfs_go_stages import cached, stage_key
+
+INDEX_FILENAME = "calendar_index.npz"
+WEEKDAYS = (
+    "monday",
+    "tuesday",
+    "wednesday",
+    "thursday",
+    "friday",
+    "saturday",
+    "sunday",
+)
+
+
+def to_days(yyyymmdd) -> np.ndarray:
+    """yyyymmdd strings to days since epoch as int64"""
+    dates = pd.to_datetime(
+        pd.Series(yyyymmdd, dtype=str).str.strip(), format="%Y%m%d"
+    ).values
+    return dates.astype("datetime64[D]").astype("int64")
+
+
+def to_yyyymmdd(days: np.ndarray) -> list:
+    return [
+        str(d).replace("-", "")
+        for d in np.asarray(days, dtype="int64").astype("datetime64[D]")
+    ]
+
+
+def date_range(begin: str, end: str) -> list:
+    """yyyymmdd of each date from begin to end inclusive"""
+    begin_day, end_day = to_days([begin, end])
+    return to_yyyymmdd(np.arange(begin_day, end_day + 1))
+
+
+def weekday_of(days: np.ndarray) -> np.ndarray:
+    # 1970-01-01 is a thursday, monday is 0 as WEEKDAYS
+    return (np.asarray(days) + 3) % 7
+
+
+class CalendarIndex:
+    def __init__(self, service_ids: np.ndarray, first_day: int, bits: np.ndarray):
+        """
+        Args:
+            service_ids (np.ndarray): sorted service_ids, rows of bits
+            first_day (int): days since epoch of the first column of bits
+            bits (np.ndarray): bool, services x days, True if running
+        """
+        self.service_ids = service_ids
+        self.first_day = first_day
+        self.bits = bits
+
+    @property
+    def n_days(self) -> int:
+        return self.bits.shape[1]
+
+    @classmethod
+    def build(cls, calendar=None, calendar_dates=None):
+        """
+        Args:
+            calendar (pd.DataFrame, optional): calendar table
+            calendar_dates (pd.DataFrame, optional): calendar_dates table
+        """
+        if calendar is None:
+            calendar = pd.DataFrame(
+                columns=["service_id", "start_date", "end_date"] + list(WEEKDAYS)
+            )
+        if calendar_dates is None:
+            calendar_dates = pd.DataFrame(
+                columns=["service_id", "date", "exception_type"]
+            )
+
+        service_ids = np.unique(
+            np.concatenate(
+                [
+                    calendar["service_id"].astype(str).values,
+                    calendar_dates["service_id"].astype(str).values,
+                ]
+            )
+        )
+        start_days = to_days(calendar["start_date"])
+        end_days = to_days(calendar["end_date"])
+        exception_days = to_days(calendar_dates["date"])
+
+        all_days = np.concatenate([start_days, end_days, exception_days])
+        if len(all_days) == 0:
+            return cls(service_ids, 0, np.zeros((len(service_ids), 0), dtype=bool))
+        first_day = int(all_days.min())
+        days = np.arange(first_day, int(all_days.max()) + 1)
+
+        bits = np.zeros((len(service_ids), len(days)), dtype=bool)
+        if len(calendar) > 0:
+            weekly = np.stack(
+                [calendar[w].astype(str).str.strip().values == "1" for w in WEEKDAYS],
+                axis=1,
+            )
+            running = (
+                weekly[:, weekday_of(days)]
+                & (days >= start_days[:, None])
+                & (days <= end_days[:, None])
+            )
+            rows = np.searchsorted(service_ids, calendar["service_id"].astype(str))
+            # a service_id listed twice in calendar runs on either pattern
+            np.logical_or.at(bits, rows, running)
+
+        if len(calendar_dates) > 0:
+            rows = np.searchsorted(
+                service_ids, calendar_dates["service_id"].astype(str)
+            )
+            columns = exception_days - first_day
+            exception_type = calendar_dates["exception_type"].astype(str).str.strip()
+            added = (exception_type == "1").values
+            removed = (exception_type == "2").values
+            bits[rows[added], columns[added]] = True
+            bits[rows[removed], columns[removed]] = False
+
+        return cls(service_ids, first_day, bits)
+
+    @classmethod
+    def load(cls, path: str):
+        with np.load(path, allow_pickle=False) as npz:
+            n_days = int(npz["n_days"])
+            bits = np.unpackbits(npz["bits"], axis=1, count=n_days).astype(bool)
+            return cls(npz["service_ids"], int(npz["first_day"]), bits)
+
+    def save(self, path: str):
+        # packed to a bit per service-day, written under a temporary name
+        tmp_path = path + "." + str(uuid.uuid4())
+        with open(tmp_path, mode="wb") as f:
+            np.savez(
+                f,
+                service_ids=self.service_ids.astype(str),
+                first_day=np.int64(self.first_day),
+                n_days=np.int64(self.n_days),
+                bits=np.packbits(self.bits, axis=1),
+            )
+        os.replace(tmp_path, path)
+
+    def running_on(self, yyyymmdd: str) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: bool by service_ids, True if the service runs on the date
+        """
+        column = int(to_days([yyyymmdd])[0]) - self.first_day
+        if column < 0 or column >= self.n_days:
+            return np.zeros(len(self.service_ids), dtype=bool)
+        return self.bits[:, column]
+
+    def running_between(self, begin: str, end: str):
+        """
+        Returns:
+            tuple: days since epoch from begin to end inclusive and
+                bool array of services x days
+        """
+        begin_day, end_day = to_days([begin, end])
+        days = np.arange(begin_day, end_day + 1)
+        columns = days - self.first_day
+        in_range = (columns >= 0) & (columns < self.n_days)
+        running = np.zeros((len(self.service_ids), len(days)), dtype=bool)
+        running[:, in_range] = self.bits[:, columns[in_range]]
+        return days, running
+
+    def service_codes(self, service_ids: pd.Series) -> np.ndarray:
+        """row of each service_id in bits, -1 if not in calendar"""
+        if len(self.service_ids) == 0:
+            return np.full(len(service_ids), -1)
+        codes = np.searchsorted(self.service_ids, service_ids.astype(str).values)
+        codes = np.minimum(codes, len(self.service_ids) - 1)
+        found = self.service_ids[codes] == service_ids.astype(str).values
+        return np.where(found, codes, -1)
+
+    def service_mask(self, service_ids: pd.Series, yyyymmdd: str) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: bool by given service_ids, e.g. of trips
+        """
+        codes = self.service_codes(service_ids)
+        running = self.running_on(yyyymmdd)
+        return (codes >= 0) & np.append(running, False)[codes]
+
+
+def get_calendar_index(gtfs) -> CalendarIndex:
+    """
+    calendar index of the feed, loaded once per session, see
+    read_calendar_index()
+    """
+    return cached(
+        gtfs, stage_key(gtfs, "calendar_index"), lambda: read_calendar_index(gtfs)
+    )
+
+
+def read_calendar_index(gtfs) -> CalendarIndex:
+    """
+    calendar index of the feed, read from or written to the parsed feed cache
+    of GTFSFeed, built from the tables otherwise
+    """
+    table_dir = getattr(gtfs, "table_dir", None)
+    path = None if table_dir is None else os.path.join(table_dir, INDEX_FILENAME)
+    if path is not None and os.path.exists(path):
+        try:
+            return CalendarIndex.load(path)
+        except (OSError, ValueError, KeyError):
+            # broken cache, rebuilt below
+            pass
+
+    # read without keeping the tables in the feed, only the index is used
+    index = CalendarIndex.build(
+        read_table(gtfs, "calendar") if "calendar" in gtfs else None,
+        read_table(gtfs, "calendar_dates") if "calendar_dates" in gtfs else None,
+    )
+    if path is not None:
+        try:
+            index.save(path)
+        except OSError:
+            pass
+    return index
+
+
+def trip_mask(gtfs, yyyymmdd: str) -> np.ndarray:
+    """
+    Returns:
+        np.ndarray: bool by trips, True if the trip runs on yyyymmdd
+    """
+    return get_calendar_index(gtfs).service_mask(gtfs["trips"]["service_id"], yyyymmdd)
+
+
+def trips_running(gtfs, trip_ids: np.ndarray, yyyymmdd: str) -> np.ndarray:
+    """
+    Returns:
+        np.ndarray: bool by given trip_ids, e.g. of CompactStopTimes, True if
+            the trip runs on yyyymmdd
+    """
+    trips = gtfs["trips"]["trip_id"][trip_mask(gtfs, yyyymmdd)]
+    return pd.Index(trip_ids).isin(trips.values)
+
+
+def trip_counts(gtfs, begin: str, end: str) -> pd.DataFrame:
+    """
+    number of trips running on each date, to find representative days
+
+    Args:
+        begin (str): first date, yyyymmdd
+        end (str): last date, yyyymmdd
+
+    Returns:
+        pd.DataFrame: date (yyyymmdd), weekday and trips of each date
+    """
+    index = get_calendar_index(gtfs)
+    codes = index.service_codes(gtfs["trips"]["service_id"])
+    trips_by_service = np.bincount(codes[codes >= 0], minlength=len(index.service_ids))
+    days, running = index.running_between(begin, end)
+    return pd.DataFrame(
+        {
+            "date": to_yyyymmdd(days),
+            "weekday": [WEEKDAYS[w] for w in weekday_of(days)],
+            "trips": trips_by_service @ running,
+        }
+    )
+
+
+def filter_by_date(gtfs, yyyymmdd: str):
+    """
+    Returns:
+        copy of gtfs with trips and stop_times running on yyyymmdd only
+    """
+    trips = gtfs["trips"][trip_mask(gtfs, yyyymmdd)]
+    stop_times = gtfs["stop_times"]
+    stop_times = stop_times[stop_times["trip_id"].isin(trips["trip_id"])]
+
+    gtfs = gtfs.copy()
+    gtfs["trips"] = trips
+    gtfs["stop_times"] = stop_times
+    return gtfs
@@ -0,0 +1,120 @@
+"""
+Command-line interface of GTFS-GO, runs the pipeline without QGIS.
+
+    python gtfs_go_cli.py -o OUTPUT_DIR [options] FEED [FEED ...]
+
+FEED is a path or URL of GTFS zip, @FILE reads feeds from FILE, one per line.
+Feeds are processed in parallel by --workers, written files of each feed are
+printed as a JSON line.
+"""
+
+import argparse
+import importlib
+import json
+import os
+import sys
+
+
+def make_parser(output_formats: tuple) -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Export and aggregate GTFS feeds",
+        fromfile_prefix_chars="@",
+    )
+    parser.add_argument("feeds", nargs="+", help="path or URL of GTFS zip")
+    parser.add_argument("-o", "--output-dir", required=True)
+    parser.add_argument(
+        "--no-simple", action="store_true", help="skip routes and stops export"
+    )
+    parser.add_argument("--ignore-shapes", action="store_true")
+    parser.add_argument("--ignore-no-route", action="store_true")
+    parser.add_argument(
+        "--aggregate", action="store_true", help="aggregate route frequency"
+    )
+    parser.add_argument("--no-unify", action="store_true")
+    parser.add_argument("--delimiter", default="", help="stop_id delimiter")
+    parser.add_argument("--date", default="", help="filter by date, YYYYMMDD")
+    parser.add_argument(
+        "--end-date", default="", help="aggregate each date from --date, YYYYMMDD"
+    )
+    parser.add_argument("--begin-time", default="", help="HH:MM:SS")
+    parser.add_argument("--end-time", default="", help="HH:MM:SS")
+    parser.add_argument(
+        "--time-bin", type=int, default=0, help="minutes of time bins, 0 to skip"
+    )
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--format", choices=output_formats, default="GeoJSON")
+    parser.add_argument("--cache-dir", default=None)
+    parser.add_argument("--precision", type=int, default=None)
+    parser.add_argument(
+        "--simplify", type=float, default=None, help="tolerance in degrees"
+    )
+    parser.add_argument(
+        "--profile", action="store_true", help="write run_profile.prof by cProfile"
+    )
+    parser.add_argument(
+        "--tiles",
+        action="store_true",
+        help="also write aggregated layers as vector tiles to MBTiles",
+    )
+    return parser
+
+
+def main(argv=None) -> int:
+    from . import gtfs_go_pipeline
+    from .gtfs_go_calendar import date_range
+    from .gtfs_go_settings import OUTPUT_FORMATS
+
+    args = make_parser(OUTPUT_FORMATS).parse_args(argv)
+
+    dates = []
+    if args.date:
+        dates = date_range(args.date, args.end_date) if args.end_date else [args.date]
+    options = {
+        "simple": not args.no_simple,
+        "ignore_shapes": args.ignore_shapes,
+        "ignore_no_route": args.ignore_no_route,
+        "aggregate": args.aggregate,
+        "unify": not args.no_unify,
+        "delimiter": "" if args.no_unify else args.delimiter,
+        "dates": dates,
+        "begin_time": args.begin_time.replace(":", ""),
+        "end_time": args.end_time.replace(":", ""),
+        "time_bin_minutes": args.time_bin,
+        "output_format": args.format,
+        "profile": args.profile,
+        "tiles": args.tiles,
+    }
+    for key, value in (
+        ("workers", args.workers),
+        ("cache_dir", args.cache_dir),
+        ("precision", args.precision),
+        ("simplify_tolerance", args.simplify),
+    ):
+        if value is not None:
+            options[key] = value
+    params = gtfs_go_pipeline.make_params(args.output_dir, **options)
+
+    def progress(feed_info: dict, stage: str, percent: float):
+        print(f"{feed_info['group']}: {stage} {percent:.0f}%", file=sys.stderr)
+
+    failed = 0
+    feed_infos = gtfs_go_pipeline.make_feed_infos(args.feeds)
+    for feed_info, written_files, exception in gtfs_go_pipeline.run_batch(
+        feed_infos, params, progress=progress
+    ):
+        if exception is not None:
+            failed += 1
+            print(f"{feed_info['group']}: failed: {exception}", file=sys.stderr)
+            continue
+        print(json.dumps({"feed": feed_info, "written_files": written_files}))
+    return 1 if failed > 0 else 0
+
+
+if __name__ == "__main__":
+    # run as a script: import the plugin directory as a package, so that
+    # relative imports work, e.g. python GTFS-GO/gtfs_go_cli.py
+    plugin_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, os.path.dirname(plugin_dir))
+    package = importlib.import_module(os.path.basename(plugin_dir))
+    cli = importlib.import_module(package.__name__ + ".gtfs_go_cli")
+    sys.exit(cli.main())
@@ -23,11 +23,10 @@
 """
 
 import datetime
+import hashlib
+import importlib.util
 import json
 import os
-import shutil
-import tempfile
-import urllib
 import uuid
 
 from PyQt5.QtCore import *
@@ -40,29 +39,88 @@ from qgis.utils import iface
 
 from . import constants, repository
 from .gtfs_go_labeling import get_labeling_for_stops
-from .gtfs_go_renderer import Renderer
+from .gtfs_go_memory import SaveLayersTask, open_layer, release_layers
+from .gtfs_go_renderer import Renderer, apply_named_style
 from .gtfs_go_settings import (
+    AGGREGATE_IN_SUBPROCESS,
+    AGGREGATION_DATES_MAX,
+    CACHE_DIR,
+    GEOJSON_COORDINATE_PRECISION,
+    MEMORY_FORMAT,
+    OUTPUT_FORMATS,
+    PROCESSING_WORKERS,
+    PROCESSING_WORKERS_MAX,
+    SIMPLIFY_TOLERANCE_DEGREE,
     STOPS_MINIMUM_VISIBLE_SCALE,
+    TIME_BIN_MINUTES,
+    UI_CACHE_DIR,
 )
-from .gtfs_parser import gtfs_parser
+from .gtfs_go_task import GTFSGoTask
+from .gtfs_go_writer import GPKG_FILENAME, write_merged_layers
+from .repository.japan_dpf.catalog import Catalog
 from .repository.japan_dpf.table import HEADERS, HEADERS_TO_HIDE
 
 DATALIST_JSON_PATH = os.path.join(os.path.dirname(__file__), "gtfs_go_datalist.json")
-TEMP_DIR = os.path.join(tempfile.gettempdir(), "GTFSGo")
+
+UI_PATH = os.path.join(os.path.dirname(__file__), "gtfs_go_dialog_base.ui")
 
 REPOSITORY_ENUM = {"preset": 0, "japanDpf": 1}
 
 
-class GTFSGoDialog(QDialog):
+def load_form_class(ui_path: str, cache_dir=UI_CACHE_DIR):
+    """
+    form class of a .ui file, compiled to python once and imported from
+    cache_dir afterwards
+
+    Args:
+        ui_path (str): path of .ui file
+        cache_dir (str, optional): compiled modules, keyed by .ui content
+
+    Returns:
+        type: form class with setupUi(), as uic.loadUiType()
+    """
+    with open(ui_path, "rb") as f:
+        content = f.read()
+    # generated code depends on the version of PyQt too
+    digest = hashlib.sha256(content + PYQT_VERSION_STR.encode()).hexdigest()
+    module_name = os.path.splitext(os.path.basename(ui_path))[0] + "_" + digest[:16]
+    module_path = os.path.join(cache_dir, module_name + ".py")
+    if not os.path.exists(module_path):
+        tmp_path = module_path + "." + uuid.uuid4().hex
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(tmp_path, mode="w", encoding="utf-8") as f:
+                uic.compileUi(ui_path, f)
+            os.replace(tmp_path, module_path)
+        except OSError:
+            # e.g. read-only home directory
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return uic.loadUiType(ui_path)[0]
+    spec = importlib.util.spec_from_file_location(module_name, module_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return next(value for name, value in vars(module).items() if name.startswith("Ui_"))
+
+
+class GTFSGoDialog(QDialog, load_form_class(UI_PATH)):
     def __init__(self, iface):
         """Constructor."""
         super().__init__()
-        self.ui = uic.loadUi(
-            os.path.join(os.path.dirname(__file__), "gtfs_go_dialog_base.ui"), self
-        )
+        self.setupUi(self)
+        # widgets are attributes of the dialog itself, as with uic.loadUi()
+        self.ui = self
         with open(DATALIST_JSON_PATH, encoding="utf-8") as f:
             self.datalist = json.load(f)
         self.iface = iface
+        # running background tasks, kept referenced until they finish
+        self.tasks = []
+        # tasks waiting for a free worker
+        self.pending_tasks = []
+        # written_files of completed feeds by name, to be shown merged
+        self.merged_feeds = {}
+        # saving memory layers, kept referenced until they finish
+        self.save_tasks = []
         self.combobox_zip_text = self.tr("---Load local ZipFile---")
         self.init_gui()
 
@@ -86,6 +144,10 @@ class GTFSGoDialog(QDialog):
         self.ui.outputDirFileWidget.fileChanged.connect(self.refresh)
         self.ui.unifyCheckBox.stateChanged.connect(self.refresh)
         self.ui.timeFilterCheckBox.stateChanged.connect(self.refresh)
+        self.ui.filterByDateCheckBox.stateChanged.connect(self.refresh)
+        self.ui.timeBinCheckBox.stateChanged.connect(self.refresh)
+        self.ui.filterByDateRangeCheckBox.stateChanged.connect(self.refresh)
+        self.ui.filterByDateDateEdit.dateChanged.connect(self.refresh)
         self.ui.simpleCheckbox.clicked.connect(self.refresh)
         self.ui.aggregateCheckbox.clicked.connect(self.refresh)
 
@@ -100,6 +162,19 @@ class GTFSGoDialog(QDialog):
         # set today DateEdit
         now = datetime.datetime.now()
         self.ui.filterByDateDateEdit.setDate(QDate(now.year, now.month, now.day))
+        self.ui.filterByDateEndDateEdit.setDate(QDate(now.year, now.month, now.day))
+
+        self.ui.timeBinSpinBox.setValue(TIME_BIN_MINUTES)
+
+        for output_format in OUTPUT_FORMATS:
+            self.ui.outputFormatComboBox.addItem(output_format, output_format)
+        self.ui.outputFormatComboBox.addItem(
+            self.tr("Memory (no files)"), MEMORY_FORMAT
+        )
+        self.ui.outputFormatComboBox.currentIndexChanged.connect(self.refresh)
+
+        self.ui.workersSpinBox.setMaximum(PROCESSING_WORKERS_MAX)
+        self.ui.workersSpinBox.setValue(PROCESSING_WORKERS)
 
         self.refresh()
 
@@ -135,6 +210,12 @@ class GTFSGoDialog(QDialog):
 
         self.japanDpfSearchButton.clicked.connect(self.japan_dpf_search)
 
+        # local catalog for offline search
+        self.japan_dpf_catalog = Catalog()
+        self.japan_dpf_sync_task = None
+        self.japanDpfOfflineCheckBox.setChecked(self.japan_dpf_catalog.exists())
+        self.japanDpfSyncButton.clicked.connect(self.japan_dpf_sync)
+
     def make_combobox_text(self, data):
         """
         parse data to combobox-text
@@ -153,15 +234,6 @@ class GTFSGoDialog(QDialog):
         """
         return "[" + data["country"] + "]" + "[" + data["region"] + "]" + data["name"]
 
-    def download_zip(self, url: str) -> str:
-        data = urllib.request.urlopen(url).read()
-        download_path = os.path.join(TEMP_DIR, str(uuid.uuid4()) + ".zip")
-        with open(download_path, mode="wb") as f:
-            f.write(data)
-
-        return download_path
-
-
     def get_target_feed_infos(self):
         feed_infos = []
         if self.repositoryCombobox.currentData() == REPOSITORY_ENUM["preset"]:
@@ -201,121 +273,104 @@ class GTFSGoDialog(QDialog):
                         + row_data["feed_id"]
                         + "-"
                         + row_data["file_uid"],
+                        # cached download is reused while this is unchanged
+                        "version": str(row_data["file_uid"])
+                        + "-"
+                        + str(row_data["file_last_updated_at"]),
                     }
                 )
         return feed_infos
 
-    def execution(self):
-        if os.path.exists(TEMP_DIR):
-            shutil.rmtree(TEMP_DIR)
-        os.makedirs(TEMP_DIR, exist_ok=True)
+    def get_params(self) -> dict:
+        return {
+            "output_dir": self.outputDirFileWidget.filePath(),
+            "simple": self.ui.simpleCheckbox.isChecked(),
+            "ignore_shapes": self.ui.ignoreShapesCheckbox.isChecked(),
+            "ignore_no_route": self.ui.ignoreNoRouteStopsCheckbox.isChecked(),
+            "aggregate": self.ui.aggregateCheckbox.isChecked(),
+            "unify": self.ui.unifyCheckBox.isChecked(),
+            "delimiter": self.get_delimiter(),
+            "yyyymmdd": self.get_yyyymmdd(),
+            "dates": self.get_dates(),
+            "begin_time": self.get_time_filter(self.ui.beginTimeLineEdit),
+            "end_time": self.get_time_filter(self.ui.endTimeLineEdit),
+            "time_bin_minutes": self.get_time_bin_minutes(),
+            "workers": self.ui.workersSpinBox.value(),
+            "aggregate_in_subprocess": AGGREGATE_IN_SUBPROCESS,
+            "cache_dir": CACHE_DIR,
+            "precision": GEOJSON_COORDINATE_PRECISION,
+            "simplify_tolerance": SIMPLIFY_TOLERANCE_DEGREE,
+            "output_format": self.ui.outputFormatComboBox.currentData(),
+            "profile": self.ui.profileCheckBox.isChecked(),
+            "merge_layers": self.ui.mergeLayersCheckBox.isChecked(),
+            "save_memory_layers": self.ui.saveMemoryLayersCheckBox.isChecked(),
+            "tiles": self.ui.tilesCheckBox.isChecked(),
+            "scale_stop_size": self.ui.scaleStopSizeCheckBox.isChecked(),
+        }
 
+    def execution(self):
+        # widgets must not be touched from worker threads: read them here
+        params = self.get_params()
         for feed_info in self.get_target_feed_infos():
-            if feed_info["path"].startswith("http"):
-                feed_info["path"] = self.download_zip(feed_info["path"])
+            task = GTFSGoTask(feed_info, params)
+            task.taskCompleted.connect(lambda task=task: self.on_task_completed(task))
+            task.taskTerminated.connect(lambda task=task: self.on_task_terminated(task))
+            self.pending_tasks.append(task)
+        self.start_pending_tasks(params["workers"])
 
-            output_dir = os.path.join(
-                self.outputDirFileWidget.filePath(), feed_info["dir"]
+        self.iface.messageBar().pushInfo(
+            self.tr("GTFS GO"), self.tr("processing started in background")
+        )
+        self.ui.close()
+
+    def start_pending_tasks(self, workers: int):
+        # bound the number of feeds processed at once
+        while self.pending_tasks and len(self.tasks) < workers:
+            task = self.pending_tasks.pop(0)
+            self.tasks.append(task)
+            QgsApplication.taskManager().addTask(task)
+
+    def on_task_completed(self, task: GTFSGoTask):
+        self.tasks.remove(task)
+        self.start_pending_tasks(task.params["workers"])
+        is_memory = task.params["output_format"] == MEMORY_FORMAT
+        if task.params["merge_layers"] and not is_memory:
+            # shown with the other feeds once all of them finished
+            self.merged_feeds[task.feed_info["group"]] = task.written_files
+            task.log_report()
+            self.show_merged_layers(task.params)
+            return
+        with task.report.stage("layers"):
+            layers = self.show_geojson(
+                task.feed_info["group"], task.written_files, task.params
             )
-            os.makedirs(output_dir, exist_ok=True)
-
-            written_files = {
-                "routes": "",
-                "stops": "",
-                "aggregated_routes": "",
-                "aggregated_stops": "",
-                "aggregated_csv": "",
-            }
-
-            gtfs = gtfs_parser.GTFS(feed_info["path"])
-
-            if self.ui.simpleCheckbox.isChecked():
-                routes_geojson = {
-                    "type": "FeatureCollection",
-                    "features": gtfs_parser.parse.read_routes(
-                        gtfs, ignore_shapes=self.ui.ignoreShapesCheckbox.isChecked()
-                    ),
-                }
-                stops_geojson = {
-                    "type": "FeatureCollection",
-                    "features": gtfs_parser.parse.read_stops(
-                        gtfs,
-                        ignore_no_route=self.ui.ignoreNoRouteStopsCheckbox.isChecked(),
-                    ),
-                }
-                # write
-                written_files["routes"] = os.path.join(output_dir, "routes.geojson")
-                written_files["stops"] = os.path.join(output_dir, "stops.geojson")
-                with open(
-                    written_files["routes"],
-                    mode="w",
-                    encoding="utf-8",
-                ) as f:
-                    json.dump(routes_geojson, f, ensure_ascii=False)
-
-                with open(
-                    written_files["stops"],
-                    mode="w",
-                    encoding="utf-8",
-                ) as f:
-                    json.dump(stops_geojson, f, ensure_ascii=False)
-
-            if self.ui.aggregateCheckbox.isChecked():
-                aggregator = gtfs_parser.aggregate.Aggregator(
-                    gtfs,
-                    no_unify_stops=not self.ui.unifyCheckBox.isChecked(),
-                    delimiter=self.get_delimiter(),
-                    yyyymmdd=self.get_yyyymmdd(),
-                    begin_time=self.get_time_filter(self.ui.beginTimeLineEdit),
-                    end_time=self.get_time_filter(self.ui.endTimeLineEdit),
-                )
-                aggregated_routes_geojson = {
-                    "type": "FeatureCollection",
-                    "features": aggregator.read_route_frequency(),
-                }
-                aggregated_stops_geojson = {
-                    "type": "FeatureCollection",
-                    "features": aggregator.read_interpolated_stops(),
-                }
-
-                # write
-                written_files["aggregated_routes"] = os.path.join(
-                    output_dir, "aggregated_routes.geojson"
-                )
-                written_files["aggregated_stops"] = os.path.join(
-                    output_dir, "aggregated_stops.geojson"
-                )
-                written_files["aggregated_csv"] = os.path.join(output_dir, "result.csv")
-                with open(
-                    written_files["aggregated_stops"],
-                    mode="w",
-                    encoding="utf-8",
-                ) as f:
-                    json.dump(aggregated_stops_geojson, f, ensure_ascii=False)
-                with open(
-                    written_files["aggregated_routes"],
-                    mode="w",
-                    encoding="utf-8",
-                ) as f:
-                    json.dump(aggregated_routes_geojson, f, ensure_ascii=False)
-                with open(
-                    written_files["aggregated_csv"],
-                    mode="w",
-                    encoding="cp932",
-                    errors="ignore",
-                ) as f:
-                    aggregator.gtfs["stops"][
-                        ["stop_id", "stop_name", "similar_stop_id", "similar_stop_name"]
-                    ].to_csv(f, index=False)
-
-            self.show_geojson(
-                feed_info["group"],
-                written_files["stops"],
-                written_files["routes"],
-                written_files["aggregated_stops"],
-                written_files["aggregated_routes"],
-                written_files["aggregated_csv"],
+        if is_memory and task.params["save_memory_layers"]:
+            self.save_memory_layers(
+                layers,
+                os.path.join(
+                    task.params["output_dir"], task.feed_info["dir"], GPKG_FILENAME
+                ),
             )
+        if task.written_files["run_report"]:
+            try:
+                # rewritten with the layers stage
+                task.report.write(os.path.dirname(task.written_files["run_report"]))
+            except OSError:
+                pass
+        task.log_report()
+
+    def on_task_terminated(self, task: GTFSGoTask):
+        self.tasks.remove(task)
+        self.start_pending_tasks(task.params["workers"])
+        self.show_merged_layers(task.params)
+        release_layers(os.path.join(task.params["output_dir"], task.feed_info["dir"]))
+        if task.exception is None:
+            # canceled by user
+            return
+        self.iface.messageBar().pushCritical(
+            self.tr("Error"),
+            task.feed_info["group"] + ": " + str(task.exception),
+        )
 
     def get_yyyymmdd(self):
         if not self.ui.filterByDateCheckBox.isChecked():
@@ -326,6 +381,22 @@ class GTFSGoDialog(QDialog):
         dd = str(date.day()).zfill(2)
         return yyyy + mm + dd
 
+    def get_dates(self) -> list:
+        """
+        Returns:
+            list: yyyymmdd of each date of the range, or of the single date
+        """
+        yyyymmdd = self.get_yyyymmdd()
+        if yyyymmdd == "" or not self.ui.filterByDateRangeCheckBox.isChecked():
+            return [yyyymmdd] if yyyymmdd else []
+        date = self.ui.filterByDateDateEdit.date()
+        end_date = self.ui.filterByDateEndDateEdit.date()
+        dates = []
+        while date <= end_date:
+            dates.append(date.toString("yyyyMMdd"))
+            date = date.addDays(1)
+        return dates
+
     def get_delimiter(self):
         if not self.ui.unifyCheckBox.isChecked():
             return ""
@@ -338,100 +409,241 @@ class GTFSGoDialog(QDialog):
             return ""
         return lineEdit.text().replace(":", "")
 
-    def show_geojson(
-        self,
-        group_name: str,
-        stops_geojson: str,
-        routes_geojson: str,
-        aggregated_stops_geojson: str,
-        aggregated_routes_geojson: str,
-        aggregated_csv: str,
-    ):
-        root = QgsProject().instance().layerTreeRoot()
-        group = root.insertGroup(0, group_name)
-        group.setExpanded(True)
-
-        if routes_geojson != "":
-            routes_vlayer = QgsVectorLayer(
-                routes_geojson, os.path.basename(routes_geojson).split(".")[0], "ogr"
-            )
-            routes_renderer = Renderer(routes_vlayer, "route_name")
-            routes_vlayer.setRenderer(routes_renderer.make_renderer())
+    def get_time_bin_minutes(self) -> int:
+        if not self.ui.timeBinCheckBox.isChecked():
+            return 0
+        return self.ui.timeBinSpinBox.value()
 
-            QgsProject.instance().addMapLayer(routes_vlayer, False)
-            group.insertLayer(0, routes_vlayer)
+    def show_geojson(self, group_name: str, written_files: dict, params: dict):
+        """
+        add layers of written files to a new group, registered to the project
+        at once while the canvas is frozen
 
-        if stops_geojson != "":
-            stops_vlayer = QgsVectorLayer(
-                stops_geojson, os.path.basename(stops_geojson).split(".")[0], "ogr"
-            )
-            # make and set labeling for stops
-            stops_labeling = get_labeling_for_stops("stop_names")
-            stops_vlayer.setLabelsEnabled(True)
-            stops_vlayer.setLabeling(stops_labeling)
-
-            # adjust layer visibility
-            stops_vlayer.setMinimumScale(STOPS_MINIMUM_VISIBLE_SCALE)
-            stops_vlayer.setScaleBasedVisibility(True)
-
-            stops_renderer = Renderer(stops_vlayer, "stop_name")
-            stops_vlayer.setRenderer(stops_renderer.make_renderer())
-
-            QgsProject.instance().addMapLayer(stops_vlayer, False)
-            group.insertLayer(0, stops_vlayer)
-
-        if aggregated_routes_geojson != "":
-            aggregated_routes_vlayer = QgsVectorLayer(
-                aggregated_routes_geojson,
-                os.path.basename(aggregated_routes_geojson).split(".")[0],
-                "ogr",
-            )
-            aggregated_routes_vlayer.loadNamedStyle(
-                os.path.join(os.path.dirname(__file__), "aggregated_routes.qml")
-            )
+        Args:
+            group_name (str): name of the layer tree group
+            written_files (dict): of run(), or of write_merged_layers()
+            params (dict): of get_params() when the run was queued
 
-            QgsProject.instance().addMapLayer(aggregated_routes_vlayer, False)
-            group.insertLayer(0, aggregated_routes_vlayer)
+        Returns:
+            list: added layers
+        """
+        layers = self.make_layers(written_files, params)
+        self.add_layers_to_group(group_name, layers)
+
+        messages = {
+            "GeoJSON": self.tr("generated geojson files: "),
+            "GPKG": self.tr("generated GeoPackage layers: "),
+            "FlatGeobuf": self.tr("generated FlatGeobuf files: "),
+            MEMORY_FORMAT: self.tr("generated memory layers: "),
+        }
+        self.iface.messageBar().pushInfo(
+            self.tr("finish"),
+            messages.get(params["output_format"], self.tr("generated layers: "))
+            + group_name,
+        )
+        return [layer for _, layer in layers]
 
-        if aggregated_stops_geojson != "":
-            aggregated_stops_vlayer = QgsVectorLayer(
-                aggregated_stops_geojson,
-                os.path.basename(aggregated_stops_geojson).split(".")[0],
-                "ogr",
-            )
-            aggregated_stops_vlayer.loadNamedStyle(
-                os.path.join(os.path.dirname(__file__), "aggregated_stops.qml")
-            )
+    def make_layers(self, written_files: dict, params: dict) -> list:
+        """
+        Returns:
+            list: (date of sub group or "", layer), top to bottom of the group
+        """
+        kinds = []
+        for kind in (
+            "aggregated_csv",
+            "aggregated_tiles",
+            "time_bins_stops",
+            "time_bins_routes",
+        ):
+            kinds.append(("", kind, written_files.get(kind, "")))
+        for yyyymmdd, date_files in sorted(
+            written_files.get("aggregated_dates", {}).items()
+        ):
+            for kind in (
+                "aggregated_tiles",
+                "time_bins_stops",
+                "time_bins_routes",
+                "aggregated_stops",
+                "aggregated_routes",
+            ):
+                kinds.append((yyyymmdd, kind, date_files.get(kind, "")))
+        for kind in ("aggregated_stops", "aggregated_routes", "stops", "routes"):
+            kinds.append(("", kind, written_files.get(kind, "")))
+        return [
+            (yyyymmdd, self.make_layer(kind, uri, params))
+            for yyyymmdd, kind, uri in kinds
+            if uri != ""
+        ]
+
+    def add_layers_to_group(self, group_name: str, layers: list):
+        """
+        Args:
+            layers (list): of make_layers(), added to a new group at the top
+        """
+        canvas = self.iface.mapCanvas()
+        # not to redraw the canvas on each layer
+        canvas.freeze(True)
+        try:
+            QgsProject.instance().addMapLayers([layer for _, layer in layers], False)
+            root = QgsProject().instance().layerTreeRoot()
+            group = root.insertGroup(0, group_name)
+            group.setExpanded(True)
+            date_groups = {}
+            for yyyymmdd, layer in layers:
+                if yyyymmdd == "":
+                    group.addLayer(layer)
+                    continue
+                if yyyymmdd not in date_groups:
+                    date_groups[yyyymmdd] = group.addGroup(yyyymmdd)
+                date_groups[yyyymmdd].addLayer(layer)
+        finally:
+            canvas.freeze(False)
+            canvas.refresh()
+
+    def show_merged_layers(self, params: dict):
+        """layers of completed feeds merged by kind, once no feed is left"""
+        if self.tasks or self.pending_tasks or not self.merged_feeds:
+            return
+        feeds = self.merged_feeds
+        self.merged_feeds = {}
+        try:
+            written_files = write_merged_layers(params["output_dir"], feeds)
+        except OSError as e:
+            self.iface.messageBar().pushCritical(self.tr("Error"), str(e))
+            return
+        self.show_geojson(self.tr("merged feeds"), written_files, params)
 
-            scale_stop_size = self.ui.scaleStopSizeCheckBox.isChecked()
-            dd_props = (
-                aggregated_stops_vlayer.renderer()
-                .symbol()
-                .symbolLayers()[0]
-                .dataDefinedProperties()
-            )
-            if dd_props.hasProperty(QgsSymbolLayer.PropertySize):
-                dd_props.property(QgsSymbolLayer.PropertySize).setActive(
-                    scale_stop_size
-                )
+    def save_memory_layers(self, layers: list, path: str):
+        """
+        save memory layers to a GeoPackage in the background, other layers
+        e.g. vector tiles of MBTiles are already files
+        """
+        layers = [
+            layer
+            for layer in layers
+            if isinstance(layer, QgsVectorLayer) and layer.providerType() == "memory"
+        ]
+        if not layers:
+            return
+        task = SaveLayersTask(layers, path)
+        task.taskCompleted.connect(lambda task=task: self.save_tasks.remove(task))
+        task.taskTerminated.connect(lambda task=task: self.save_tasks.remove(task))
+        self.save_tasks.append(task)
+        QgsApplication.taskManager().addTask(task)
+
+    def make_layer(self, kind: str, uri: str, params: dict) -> QgsMapLayer:
+        """styled layer of a kind of written_files"""
+        make = {
+            "routes": self.make_routes_layer,
+            "stops": self.make_stops_layer,
+            "aggregated_routes": self.make_aggregated_routes_layer,
+            "aggregated_stops": lambda uri: self.make_aggregated_stops_layer(
+                uri, params["scale_stop_size"]
+            ),
+            "time_bins_routes": self.make_time_bins_layer,
+            "time_bins_stops": self.make_time_bins_layer,
+            "aggregated_tiles": self.make_tiles_layer,
+        }.get(kind)
+        if make is None:
+            return open_layer(uri)
+        return make(uri)
 
-            QgsProject.instance().addMapLayer(aggregated_stops_vlayer, False)
-            group.insertLayer(0, aggregated_stops_vlayer)
+    @staticmethod
+    def make_routes_layer(uri: str) -> QgsVectorLayer:
+        routes_vlayer = open_layer(uri)
+        routes_renderer = Renderer(routes_vlayer, "route_name")
+        routes_vlayer.setRenderer(routes_renderer.make_renderer())
+        return routes_vlayer
 
-        if aggregated_csv != "":
-            aggregated_csv_vlayer = QgsVectorLayer(
-                aggregated_csv,
-                os.path.basename(aggregated_csv).split(".")[0],
-                "ogr",
-            )
+    @staticmethod
+    def make_stops_layer(uri: str) -> QgsVectorLayer:
+        stops_vlayer = open_layer(uri)
+        # make and set labeling for stops
+        stops_labeling = get_labeling_for_stops("stop_names")
+        stops_vlayer.setLabelsEnabled(True)
+        stops_vlayer.setLabeling(stops_labeling)
+
+        # adjust layer visibility
+        stops_vlayer.setMinimumScale(STOPS_MINIMUM_VISIBLE_SCALE)
+        stops_vlayer.setScaleBasedVisibility(True)
+
+        stops_renderer = Renderer(stops_vlayer, "stop_name")
+        stops_vlayer.setRenderer(stops_renderer.make_renderer())
+        return stops_vlayer
+
+    def make_aggregated_routes_layer(self, uri: str) -> QgsVectorLayer:
+        aggregated_routes_vlayer = open_layer(uri)
+        apply_named_style(
+            aggregated_routes_vlayer,
+            os.path.join(os.path.dirname(__file__), "aggregated_routes.qml"),
+        )
+        return aggregated_routes_vlayer
 
-            QgsProject.instance().addMapLayer(aggregated_csv_vlayer, False)
-            group.insertLayer(0, aggregated_csv_vlayer)
+    @staticmethod
+    def make_aggregated_stops_layer(uri: str, scale_stop_size: bool) -> QgsVectorLayer:
+        aggregated_stops_vlayer = open_layer(uri)
+        apply_named_style(
+            aggregated_stops_vlayer,
+            os.path.join(os.path.dirname(__file__), "aggregated_stops.qml"),
+        )
 
-        self.iface.messageBar().pushInfo(
-            self.tr("finish"), self.tr("generated geojson files: ")
+        dd_props = (
+            aggregated_stops_vlayer.renderer()
+            .symbol()
+            .symbolLayers()[0]
+            .dataDefinedProperties()
         )
-        self.ui.close()
+        if dd_props.hasProperty(QgsSymbolLayer.PropertySize):
+            dd_props.property(QgsSymbolLayer.PropertySize).setActive(scale_stop_size)
+        return aggregated_stops_vlayer
+
+    @staticmethod
+    def make_tiles_layer(path: str) -> QgsVectorTileLayer:
+        tiles_vlayer = QgsVectorTileLayer(
+            "type=mbtiles&url=" + path, os.path.splitext(os.path.basename(path))[0]
+        )
+        # width of routes and size of stops by frequency, as the QML styles
+        routes_symbol = QgsSymbol.defaultSymbol(QgsWkbTypes.LineGeometry)
+        routes_symbol.symbolLayer(0).setDataDefinedProperty(
+            QgsSymbolLayer.PropertyStrokeWidth,
+            QgsProperty.fromExpression(
+                'coalesce(scale_linear("frequency", 0, 300, 0.2, 3), 0.2)'
+            ),
+        )
+        routes_style = QgsVectorTileBasicRendererStyle(
+            "aggregated_routes", "aggregated_routes", QgsWkbTypes.LineGeometry
+        )
+        routes_style.setSymbol(routes_symbol)
+        stops_symbol = QgsSymbol.defaultSymbol(QgsWkbTypes.PointGeometry)
+        stops_symbol.symbolLayer(0).setDataDefinedProperty(
+            QgsSymbolLayer.PropertySize,
+            QgsProperty.fromExpression(
+                'coalesce(scale_linear("count", 0, 500, 1, 5), 1)'
+            ),
+        )
+        stops_style = QgsVectorTileBasicRendererStyle(
+            "aggregated_stops", "aggregated_stops", QgsWkbTypes.PointGeometry
+        )
+        stops_style.setSymbol(stops_symbol)
+        renderer = QgsVectorTileBasicRenderer()
+        renderer.setStyles([routes_style, stops_style])
+        tiles_vlayer.setRenderer(renderer)
+        return tiles_vlayer
+
+    @staticmethod
+    def make_time_bins_layer(uri: str) -> QgsVectorLayer:
+        time_bins_vlayer = open_layer(uri)
+        if not hasattr(time_bins_vlayer, "temporalProperties"):
+            # temporal controller is available on QGIS 3.14 or later
+            return time_bins_vlayer
+        temporal_properties = time_bins_vlayer.temporalProperties()
+        temporal_properties.setMode(
+            QgsVectorLayerTemporalProperties.ModeFeatureDateTimeStartAndEndFromExpressions
+        )
+        temporal_properties.setStartExpression('to_datetime("time_begin")')
+        temporal_properties.setEndExpression('to_datetime("time_end")')
+        temporal_properties.setIsActive(True)
+        return time_bins_vlayer
 
     def refresh(self):
         self.localDataSelectAreaWidget.setVisible(
@@ -468,10 +680,27 @@ class GTFSGoDialog(QDialog):
         has_time_filter = self.ui.timeFilterCheckBox.isChecked()
         self.ui.beginTimeLineEdit.setEnabled(has_time_filter)
         self.ui.endTimeLineEdit.setEnabled(has_time_filter)
+        self.ui.timeBinSpinBox.setEnabled(self.ui.timeBinCheckBox.isChecked())
+
+        # filter by date or date range mode
+        has_date_filter = self.ui.filterByDateCheckBox.isChecked()
+        self.ui.filterByDateDateEdit.setEnabled(has_date_filter)
+        self.ui.filterByDateRangeCheckBox.setEnabled(has_date_filter)
+        self.ui.filterByDateEndDateEdit.setEnabled(
+            has_date_filter and self.ui.filterByDateRangeCheckBox.isChecked()
+        )
+        begin_date = self.ui.filterByDateDateEdit.date()
+        self.ui.filterByDateEndDateEdit.setDateRange(
+            begin_date, begin_date.addDays(AGGREGATION_DATES_MAX - 1)
+        )
 
         # mode toggle
         self.ui.simpleFrame.setEnabled(self.ui.simpleCheckbox.isChecked())
         self.ui.freqFrame.setEnabled(self.ui.aggregateCheckbox.isChecked())
+        is_memory = self.ui.outputFormatComboBox.currentData() == MEMORY_FORMAT
+        self.ui.saveMemoryLayersCheckBox.setEnabled(is_memory)
+        # memory layers are not merged, VRT reads files only
+        self.ui.mergeLayersCheckBox.setEnabled(not is_memory)
 
     @staticmethod
     def validate_time_lineedit(lineedit):
@@ -513,28 +742,80 @@ class GTFSGoDialog(QDialog):
             )
         )
 
-        try:
-            results = repository.japan_dpf.api.get_feeds(
-                f"{yyyy}-{mm}-{dd}",
-                extent=extent,
-                pref=pref_code,
-            )
-            self.japan_dpf_set_table(results)
-        except Exception as e:
-            QMessageBox.information(
-                self,
-                self.tr("Error"),
-                self.tr(
-                    "Error occured, please check:\n- Internet connection.\n- Repository-server"
+        if self.japanDpfOfflineCheckBox.isChecked():
+            self.on_japan_dpf_search_finished(
+                self.japan_dpf_catalog.get_feeds(
+                    f"{yyyy}-{mm}-{dd}",
+                    extent=extent,
+                    pref=pref_code,
                 )
-                + "\n\n"
-                + e,
             )
+            return
+
+        repository.japan_dpf.api.get_feeds_async(
+            self.on_japan_dpf_search_finished,
+            self.on_japan_dpf_search_failed,
+            f"{yyyy}-{mm}-{dd}",
+            extent=extent,
+            pref=pref_code,
+        )
+
+    def on_japan_dpf_search_finished(self, results: list):
+        try:
+            self.japan_dpf_set_table(results)
         finally:
             self.japanDpfSearchButton.setEnabled(True)
             self.japanDpfSearchButton.setText(self.tr("Search"))
             self.refresh()
 
+    def on_japan_dpf_search_failed(self, e: Exception):
+        QMessageBox.information(
+            self,
+            self.tr("Error"),
+            self.tr(
+                "Error occured, please check:\n- Internet connection.\n- Repository-server"
+            )
+            + "\n\n"
+            + str(e),
+        )
+        self.japanDpfSearchButton.setEnabled(True)
+        self.japanDpfSearchButton.setText(self.tr("Search"))
+        self.refresh()
+
+    def japan_dpf_sync(self):
+        self.japanDpfSyncButton.setEnabled(False)
+        self.japanDpfSyncButton.setText(self.tr("Syncing..."))
+        self.japan_dpf_sync_task = QgsTask.fromFunction(
+            self.tr("GTFS GO: sync Japan DPF catalog"),
+            lambda task: self.japan_dpf_catalog.sync(is_canceled=task.isCanceled),
+            on_finished=self.on_japan_dpf_sync_finished,
+        )
+        QgsApplication.taskManager().addTask(self.japan_dpf_sync_task)
+
+    def on_japan_dpf_sync_finished(self, exception, result=None):
+        self.japan_dpf_sync_task = None
+        self.japanDpfSyncButton.setEnabled(True)
+        self.japanDpfSyncButton.setText(self.tr("Sync catalog"))
+        if exception is not None:
+            self.on_japan_dpf_search_failed(exception)
+            return
+        self.japanDpfOfflineCheckBox.setChecked(True)
+        updated, failed = result
+        if failed:
+            # retried by the next sync
+            self.iface.messageBar().pushWarning(
+                self.tr("finish"),
+                self.tr("updated feeds in catalog: ")
+                + str(updated)
+                + self.tr(", stops not fetched, retried on next sync: ")
+                + str(failed),
+            )
+            return
+        self.iface.messageBar().pushInfo(
+            self.tr("finish"),
+            self.tr("updated feeds in catalog: ") + str(updated),
+        )
+
     def japan_dpf_set_table(self, results: list):
         # replace pref code to pref name
         for result in results:
@@ -0,0 +1,404 @@
+"""
+Lazy loading of GTFS tables with an on-disk cache of parsed tables.
+
+GTFSFeed behaves like the dict returned by gtfs_parser.GTFS() but reads a
+table from the zip only when it is first accessed. Parsed tables are written
+in a binary columnar format (Feather when pyarrow is installed, pickle
+otherwise) under <cache_dir>/<sha256 of zip> and read from there next time.
+
+Members are parsed straight from the zip stream, by the multithreaded Arrow
+CSV reader when pyarrow is installed. Otherwise large members are split at
+line ends into chunks parsed by pandas in threads. preload() parses several
+members at once.
+"""
+
+import copy
+import csv
+import hashlib
+import io
+import os
+import shutil
+import uuid
+import zipfile
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from .gtfs_go_settings import INGEST_WORKERS
+
+try:
+    import pyarrow
+    import pyarrow.csv
+    import pyarrow.ipc
+
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+HASH_CHUNK_SIZE = 1024 * 1024
+# members smaller than this are parsed by pandas in one piece
+CSV_CHUNK_MIN_BYTES = 16 * 1024 * 1024
+# block of the Arrow CSV reader, parsed by a thread each
+ARROW_BLOCK_SIZE = 8 * 1024 * 1024
+
+# casts applied by gtfs_parser.GTFS(), other columns are kept as str
+TABLE_DTYPES = {
+    "stops": {"stop_lon": float, "stop_lat": float},
+    "stop_times": {"stop_sequence": int},
+    "shapes": {
+        "shape_pt_lon": float,
+        "shape_pt_lat": float,
+        "shape_pt_sequence": int,
+    },
+}
+
+# compact dtypes for consumers in this plugin, see GTFSFeed.table()
+COMPACT_INT_COLUMNS = ("stop_sequence", "shape_pt_sequence", "direction_id")
+COMPACT_TIME_COLUMNS = ("arrival_time", "departure_time")
+
+
+def file_sha256(path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, mode="rb") as f:
+        while True:
+            chunk = f.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def time_to_seconds(times: pd.Series) -> pd.Series:
+    """HH:MM:SS, hours may exceed 24, to int32 seconds from midnight, -1 if blank"""
+    # a feed has far fewer distinct times than stop times: parse each once
+    codes, uniques = pd.factorize(times)
+    hms = pd.Series(uniques, dtype=str).str.strip().str.split(":", expand=True)
+    if hms.shape[1] < 3:
+        return pd.Series(-1, index=times.index, dtype="int32")
+    hms = hms.apply(pd.to_numeric, errors="coerce")
+    seconds = (hms[0] * 3600 + hms[1] * 60 + hms[2]).fillna(-1).astype("int32")
+    # code -1 of missing values picks the appended -1
+    seconds = np.append(seconds.values, np.int32(-1))[codes]
+    return pd.Series(seconds, index=times.index, dtype="int32")
+
+
+def read_header(z: zipfile.ZipFile, member: str) -> list:
+    with z.open(member) as f:
+        line = io.TextIOWrapper(f, encoding="utf-8-sig", newline="").readline()
+    return next(csv.reader([line]), [])
+
+
+def has_rows(z: zipfile.ZipFile, member: str) -> bool:
+    """whether a member has a line after its header, gtfs_parser skips it if not"""
+    with z.open(member) as f:
+        lines = io.TextIOWrapper(f, encoding="utf-8-sig", newline="")
+        lines.readline()
+        # blank lines are skipped by read_csv as well
+        return any(line.strip() for line in lines)
+
+
+def read_csv_arrow(z: zipfile.ZipFile, member: str, columns=None) -> pd.DataFrame:
+    """
+    parse a member by the Arrow CSV reader, every column as string and empty
+    fields as null like pandas.read_csv(dtype=str)
+    """
+    header = read_header(z, member)
+    if columns is not None:
+        # missing columns are skipped, as usecols of pandas
+        header = [c for c in header if c in columns]
+    with z.open(member) as f:
+        # blocks are split at line ends: raises on line ends in quoted fields
+        table = pyarrow.csv.read_csv(
+            f,
+            read_options=pyarrow.csv.ReadOptions(
+                use_threads=True, block_size=ARROW_BLOCK_SIZE, encoding="utf-8"
+            ),
+            convert_options=pyarrow.csv.ConvertOptions(
+                column_types={c: pyarrow.string() for c in header},
+                include_columns=header,
+                strings_can_be_null=True,
+            ),
+        )
+    return table.to_pandas()
+
+
+def split_lines(data: bytes, n: int) -> list:
+    """
+    Returns:
+        list: (begin, end) of n or fewer ranges of data after the header line,
+            each ending at a line end
+    """
+    begin = data.find(b"\n") + 1
+    if begin == 0:
+        return []
+    size = (len(data) - begin) // n + 1
+    ranges = []
+    while begin < len(data):
+        end = data.find(b"\n", min(begin + size, len(data) - 1))
+        end = len(data) if end < 0 else end + 1
+        ranges.append((begin, end))
+        begin = end
+    return ranges
+
+
+def read_csv_chunked(data: bytes, columns=None, workers=INGEST_WORKERS):
+    """
+    parse CSV bytes by pandas, in chunks on threads when large
+
+    Args:
+        data (bytes): whole member with its header line
+        columns (list, optional): columns to read, all if None
+        workers (int, optional): number of chunks parsed at once
+    """
+
+    def parse(chunk: bytes) -> pd.DataFrame:
+        return pd.read_csv(
+            io.BytesIO(chunk),
+            dtype=str,
+            encoding="utf-8-sig",
+            usecols=None if columns is None else lambda c: c in columns,
+        )
+
+    # quoted fields may contain line ends: split only when nothing is quoted
+    if workers < 2 or len(data) < CSV_CHUNK_MIN_BYTES or b'"' in data:
+        return parse(data)
+
+    ranges = split_lines(data, workers)
+    if len(ranges) < 2:
+        return parse(data)
+    header = data[: ranges[0][0]]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # the tokenizer of pandas releases the GIL
+        chunks = list(executor.map(lambda r: parse(header + data[r[0] : r[1]]), ranges))
+    return pd.concat(chunks, ignore_index=True)
+
+
+def apply_table_dtypes(df: pd.DataFrame, name: str) -> pd.DataFrame:
+    return df.astype(
+        {
+            column: dtype
+            for column, dtype in TABLE_DTYPES.get(name, {}).items()
+            if column in df.columns
+        }
+    )
+
+
+def compact_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """ids to category, times to int32 seconds, small integers to int32"""
+    df = df.copy()
+    for column in df.columns:
+        # direction_id is an integer column, not an id
+        if column in COMPACT_INT_COLUMNS:
+            df[column] = pd.to_numeric(df[column]).fillna(-1).astype("int32")
+        elif column in COMPACT_TIME_COLUMNS:
+            df[column] = time_to_seconds(df[column])
+        elif column.endswith("_id"):
+            df[column] = df[column].astype("category")
+    return df
+
+
+def write_table(df: pd.DataFrame, table_dir: str, name: str):
+    # written under a temporary name: a table file is always complete
+    tmp_path = os.path.join(table_dir, name + "." + str(uuid.uuid4()))
+    if HAS_PYARROW:
+        try:
+            df.reset_index(drop=True).to_feather(tmp_path)
+            os.replace(tmp_path, os.path.join(table_dir, name + ".feather"))
+            return
+        except Exception:
+            # e.g. object column mixing types, not representable in Arrow
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    df.to_pickle(tmp_path)
+    os.replace(tmp_path, os.path.join(table_dir, name + ".pkl"))
+
+
+def select_columns(df: pd.DataFrame, columns=None) -> pd.DataFrame:
+    # columns missing from the table are skipped, as usecols of pandas
+    if columns is None:
+        return df
+    return df[[c for c in columns if c in df.columns]]
+
+
+def read_cached_table(table_dir: str, name: str, columns=None):
+    path = os.path.join(table_dir, name + ".feather")
+    if os.path.exists(path):
+        if columns is not None:
+            with pyarrow.ipc.open_file(path) as reader:
+                columns = [c for c in columns if c in reader.schema.names]
+        return pd.read_feather(path, columns=columns)
+    path = os.path.join(table_dir, name + ".pkl")
+    if os.path.exists(path):
+        return select_columns(pd.read_pickle(path), columns)
+    return None
+
+
+class GTFSFeed(MutableMapping):
+    """GTFS tables as returned by gtfs_parser.GTFS(), loaded on first access"""
+
+    def __init__(self, zip_path: str, cache_dir=None, digest=None):
+        self.zip_path = zip_path
+        with zipfile.ZipFile(zip_path) as z:
+            # table name to member name, feeds may be zipped within a folder
+            self.members = {
+                os.path.splitext(os.path.basename(member))[0]: member
+                for member in z.namelist()
+                if member.endswith(".txt")
+                and not member.startswith("__MACOSX")
+                and has_rows(z, member)
+            }
+        self.names = list(self.members.keys())
+        self.tables = {}
+
+        self.table_dir = None
+        if cache_dir is not None:
+            self.table_dir = os.path.join(cache_dir, digest or file_sha256(zip_path))
+            os.makedirs(self.table_dir, exist_ok=True)
+            # mtime of the directory is the last use, see evict_parsed_feeds()
+            os.utime(self.table_dir)
+
+    def read_csv(self, name: str, columns=None) -> pd.DataFrame:
+        # a ZipFile of its own: members may be read by several threads
+        with zipfile.ZipFile(self.zip_path) as z:
+            if HAS_PYARROW:
+                try:
+                    return read_csv_arrow(z, self.members[name], columns=columns)
+                except pyarrow.ArrowInvalid:
+                    # e.g. line ends in quoted fields, parsed by pandas below
+                    pass
+            with z.open(self.members[name]) as f:
+                return read_csv_chunked(f.read(), columns=columns)
+
+    def preload(self, names: list, workers=INGEST_WORKERS):
+        """load tables of names in the feed at once, by workers threads"""
+        names = [n for n in names if n in self.members and n not in self.tables]
+        if not names:
+            return
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(names)))) as ex:
+            for name, df in zip(names, ex.map(self.load, names)):
+                self.tables[name] = df
+
+    def load(self, name: str) -> pd.DataFrame:
+        if self.table_dir is not None:
+            df = read_cached_table(self.table_dir, name)
+            if df is not None:
+                return df
+
+        df = apply_table_dtypes(self.read_csv(name), name)
+        if name == "stops" and "parent_station" not in df.columns:
+            # optional on GTFS but used by gtfs_parser, filled as gtfs_parser does
+            df["parent_station"] = "nan"
+
+        if self.table_dir is not None:
+            try:
+                write_table(df, self.table_dir, name)
+            except OSError:
+                # caching is an optimization only
+                pass
+        return df
+
+    def table(self, name: str, columns=None, compact=False) -> pd.DataFrame:
+        """
+        read a table, or only some columns of it, without keeping it in the feed
+
+        Args:
+            name (str): table name e.g. stop_times
+            columns (list, optional): columns to read, all if None; columns
+                missing from the table are skipped
+            compact (bool, optional): apply compact_dtypes()
+
+        Returns:
+            pd.DataFrame: table, empty if the feed doesn't have it
+        """
+        if name in self.tables:
+            df = select_columns(self.tables[name], columns)
+        elif name not in self.members:
+            df = pd.DataFrame(columns=columns)
+        elif self.table_dir is None:
+            df = apply_table_dtypes(self.read_csv(name, columns=columns), name)
+        else:
+            df = read_cached_table(self.table_dir, name, columns=columns)
+            if df is None:
+                # parsed whole once, to be read by columns from the cache later
+                df = select_columns(self.load(name), columns)
+        return compact_dtypes(df) if compact else df
+
+    def __getitem__(self, name: str) -> pd.DataFrame:
+        if name not in self.tables:
+            if name not in self.members:
+                raise KeyError(name)
+            self.tables[name] = self.load(name)
+        return self.tables[name]
+
+    def __setitem__(self, name: str, df: pd.DataFrame):
+        if name not in self.names:
+            self.names.append(name)
+        self.tables[name] = df
+
+    def __delitem__(self, name: str):
+        self.names.remove(name)
+        self.members.pop(name, None)
+        self.tables.pop(name, None)
+
+    def __iter__(self):
+        return iter(list(self.names))
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __contains__(self, name) -> bool:
+        # without loading the table as Mapping.__contains__ would
+        return name in self.names
+
+    def copy(self):
+        """shallow copy, tables replaced on the copy are not seen by this feed"""
+        feed = copy.copy(self)
+        feed.names = list(self.names)
+        feed.members = dict(self.members)
+        feed.tables = dict(self.tables)
+        return feed
+
+
+def read_table(gtfs, name: str, columns=None, compact=False) -> pd.DataFrame:
+    """
+    GTFSFeed.table() of gtfs, or columns of a table of any other mapping of
+    tables e.g. the dict of gtfs_parser.GTFS()
+    """
+    if isinstance(gtfs, GTFSFeed):
+        return gtfs.table(name, columns=columns, compact=compact)
+    if name not in gtfs:
+        return pd.DataFrame(columns=columns)
+    df = select_columns(gtfs[name], columns)
+    return compact_dtypes(df) if compact else df
+
+
+def evict_parsed_feeds(cache_dir: str, max_feeds: int):
+    entries = []
+    for dirname in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, dirname)
+        if os.path.isdir(path):
+            entries.append((os.path.getmtime(path), dirname))
+    entries.sort(reverse=True)
+    for _, dirname in entries[max_feeds:]:
+        shutil.rmtree(os.path.join(cache_dir, dirname), ignore_errors=True)
+
+
+def load_gtfs(zip_path: str, cache_dir: str, max_feeds: int, digest=None) -> GTFSFeed:
+    """
+    open GTFS zip, tables are parsed or read from cache_dir when accessed
+
+    Args:
+        zip_path (str): path to GTFS zip
+        cache_dir (str): directory of parsed feeds
+        max_feeds (int): number of parsed feeds kept in cache_dir
+        digest (str, optional): sha256 of the zip if known
+
+    Returns:
+        GTFSFeed: table name to DataFrame, as gtfs_parser.GTFS()
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    gtfs = GTFSFeed(zip_path, cache_dir=cache_dir, digest=digest)
+    evict_parsed_feeds(cache_dir, max_feeds)
+    return gtfs
@@ -0,0 +1,162 @@
+"""
+Persistent cache of downloaded GTFS zip files.
+
+Zips are stored once per content hash (blobs/<sha256>.zip) and an index maps
+each source URL to its blob together with the validators needed to revalidate
+it: HTTP ETag/Last-Modified or a version string known by the caller (e.g.
+file_uid and file_last_updated_at of Japan DPF feeds).
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+ORPHAN_MAX_AGE_SEC = 60 * 60
+
+# index.json is shared by tasks running in parallel threads
+_lock = threading.Lock()
+
+
+class FeedCache:
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.blobs_dir = os.path.join(cache_dir, "blobs")
+        self.index_path = os.path.join(cache_dir, "index.json")
+        self.max_bytes = max_bytes
+        os.makedirs(self.blobs_dir, exist_ok=True)
+
+    def blob_path(self, sha256: str) -> str:
+        return os.path.join(self.blobs_dir, sha256 + ".zip")
+
+    def load_index(self) -> dict:
+        if not os.path.exists(self.index_path):
+            return {}
+        try:
+            with open(self.index_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            # broken index: start over, orphaned blobs are evicted later
+            return {}
+
+    def save_index(self, index: dict):
+        tmp_path = self.index_path + "." + str(uuid.uuid4())
+        with open(tmp_path, mode="w", encoding="utf-8") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self.index_path)
+
+    def get(self, url: str, version=None) -> str:
+        """
+        return local path of the zip at url, downloading it only when changed
+
+        Args:
+            url (str): zip URL
+            version (str, optional): identifies the content of url, when it
+                matches the cached entry no request is sent at all
+
+        Returns:
+            str: path of the cached zip
+        """
+        with _lock:
+            entry = self.load_index().get(url)
+        if entry is not None and not os.path.exists(self.blob_path(entry["sha256"])):
+            entry = None
+
+        if entry is not None and version is not None and entry["version"] == version:
+            return self.touch(url, entry)
+
+        req = urllib.request.Request(url)
+        if entry is not None:
+            if entry.get("etag"):
+                req.add_header("If-None-Match", entry["etag"])
+            if entry.get("last_modified"):
+                req.add_header("If-Modified-Since", entry["last_modified"])
+
+        try:
+            res = urllib.request.urlopen(req)
+        except urllib.error.HTTPError as e:
+            if e.code == 304 and entry is not None:
+                entry["version"] = version
+                return self.touch(url, entry)
+            raise
+
+        with res:
+            sha256, size = self.download(res)
+            entry = {
+                "sha256": sha256,
+                "size": size,
+                "etag": res.headers.get("ETag"),
+                "last_modified": res.headers.get("Last-Modified"),
+                "version": version,
+            }
+        return self.touch(url, entry)
+
+    def download(self, res) -> tuple:
+        # stream to a temporary file while hashing, then move into place
+        tmp_path = os.path.join(self.blobs_dir, str(uuid.uuid4()) + ".part")
+        sha256 = hashlib.sha256()
+        size = 0
+        try:
+            with open(tmp_path, mode="wb") as f:
+                while True:
+                    chunk = res.read(DOWNLOAD_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    sha256.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+            digest = sha256.hexdigest()
+            if os.path.exists(self.blob_path(digest)):
+                os.remove(tmp_path)
+            else:
+                os.replace(tmp_path, self.blob_path(digest))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return digest, size
+
+    def touch(self, url: str, entry: dict) -> str:
+        entry["last_used"] = time.time()
+        with _lock:
+            index = self.load_index()
+            index[url] = entry
+            self.evict(index, keep=url)
+            self.save_index(index)
+        return self.blob_path(entry["sha256"])
+
+    def evict(self, index: dict, keep: str):
+        """remove least recently used entries until blobs fit in max_bytes"""
+        blob_sizes = {}
+        for entry in index.values():
+            blob_sizes[entry["sha256"]] = entry["size"]
+        total = sum(blob_sizes.values())
+
+        for url in sorted(index, key=lambda url: index[url]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            if url == keep:
+                continue
+            sha256 = index.pop(url)["sha256"]
+            if any(entry["sha256"] == sha256 for entry in index.values()):
+                # blob is still referenced by another URL
+                continue
+            total -= blob_sizes[sha256]
+            if os.path.exists(self.blob_path(sha256)):
+                os.remove(self.blob_path(sha256))
+
+        # files left behind by a lost index or an interrupted download, old
+        # enough not to belong to a download running in another thread
+        referenced = set(entry["sha256"] + ".zip" for entry in index.values())
+        for filename in os.listdir(self.blobs_dir):
+            path = os.path.join(self.blobs_dir, filename)
+            if (
+                filename not in referenced
+                and time.time() - os.path.getmtime(path) > ORPHAN_MAX_AGE_SEC
+            ):
+                os.remove(path)
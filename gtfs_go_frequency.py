@@ -0,0 +1,193 @@
+"""
+Trip frequencies of unified stops and of paths between them.
+
+Frequency gives the same features as gtfs_parser.aggregate.Aggregator, but
+from a unification table made once per feed by gtfs_go_unify instead of
+unifying stops again on each run. Stops of the same position, the centroid
+rounded to 4 decimal places, are counted and drawn as one.
+
+Stop times are counted on CompactStopTimes of the whole feed, filtered by
+masks of the date and time, so one of them serves every date and window.
+"""
+
+import numpy as np
+import pandas as pd
+
+from .gtfs_go_calendar import trips_running
+from .gtfs_go_stoptimes import CompactStopTimes, pack_keys
+from .gtfs_go_timebins import hhmmss_to_seconds
+from .gtfs_go_unify import position_ids
+
+
+class Frequency:
+    def __init__(
+        self,
+        gtfs,
+        unified: pd.DataFrame,
+        yyyymmdd="",
+        begin_time="",
+        end_time="",
+        count_stops=True,
+        compact=None,
+    ):
+        """
+        Args:
+            gtfs (dict): feed, stops not unified
+            unified (pd.DataFrame): of unify_stops() or keep_stops()
+            yyyymmdd (str, optional): trips running on the date, all if empty
+            begin_time (str, optional): hhmmss, departures from the time only
+            end_time (str, optional): hhmmss, departures before the time only
+            count_stops (bool, optional): False to set count of every stop to
+                1, as Aggregator does when stops are not unified
+            compact (CompactStopTimes, optional): of gtfs["stop_times"], not
+                filtered, built if None
+        """
+        self.gtfs = gtfs
+        self.count_stops = count_stops
+        self.similar = unified.assign(position_id=position_ids(unified))
+        self.compact = CompactStopTimes.from_feed(gtfs) if compact is None else compact
+
+        # similar stop of each stop code, -1 if not in stops
+        similar = self.similar.drop_duplicates("stop_id")
+        self.rows = pd.Index(similar["stop_id"]).get_indexer(self.compact.stop_ids)
+        self.rows = np.where(self.rows >= 0, similar.index.values[self.rows], -1)
+
+        mask = np.ones(len(self.compact), dtype=bool)
+        if yyyymmdd:
+            running = trips_running(gtfs, self.compact.trip_ids, yyyymmdd)
+            mask &= running[self.compact.trip_codes()]
+        if begin_time and end_time:
+            # times of blank departures are of arrival_time, as time bins
+            mask &= self.compact.time_mask(
+                hhmmss_to_seconds(begin_time), hhmmss_to_seconds(end_time)
+            )
+        self.mask = mask
+
+    def position_counts(self) -> pd.Series:
+        """number of stop times by position_id"""
+        rows = self.rows[self.compact.stop_codes[self.mask]]
+        positions = self.similar["position_id"].values[rows[rows >= 0]]
+        return pd.Series(positions, dtype=object).value_counts()
+
+    def read_interpolated_stops(self):
+        """
+        Returns:
+            generator: Point features of unified stops with count of stop times
+        """
+        stops = self.similar.drop_duplicates("position_id")
+        if self.count_stops:
+            # float with NaN for stops of no stop times, as Aggregator
+            counts = stops["position_id"].map(self.position_counts()).tolist()
+        else:
+            counts = [1] * len(stops)
+        for stop_id, stop_name, lon, lat, count in zip(
+            stops["similar_stop_id"],
+            stops["similar_stop_name"],
+            stops["similar_stop_lon"].tolist(),
+            stops["similar_stop_lat"].tolist(),
+            counts,
+        ):
+            yield {
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [lon, lat]},
+                "properties": {
+                    "similar_stop_name": stop_name,
+                    "similar_stop_id": stop_id,
+                    "count": count,
+                },
+            }
+
+    def agencies_of_trips(self, trip_ids: pd.Series) -> pd.DataFrame:
+        """agency_id and agency_name of the route of each trip"""
+        trips = self.gtfs["trips"].drop_duplicates("trip_id")
+        routes = self.gtfs["routes"].drop_duplicates("route_id")
+        agencies = trip_ids.to_frame("trip_id").merge(
+            trips[["trip_id", "route_id"]], on="trip_id", how="left"
+        )
+        if "agency_id" not in routes.columns:
+            return pd.DataFrame(
+                {"agency_id": np.nan, "agency_name": np.nan}, index=agencies.index
+            )
+        agencies = agencies.merge(
+            routes[["route_id", "agency_id"]], on="route_id", how="left"
+        )
+        agency = self.gtfs["agency"].drop_duplicates("agency_id")
+        agencies = agencies.merge(
+            agency[["agency_id", "agency_name"]], on="agency_id", how="left"
+        )
+        return agencies[["agency_id", "agency_name"]]
+
+    def read_route_frequency(self):
+        """
+        Returns:
+            generator: LineString features of paths between consecutive unified
+                stops of trips with frequency, in order of path as Aggregator
+        """
+        # consecutive stop times of a trip among those filtered
+        index = np.flatnonzero(self.mask)
+        trip_codes = self.compact.trip_codes()[index]
+        is_pair = trip_codes[1:] == trip_codes[:-1]
+        prev_rows = self.rows[self.compact.stop_codes[index[:-1][is_pair]]]
+        next_rows = self.rows[self.compact.stop_codes[index[1:][is_pair]]]
+        pair_trips = trip_codes[:-1][is_pair]
+        known = (prev_rows >= 0) & (next_rows >= 0)
+        prev_rows, next_rows = prev_rows[known], next_rows[known]
+        pair_trips = pair_trips[known]
+
+        # a path is of the similar stop_ids and positions of both ends
+        similar_ids = self.similar["similar_stop_id"].to_numpy(dtype=object)
+        positions = self.similar["position_id"].to_numpy(dtype=object)
+        node_codes, nodes = pd.factorize(
+            pd.Series(similar_ids + "\n" + positions, dtype=object)
+        )
+        _, first, counts = np.unique(
+            pack_keys(
+                [node_codes[prev_rows], node_codes[next_rows]],
+                [len(nodes), len(nodes)],
+            ),
+            return_index=True,
+            return_counts=True,
+        )
+        prev_rows, next_rows = prev_rows[first], next_rows[first]
+        path_ids = (
+            similar_ids[prev_rows]
+            + similar_ids[next_rows]
+            + positions[prev_rows]
+            + positions[next_rows]
+        )
+        order = np.argsort(path_ids, kind="stable")
+        prev_rows, next_rows = prev_rows[order], next_rows[order]
+        counts = counts[order]
+        agencies = self.agencies_of_trips(
+            pd.Series(self.compact.trip_ids[pair_trips[first][order]], dtype=object)
+        )
+
+        names = self.similar["similar_stop_name"].to_numpy(dtype=object)
+        lons = self.similar["similar_stop_lon"].tolist()
+        lats = self.similar["similar_stop_lat"].tolist()
+        for prev_row, next_row, count, agency_id, agency_name in zip(
+            prev_rows.tolist(),
+            next_rows.tolist(),
+            counts.tolist(),
+            agencies["agency_id"],
+            agencies["agency_name"],
+        ):
+            yield {
+                "type": "Feature",
+                "geometry": {
+                    "type": "LineString",
+                    "coordinates": (
+                        [lons[prev_row], lats[prev_row]],
+                        [lons[next_row], lats[next_row]],
+                    ),
+                },
+                "properties": {
+                    "frequency": count,
+                    "prev_stop_id": similar_ids[prev_row],
+                    "prev_stop_name": names[prev_row],
+                    "next_stop_id": similar_ids[next_row],
+                    "next_stop_name": names[next_row],
+                    "agency_id": agency_id,
+                    "agency_name": agency_name,
+                },
+            }
@@ -10,8 +10,18 @@ from .gtfs_go_settings import (
     STOPS_LABEL_MINUMUM_VISIBLE_SCALE
 )
 
+# labeling of each field, cloned for each layer as layers take ownership
+_labelings = {}
+
 
 def get_labeling_for_stops(target_field_name="stop_name"):
+    if target_field_name not in _labelings:
+        _labelings[target_field_name] = make_labeling_for_stops(
+            target_field_name)
+    return _labelings[target_field_name].clone()
+
+
+def make_labeling_for_stops(target_field_name):
     text_format = QgsTextFormat()
     text_format.setFont(QFont(STOPS_LABEL_FONT, STOPS_LABEL_SIZE_MM))
     text_format.setSize(STOPS_LABEL_SIZE_MM)
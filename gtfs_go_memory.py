@@ -0,0 +1,280 @@
+"""
+Memory layers as an output format: features are added to QGIS memory
+provider layers as they are produced, skipping the round-trip of writing
+files and parsing them back through OGR.
+
+Layers are built in the thread of a task, moved to the main thread and kept
+here by uri, as written_files of other formats, until the dialog takes them.
+They can be saved to a GeoPackage afterwards by SaveLayersTask.
+"""
+
+import json
+import os
+import threading
+
+from qgis.core import (
+    Qgis,
+    QgsFeature,
+    QgsField,
+    QgsGeometry,
+    QgsMessageLog,
+    QgsPointXY,
+    QgsProject,
+    QgsTask,
+    QgsVectorFileWriter,
+    QgsVectorLayer,
+    QgsVectorLayerFeatureSource,
+)
+from qgis.PyQt.QtCore import QCoreApplication, QVariant
+
+from .gtfs_go_settings import MEMORY_BATCH_SIZE, MEMORY_URI_PREFIX
+from .gtfs_go_writer import SCHEMA_SAMPLE_SIZE, infer_schema, layer_name
+
+MESSAGE_TAG = "GTFS-GO"
+
+# memory layers written by tasks, by uri
+_lock = threading.Lock()
+_layers = {}
+
+# memory provider geometry of GeoJSON geometry types
+GEOMETRY_TYPES = {
+    "Point": "Point",
+    "MultiPoint": "MultiPoint",
+    "LineString": "LineString",
+    "MultiLineString": "MultiLineString",
+    "Polygon": "Polygon",
+    "MultiPolygon": "MultiPolygon",
+}
+
+
+def is_memory_uri(uri: str) -> bool:
+    return uri.startswith(MEMORY_URI_PREFIX)
+
+
+def take_layer(uri: str):
+    """
+    Returns:
+        QgsVectorLayer: the layer written to uri, None if taken already
+    """
+    with _lock:
+        return _layers.pop(uri, None)
+
+
+def release_layers(output_dir: str):
+    """drop layers of a feed not taken, e.g. written before it failed"""
+    prefix = MEMORY_URI_PREFIX + os.path.join(output_dir, "")
+    with _lock:
+        for uri in [uri for uri in _layers if uri.startswith(prefix)]:
+            del _layers[uri]
+
+
+def open_layer(uri: str) -> QgsVectorLayer:
+    """layer of a data source of written_files, of any output format"""
+    if is_memory_uri(uri):
+        layer = take_layer(uri)
+        if layer is not None:
+            return layer
+    return QgsVectorLayer(uri, layer_name(uri), "ogr")
+
+
+def variant_type(python_type: type):
+    """QVariant type of a value_type() of gtfs_go_writer"""
+    return {
+        bool: QVariant.Bool,
+        int: QVariant.LongLong,
+        float: QVariant.Double,
+    }.get(python_type, QVariant.String)
+
+
+def make_geometry(geometry: dict) -> QgsGeometry:
+    """QgsGeometry of a GeoJSON geometry, built from coordinates directly"""
+    coordinates = geometry["coordinates"]
+    geometry_type = geometry["type"]
+    if geometry_type == "Point":
+        return QgsGeometry.fromPointXY(QgsPointXY(*coordinates[:2]))
+    if geometry_type == "MultiPoint":
+        return QgsGeometry.fromMultiPointXY([QgsPointXY(*c[:2]) for c in coordinates])
+    if geometry_type == "LineString":
+        return QgsGeometry.fromPolylineXY([QgsPointXY(*c[:2]) for c in coordinates])
+    if geometry_type == "MultiLineString":
+        return QgsGeometry.fromMultiPolylineXY(
+            [[QgsPointXY(*c[:2]) for c in line] for line in coordinates]
+        )
+    if geometry_type == "Polygon":
+        return QgsGeometry.fromPolygonXY(
+            [[QgsPointXY(*c[:2]) for c in ring] for ring in coordinates]
+        )
+    if geometry_type == "MultiPolygon":
+        return QgsGeometry.fromMultiPolygonXY(
+            [[[QgsPointXY(*c[:2]) for c in ring] for ring in p] for p in coordinates]
+        )
+    raise ValueError("unsupported geometry: " + geometry_type)
+
+
+class MemoryWriter:
+    def __init__(self, uri: str):
+        """
+        Args:
+            uri (str): from layer_uri() of MEMORY_FORMAT
+        """
+        self.uri = uri
+        self.count = 0
+        self.layer = None
+        self.fields = []
+        self.buffer = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            return
+        if self.layer is None:
+            self.create_layer()
+        self.flush()
+        self.layer.updateExtents()
+        # created in the thread of a task, used by the main thread
+        self.layer.moveToThread(QCoreApplication.instance().thread())
+        with _lock:
+            _layers[self.uri] = self.layer
+
+    def create_layer(self):
+        """typed fields and geometry type of the sampled features"""
+        geometry_types = set(
+            f["geometry"]["type"] for f in self.buffer if f.get("geometry")
+        )
+        if len(geometry_types) == 0:
+            geometry = "None"
+        elif len(geometry_types) == 1:
+            geometry = GEOMETRY_TYPES[geometry_types.pop()]
+        elif geometry_types <= {"LineString", "MultiLineString"}:
+            geometry = "MultiLineString"
+        else:
+            raise ValueError("mixed geometries: " + ", ".join(sorted(geometry_types)))
+        self.layer = QgsVectorLayer(
+            geometry + "?crs=EPSG:4326", layer_name(self.uri), "memory"
+        )
+        self.multi = geometry.startswith("Multi")
+
+        schema = infer_schema(self.buffer)
+        self.fields = [key for key, _ in schema]
+        self.layer.dataProvider().addAttributes(
+            [QgsField(key, variant_type(key_type)) for key, key_type in schema]
+        )
+        self.layer.updateFields()
+
+    def flush(self):
+        fields = self.layer.fields()
+        features = []
+        for feature in self.buffer:
+            qgs_feature = QgsFeature(fields)
+            properties = feature.get("properties", {})
+            attributes = []
+            for key in self.fields:
+                value = properties.get(key)
+                if isinstance(value, (list, dict)):
+                    value = json.dumps(value, ensure_ascii=False)
+                attributes.append(value)
+            qgs_feature.setAttributes(attributes)
+            if feature.get("geometry"):
+                geometry = make_geometry(feature["geometry"])
+                if self.multi:
+                    geometry.convertToMultiType()
+                qgs_feature.setGeometry(geometry)
+            features.append(qgs_feature)
+        # keys missing from the sampled features are dropped
+        self.layer.dataProvider().addFeatures(features)
+        self.buffer = []
+
+    def write(self, feature: dict):
+        self.buffer.append(feature)
+        self.count += 1
+        if self.layer is None and len(self.buffer) >= SCHEMA_SAMPLE_SIZE:
+            self.create_layer()
+        if self.layer is not None and len(self.buffer) >= MEMORY_BATCH_SIZE:
+            self.flush()
+
+
+def write_memory_layer(uri: str, features) -> int:
+    """
+    features to a memory layer, kept until taken by take_layer(uri)
+
+    Returns:
+        int: number of features
+    """
+    with MemoryWriter(uri) as writer:
+        for feature in features:
+            writer.write(feature)
+    return writer.count
+
+
+class SaveLayersTask(QgsTask):
+    """save memory layers of a feed to a GeoPackage in the background"""
+
+    def __init__(self, layers: list, path: str):
+        """
+        Args:
+            layers (list): QgsVectorLayer, saved as layers of their name
+            path (str): output GeoPackage
+        """
+        super().__init__("GTFS-GO: save " + path, QgsTask.CanCancel)
+        self.path = path
+        # snapshots of features, safe to read in the thread of the task
+        self.sources = [
+            (
+                layer.name(),
+                QgsVectorLayerFeatureSource(layer),
+                layer.fields(),
+                layer.wkbType(),
+                layer.crs(),
+            )
+            for layer in layers
+        ]
+        self.transform_context = QgsProject.instance().transformContext()
+        self.exception = None
+
+    def run(self):
+        try:
+            for i, (name, source, fields, wkb_type, crs) in enumerate(self.sources):
+                if self.isCanceled():
+                    return False
+                self.save(name, source, fields, wkb_type, crs)
+                self.setProgress(100.0 * (i + 1) / len(self.sources))
+        except Exception as e:
+            self.exception = e
+            return False
+        return True
+
+    def save(self, name: str, source, fields, wkb_type, crs):
+        options = QgsVectorFileWriter.SaveVectorOptions()
+        options.driverName = "GPKG"
+        options.layerName = name
+        options.actionOnExistingFile = (
+            QgsVectorFileWriter.CreateOrOverwriteLayer
+            if os.path.exists(self.path)
+            else QgsVectorFileWriter.CreateOrOverwriteFile
+        )
+        writer = QgsVectorFileWriter.create(
+            self.path, fields, wkb_type, crs, self.transform_context, options
+        )
+        if writer.hasError() != QgsVectorFileWriter.NoError:
+            raise RuntimeError(writer.errorMessage())
+        batch = []
+        for feature in source.getFeatures():
+            batch.append(feature)
+            if len(batch) >= MEMORY_BATCH_SIZE:
+                writer.addFeatures(batch)
+                batch = []
+        writer.addFeatures(batch)
+        # closes the file
+        del writer
+
+    def finished(self, result: bool):
+        if result:
+            QgsMessageLog.logMessage("saved " + self.path, MESSAGE_TAG, Qgis.Info)
+        elif self.exception is not None:
+            QgsMessageLog.logMessage(
+                f"failed to save {self.path}: {self.exception}",
+                MESSAGE_TAG,
+                Qgis.Critical,
+            )
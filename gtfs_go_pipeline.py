@@ -0,0 +1,1065 @@
+"""
+GUI-free per-feed processing pipeline.
+
+Every function in this module works only with plain values (paths, dicts) so
+it can run in a worker thread: the dialog collects widget state into a params
+dict on the main thread and hands it over here.
+"""
+
+import multiprocessing
+import os
+import sys
+import urllib.parse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from .gtfs_go_calendar import filter_by_date, get_calendar_index, trips_running
+from .gtfs_go_feed_cache import FeedCache
+from .gtfs_go_frequency import Frequency
+from .gtfs_go_report import RunReport, stage
+from .gtfs_go_segments import (
+    get_segments,
+    segment_coordinates,
+    simplify_features,
+    with_segments,
+)
+from .gtfs_go_settings import (
+    AGGREGATE_IN_SUBPROCESS,
+    CACHE_DIR,
+    FEED_CACHE_MAX_BYTES,
+    GEOJSON_COORDINATE_PRECISION,
+    MEMORY_FORMAT,
+    PARSED_CACHE_MAX_FEEDS,
+    PRELOAD_TABLES,
+    PROCESSING_WORKERS,
+    SIMPLIFY_TOLERANCE_DEGREE,
+    VECTORIZED_STOP_UNIFICATION,
+)
+from .gtfs_go_stages import cached, cached_table, load_feed, stage_key
+from .gtfs_go_stoptimes import CompactStopTimes
+from .gtfs_go_tiles import write_mbtiles
+from .gtfs_go_timebins import read_binned_routes, read_binned_stops
+from .gtfs_go_unify import (
+    MAX_DISTANCE_DEGREE,
+    RESULT_COLUMNS,
+    keep_stops,
+    similar_stop_ids,
+    unified_stops,
+    unify_stops,
+)
+from .gtfs_go_writer import (
+    AGGREGATED_PREFIXES,
+    layer_uri,
+    remove_layers,
+    write_features,
+    write_table,
+)
+from .gtfs_parser import gtfs_parser
+
+# stages in execution order, used to compute overall progress
+STAGES = ("download", "parse", "simple", "aggregate", "write")
+
+
+# shared by all feeds of the session, see get_process_executor()
+_process_executor = None
+_process_executor_workers = 0
+
+
+class CanceledError(Exception):
+    pass
+
+
+def get_python_executable() -> str:
+    # inside QGIS sys.executable is the application binary, not the interpreter
+    if os.name == "nt":
+        candidates = [os.path.join(sys.exec_prefix, "pythonw.exe")]
+    else:
+        candidates = [
+            os.path.join(sys.exec_prefix, "bin", "python3"),
+            os.path.join(sys.exec_prefix, "bin", "python"),
+        ]
+    for candidate in candidates:
+        if os.path.isfile(candidate):
+            return candidate
+    return sys.executable
+
+
+def make_process_executor(max_workers: int) -> ProcessPoolExecutor:
+    context = multiprocessing.get_context("spawn")
+    context.set_executable(get_python_executable())
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=context)
+
+
+def get_process_executor(max_workers: int) -> ProcessPoolExecutor:
+    global _process_executor, _process_executor_workers
+    if _process_executor is None or _process_executor_workers != max_workers:
+        if _process_executor is not None:
+            _process_executor.shutdown(wait=False)
+        _process_executor = make_process_executor(max_workers)
+        _process_executor_workers = max_workers
+    return _process_executor
+
+
+def shutdown_executor(executor: ProcessPoolExecutor, terminate=False):
+    """
+    Args:
+        terminate (bool, optional): also stop the worker processes, running
+            tasks can't be canceled otherwise
+    """
+    processes = list((executor._processes or {}).values())
+    try:
+        executor.shutdown(wait=False, cancel_futures=True)
+    except TypeError:
+        # cancel_futures is of Python 3.9 and later
+        executor.shutdown(wait=False)
+    if terminate:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            # outputs can be removed only after the process released them
+            process.join()
+
+
+def shutdown_process_executor(terminate=False):
+    """
+    shut the shared executor down, a new one is made by get_process_executor()
+
+    Args:
+        terminate (bool, optional): also stop the worker processes
+    """
+    global _process_executor
+    executor = _process_executor
+    _process_executor = None
+    if executor is not None:
+        shutdown_executor(executor, terminate=terminate)
+
+
+def download_zip(url: str, version=None, cache_dir=CACHE_DIR) -> str:
+    feed_cache = FeedCache(os.path.join(cache_dir, "feeds"), FEED_CACHE_MAX_BYTES)
+    return feed_cache.get(url, version=version)
+
+
+def make_params(output_dir: str, **options) -> dict:
+    """
+    params of run(), options not given are the defaults of the dialog
+
+    Raises:
+        ValueError: unknown option
+    """
+    params = {
+        "output_dir": output_dir,
+        "simple": True,
+        "ignore_shapes": False,
+        "ignore_no_route": False,
+        "aggregate": False,
+        "unify": True,
+        "delimiter": "",
+        "yyyymmdd": "",
+        "dates": [],
+        "begin_time": "",
+        "end_time": "",
+        "time_bin_minutes": 0,
+        "workers": PROCESSING_WORKERS,
+        "aggregate_in_subprocess": AGGREGATE_IN_SUBPROCESS,
+        "cache_dir": CACHE_DIR,
+        "precision": GEOJSON_COORDINATE_PRECISION,
+        "simplify_tolerance": SIMPLIFY_TOLERANCE_DEGREE,
+        "output_format": "GeoJSON",
+        "profile": False,
+        "tiles": False,
+    }
+    unknown = set(options.keys()) - set(params.keys())
+    if unknown:
+        raise ValueError("unknown options: " + ", ".join(sorted(unknown)))
+    params.update(options)
+    if params["dates"] and not params["yyyymmdd"]:
+        params["yyyymmdd"] = params["dates"][0]
+    elif params["yyyymmdd"] and not params["dates"]:
+        params["dates"] = [params["yyyymmdd"]]
+    return params
+
+
+def make_feed_infos(paths: list) -> list:
+    """feed_info of each zip path or URL, named after its file name"""
+    feed_infos = []
+    names = set()
+    for path in paths:
+        if path.startswith("http"):
+            filename = os.path.basename(urllib.parse.urlparse(path).path)
+        else:
+            filename = os.path.basename(path)
+        name = filename.split(".")[0] or "feed"
+        # each feed is written to its own directory
+        unique_name = name
+        i = 2
+        while unique_name in names:
+            unique_name = name + "-" + str(i)
+            i += 1
+        names.add(unique_name)
+        feed_infos.append({"path": path, "group": unique_name, "dir": unique_name})
+    return feed_infos
+
+
+def run_batch(feed_infos: list, params: dict, progress=None, is_canceled=None) -> list:
+    """
+    run() many feeds, params["workers"] of them at once
+
+    Args:
+        progress (callable, optional): called with (feed_info, stage, percent)
+        is_canceled (callable, optional): returns True when processing should stop
+
+    Raises:
+        CanceledError: is_canceled() returned True
+
+    Returns:
+        list: (feed_info, written_files, exception) of each feed in order,
+            written_files is None if failed
+    """
+
+    def run_feed(feed_info: dict):
+        def progress_of_feed(stage: str, percent: float):
+            progress(feed_info, stage, percent)
+
+        try:
+            written_files = run(
+                feed_info,
+                params,
+                progress=None if progress is None else progress_of_feed,
+                is_canceled=is_canceled,
+            )
+        except CanceledError:
+            raise
+        except Exception as e:
+            # a broken feed doesn't stop the others
+            return feed_info, None, e
+        return feed_info, written_files, None
+
+    with ThreadPoolExecutor(max_workers=max(1, params["workers"])) as executor:
+        return list(executor.map(run_feed, feed_infos))
+
+
+def run(
+    feed_info: dict, params: dict, progress=None, is_canceled=None, report=None
+) -> dict:
+    """
+    process a feed: download, parse, export and aggregate then write outputs
+
+    params-schema: {
+        output_dir: str,
+        simple: bool,
+        ignore_shapes: bool,
+        ignore_no_route: bool,
+        aggregate: bool,
+        unify: bool,
+        delimiter: str,
+        yyyymmdd: str,
+        dates: list,
+        begin_time: str,
+        end_time: str,
+        time_bin_minutes: int,
+        workers: int,
+        aggregate_in_subprocess: bool,
+        cache_dir: str,
+        precision: int,
+        simplify_tolerance: float,
+        output_format: str,
+        profile: bool
+    }
+
+    Args:
+        feed_info (dict): path, group, dir and optional version of the feed
+        params (dict): processing options
+        progress (callable, optional): called with (stage, percent)
+        is_canceled (callable, optional): returns True when processing should stop
+        report (RunReport, optional): stages are recorded to it, a new one if
+            None; written to the output directory also when the run fails
+
+    Raises:
+        CanceledError: is_canceled() returned True between stages
+
+    Returns:
+        dict: paths of written files, empty string for skipped outputs;
+            with more than one dates, layers of each date in aggregated_dates
+    """
+    if report is None:
+        report = RunReport(feed_info["group"], profile=params.get("profile", False))
+
+    output_dir = os.path.join(params["output_dir"], feed_info["dir"])
+    os.makedirs(output_dir, exist_ok=True)
+
+    report.start_profile()
+    try:
+        written_files = process_feed(
+            feed_info, params, output_dir, report, progress, is_canceled
+        )
+    finally:
+        report.stop_profile()
+        try:
+            report_path = report.write(output_dir)
+        except OSError:
+            # the report must not hide the result, or the error, of the run
+            report_path = ""
+    written_files["run_report"] = report_path
+    return written_files
+
+
+def process_feed(
+    feed_info: dict,
+    params: dict,
+    output_dir: str,
+    report: RunReport,
+    progress=None,
+    is_canceled=None,
+) -> dict:
+    """stages of run()"""
+
+    def enter(stage: str):
+        if is_canceled is not None and is_canceled():
+            raise CanceledError(stage)
+        if progress is not None:
+            progress(stage, 100.0 * STAGES.index(stage) / len(STAGES))
+
+    written_files = {
+        "routes": "",
+        "stops": "",
+        "aggregated_routes": "",
+        "aggregated_stops": "",
+        "aggregated_csv": "",
+        "aggregated_dates": {},
+        "aggregated_tiles": "",
+        "time_bins_routes": "",
+        "time_bins_stops": "",
+    }
+
+    enter("download")
+    zip_path = feed_info["path"]
+    if zip_path.startswith("http"):
+        with report.stage("download"):
+            zip_path = download_zip(
+                zip_path,
+                version=feed_info.get("version"),
+                cache_dir=params.get("cache_dir", CACHE_DIR),
+            )
+
+    enter("parse")
+    with report.stage("load") as record:
+        # tables parsed by an earlier run are read from the parsed cache
+        gtfs = load_feed(
+            zip_path,
+            os.path.join(params.get("cache_dir", CACHE_DIR), "parsed"),
+            PARSED_CACHE_MAX_FEEDS,
+        )
+        # the others are read by columns, or whole on first use
+        gtfs.preload(preload_tables(params))
+        record["counts"]["tables"] = len(gtfs)
+
+    enter("simple")
+    # each output is written as soon as it is produced, not to hold the simple
+    # and aggregated layers in memory together
+    precision = params.get("precision", GEOJSON_COORDINATE_PRECISION)
+    output_format = params.get("output_format", "GeoJSON")
+    if params["simple"]:
+        written_files["routes"] = layer_uri(output_dir, "routes", output_format)
+        with report.stage("routes") as record:
+            record["counts"]["features"] = write_features(
+                written_files["routes"],
+                simplify_features(
+                    with_route_colors(
+                        gtfs_parser.parse.read_routes(
+                            gtfs, ignore_shapes=params["ignore_shapes"]
+                        ),
+                        gtfs["routes"],
+                    ),
+                    params.get("simplify_tolerance", SIMPLIFY_TOLERANCE_DEGREE),
+                ),
+                output_format,
+                precision=precision,
+            )
+        written_files["stops"] = layer_uri(output_dir, "stops", output_format)
+        with report.stage("stops") as record:
+            record["counts"]["stop_times"] = len(gtfs["stop_times"])
+            record["counts"]["features"] = write_features(
+                written_files["stops"],
+                gtfs_parser.parse.read_stops(
+                    gtfs, ignore_no_route=params["ignore_no_route"]
+                ),
+                output_format,
+                precision=precision,
+            )
+
+    if params["aggregate"]:
+        enter("aggregate")
+        if (
+            params.get("workers", 1) > 1
+            and params.get("aggregate_in_subprocess")
+            # memory layers can't be sent back from a worker process
+            and params.get("output_format") != MEMORY_FORMAT
+        ):
+            # written by the worker process as well
+            written_files.update(
+                aggregate_in_subprocess(
+                    gtfs,
+                    params,
+                    output_dir,
+                    is_canceled=is_canceled,
+                    enter=enter,
+                    report=report,
+                )
+            )
+        else:
+            written_files.update(
+                aggregate_and_write(
+                    gtfs,
+                    params,
+                    output_dir,
+                    is_canceled=is_canceled,
+                    enter=enter,
+                    report=report,
+                )
+            )
+
+    if progress is not None:
+        progress("write", 100.0)
+
+    return written_files
+
+
+def with_route_colors(features, routes):
+    """
+    yield routes features with route_color of their route_id, None if the
+    route has none; routes layers are colored by it, see gtfs_go_renderer
+    """
+    colors = {}
+    if "route_color" in routes.columns:
+        routes = routes.dropna(subset=["route_color"])
+        colors = dict(zip(routes["route_id"], routes["route_color"].str.strip()))
+    for feature in features:
+        route_id = feature["properties"].get("route_id")
+        feature["properties"]["route_color"] = colors.get(route_id) or None
+        yield feature
+
+
+def preload_tables(params: dict) -> list:
+    """tables of PRELOAD_TABLES read whole by the stages enabled by params"""
+    names = set()
+    if params["simple"]:
+        # read_stops() joins all stop_times to trips
+        names.update(["stops", "routes", "trips", "stop_times"])
+        if not params["ignore_shapes"]:
+            names.add("shapes")
+    if params["aggregate"]:
+        names.update(["agency", "stops", "routes", "trips"])
+        if not VECTORIZED_STOP_UNIFICATION:
+            # Aggregator filters all stop_times, others read some columns
+            names.add("stop_times")
+        if params.get("time_bin_minutes") or (
+            VECTORIZED_STOP_UNIFICATION and not params["ignore_shapes"]
+        ):
+            # cut into segments, see segments_of()
+            names.add("shapes")
+    return [name for name in PRELOAD_TABLES if name in names]
+
+
+def unify_inputs(params: dict) -> list:
+    """inputs of unify(), part of the keys of the stages after it"""
+    return [
+        params["unify"],
+        VECTORIZED_STOP_UNIFICATION,
+        params["delimiter"],
+        MAX_DISTANCE_DEGREE,
+    ]
+
+
+def date_inputs(gtfs: dict, params: dict, yyyymmdd: str) -> list:
+    """inputs of filter_dates(), dates running the same services are the same"""
+    services = ""
+    if yyyymmdd:
+        services = get_calendar_index(gtfs).running_on(yyyymmdd).tobytes().hex()
+    return unify_inputs(params) + [services]
+
+
+def unify(gtfs: dict, params: dict):
+    """
+    Returns:
+        pd.DataFrame: similar stop of each stop, every stop as its own if
+            params["unify"] is off; None when Aggregator unifies stops by itself
+    """
+    if not VECTORIZED_STOP_UNIFICATION:
+        return None
+    if not params["unify"]:
+        return keep_stops(gtfs["stops"])
+    return cached_table(
+        gtfs,
+        stage_key(gtfs, "unified", *unify_inputs(params)),
+        lambda: unify_stops(gtfs["stops"], delimiter=params["delimiter"]),
+    )
+
+
+def unified_feed(gtfs: dict, params: dict, unified=None):
+    """
+    gtfs with stops replaced by unified stops, as it is if not unified.
+    stop_times are not remapped but dropped, read feed_stop_times() of the
+    unified stops instead
+    """
+    if unified is None or not params["unify"]:
+        return gtfs
+
+    def replace_stops():
+        feed = gtfs.copy()
+        feed["stops"] = unified_stops(unified)
+        del feed["stop_times"]
+        return feed
+
+    return cached(
+        gtfs, stage_key(gtfs, "unified_feed", *unify_inputs(params)), replace_stops
+    )
+
+
+def unified_stops_count(gtfs: dict, unified=None) -> int:
+    if unified is None:
+        return len(gtfs["stops"])
+    return unified["similar_stop_id"].nunique()
+
+
+def filter_dates(gtfs: dict, params: dict, yyyymmdd: str) -> dict:
+    """filter_by_date() of the feed, cached by the services running"""
+    return cached(
+        gtfs,
+        stage_key(gtfs, "date_filtered", *date_inputs(gtfs, params, yyyymmdd)),
+        lambda: filter_by_date(gtfs, yyyymmdd),
+    )
+
+
+def segments_of(gtfs: dict, params: dict, unified=None):
+    """
+    geometry of segments between stops for time bins and aggregated routes,
+    None if not needed
+
+    Args:
+        gtfs (dict): the feed, not unified
+
+    Returns:
+        dict: (prev_stop_id, next_stop_id): coordinates
+    """
+    if not (params.get("time_bin_minutes") or route_segments_used(params, unified)):
+        return None
+    cache_key = ""
+    if unified is not None and params["unify"]:
+        # stop_ids of segments depend on how stops are unified
+        cache_key = "unified_" + params["delimiter"].encode("utf-8").hex()
+    return cached(
+        gtfs,
+        stage_key(gtfs, "segments", cache_key),
+        lambda: segment_coordinates(
+            get_segments(
+                unified_feed(gtfs, params, unified),
+                cache_key=cache_key,
+                compact=feed_stop_times(gtfs, params, unified),
+            )
+        ),
+    )
+
+
+def route_segments_used(params: dict, unified=None) -> bool:
+    """
+    aggregated routes follow segments of shapes, unless shapes are ignored or
+    Aggregator of gtfs_parser, whose stop_ids are not of the segments, is used
+    """
+    return unified is not None and not params["ignore_shapes"]
+
+
+def aggregator_feed(gtfs: dict) -> dict:
+    """
+    copy of gtfs for Aggregator, which replaces stop_times and adds columns to
+    stops of the feed given, not to change tables of cached stages
+    """
+    feed = gtfs.copy()
+    feed["stops"] = gtfs["stops"].copy()
+    feed["stop_times"] = gtfs["stop_times"].copy()
+    return feed
+
+
+def make_aggregator(gtfs: dict, params: dict, unified=None, yyyymmdd=""):
+    """
+    Frequency of unified stops, one of the same inputs is reused, or
+    Aggregator of gtfs_parser when unified is None, made on every run
+
+    Args:
+        gtfs (dict): the feed, not unified nor filtered
+        unified (pd.DataFrame, optional): of unify()
+        yyyymmdd (str, optional): trips running on the date only
+    """
+    if unified is None:
+        # not cached, Aggregator and tables derived from it hold its changes
+        return gtfs_parser.aggregate.Aggregator(
+            aggregator_feed(filter_dates(gtfs, params, yyyymmdd) if yyyymmdd else gtfs),
+            no_unify_stops=not params["unify"],
+            delimiter=params["delimiter"],
+            yyyymmdd="",
+            begin_time=params["begin_time"],
+            end_time=params["end_time"],
+        )
+    return cached(
+        gtfs,
+        stage_key(
+            gtfs,
+            "aggregator",
+            *date_inputs(gtfs, params, yyyymmdd),
+            params["begin_time"],
+            params["end_time"],
+        ),
+        lambda: Frequency(
+            gtfs,
+            unified,
+            yyyymmdd=yyyymmdd,
+            begin_time=params["begin_time"],
+            end_time=params["end_time"],
+            # Aggregator doesn't count stops when not unifying them
+            count_stops=params["unify"],
+            compact=feed_stop_times(gtfs, params),
+        ),
+    )
+
+
+def counted_stop_times(aggregator) -> int:
+    """stop times of the date and time window, counted by the aggregator"""
+    if isinstance(aggregator, Frequency):
+        return int(aggregator.mask.sum())
+    return len(aggregator.gtfs["stop_times"])
+
+
+def feed_stop_times(gtfs: dict, params: dict, unified=None):
+    """
+    stop_times of the whole feed, filtered by masks for every date and time
+
+    Args:
+        gtfs (dict): the feed, not unified
+        unified (pd.DataFrame, optional): of unify(), stop_ids are of unified
+            stops if given, for time bins
+    """
+    compact = cached(
+        gtfs,
+        stage_key(gtfs, "feed_stop_times"),
+        lambda: CompactStopTimes.from_feed(gtfs),
+    )
+    if unified is None or not params["unify"]:
+        return compact
+
+    return cached(
+        gtfs,
+        stage_key(gtfs, "feed_stop_times", *unify_inputs(params)),
+        lambda: compact.remap_stops(similar_stop_ids(unified, compact.stop_ids)),
+    )
+
+
+def result_table(aggregator, unified=None):
+    if unified is None:
+        return aggregator.gtfs["stops"][RESULT_COLUMNS]
+    return unified[RESULT_COLUMNS]
+
+
+def aggregate_dates(
+    gtfs: dict, params: dict, output_dir: str, is_canceled=None, enter=None, report=None
+) -> dict:
+    """
+    aggregate each date of params["dates"] to its own layers, suffixed by the
+    date. The feed is loaded and its stops are unified once for all dates, and
+    dates running the same set of services share one Aggregator.
+
+    Returns:
+        dict: aggregated_csv and aggregated_dates,
+            yyyymmdd: {aggregated_routes: str, aggregated_stops: str}
+    """
+    output_format = params.get("output_format", "GeoJSON")
+    precision = params.get("precision", GEOJSON_COORDINATE_PRECISION)
+
+    with stage(report, "unify") as record:
+        unified = unify(gtfs, params)
+        record["counts"]["stops"] = unified_stops_count(gtfs, unified)
+    with stage(report, "segments"):
+        segments = segments_of(gtfs, params, unified)
+    route_segments = segments if route_segments_used(params, unified) else None
+
+    calendar_index = get_calendar_index(gtfs)
+    dates_by_services = {}
+    for yyyymmdd in params["dates"]:
+        services = calendar_index.running_on(yyyymmdd).tobytes()
+        dates_by_services.setdefault(services, []).append(yyyymmdd)
+
+    written_files = {"aggregated_dates": {}}
+    aggregator = None
+    for dates in dates_by_services.values():
+        if is_canceled is not None and is_canceled():
+            raise CanceledError("aggregate")
+        with stage(report, "aggregator", date=dates[0]) as record:
+            aggregator = make_aggregator(gtfs, params, unified, dates[0])
+            record["counts"]["stop_times"] = counted_stop_times(aggregator)
+        for yyyymmdd in dates:
+            written_files["aggregated_dates"][yyyymmdd] = write_aggregated_layers(
+                aggregator,
+                output_dir,
+                output_format,
+                precision=precision,
+                suffix="_" + yyyymmdd,
+                simplify_tolerance=params.get(
+                    "simplify_tolerance", SIMPLIFY_TOLERANCE_DEGREE
+                ),
+                report=report,
+                yyyymmdd=yyyymmdd,
+                tiles=params.get("tiles", False),
+                workers=params.get("workers", 1),
+                segments=route_segments,
+            )
+            written_files["aggregated_dates"][yyyymmdd].update(
+                write_time_bins(
+                    gtfs,
+                    params,
+                    output_dir,
+                    yyyymmdd,
+                    suffix="_" + yyyymmdd,
+                    unified=unified,
+                    segments=segments,
+                    report=report,
+                )
+            )
+
+    if enter is not None:
+        enter("write")
+    written_files["aggregated_csv"] = write_result(
+        result_table(aggregator, unified), output_dir, output_format, report=report
+    )
+    return written_files
+
+
+def write_aggregated_layers(
+    aggregator,
+    output_dir: str,
+    output_format: str,
+    precision=None,
+    suffix="",
+    simplify_tolerance=SIMPLIFY_TOLERANCE_DEGREE,
+    report=None,
+    yyyymmdd="",
+    tiles=False,
+    workers=1,
+    segments=None,
+) -> dict:
+    """
+    Args:
+        yyyymmdd (str, optional): date of the aggregator, for the report
+        tiles (bool, optional): also write both layers as vector tiles
+        workers (int, optional): processes encoding the tiles
+        segments (dict, optional): of segments_of(), geometry of routes
+            between stops, straight lines if None
+
+    Returns:
+        dict: data sources of aggregated_routes, aggregated_stops and
+            aggregated_tiles
+    """
+    written_files = {
+        "aggregated_routes": layer_uri(
+            output_dir, "aggregated_routes" + suffix, output_format
+        ),
+        "aggregated_stops": layer_uri(
+            output_dir, "aggregated_stops" + suffix, output_format
+        ),
+    }
+    with stage(report, "aggregated_stops", date=yyyymmdd) as record:
+        stops = aggregator.read_interpolated_stops()
+        if tiles:
+            # written again as tiles
+            stops = list(stops)
+        record["counts"]["features"] = write_features(
+            written_files["aggregated_stops"],
+            stops,
+            output_format,
+            precision=precision,
+        )
+    with stage(report, "aggregated_routes", date=yyyymmdd) as record:
+        routes = aggregator.read_route_frequency()
+        if segments:
+            routes = with_segments(routes, segments)
+        if tiles:
+            routes = list(routes)
+        record["counts"]["features"] = write_features(
+            written_files["aggregated_routes"],
+            simplify_features(routes, simplify_tolerance),
+            output_format,
+            precision=precision,
+        )
+    written_files["aggregated_tiles"] = ""
+    if tiles:
+        written_files["aggregated_tiles"] = os.path.join(
+            output_dir, "aggregated" + suffix + ".mbtiles"
+        )
+        with stage(report, "tiles", date=yyyymmdd) as record:
+            record["counts"]["tiles"] = write_tiles(
+                written_files["aggregated_tiles"],
+                {"aggregated_routes": routes, "aggregated_stops": stops},
+                workers,
+            )
+    return written_files
+
+
+def write_tiles(path: str, layers: dict, workers: int) -> int:
+    """
+    write_mbtiles() with tiles encoded by worker processes; serially within
+    a worker process of aggregation, as feeds already run on the others
+
+    Returns:
+        int: number of tiles
+    """
+    if workers > 1 and multiprocessing.current_process().name == "MainProcess":
+        try:
+            return write_mbtiles(
+                path, layers, map_func=get_process_executor(workers).map
+            )
+        except (BrokenProcessPool, OSError):
+            # worker processes can't be spawned in this environment
+            shutdown_process_executor()
+    return write_mbtiles(path, layers)
+
+
+def write_time_bins(
+    gtfs: dict,
+    params: dict,
+    output_dir: str,
+    yyyymmdd: str,
+    suffix="",
+    unified=None,
+    segments=None,
+    report=None,
+) -> dict:
+    """
+    write trips and headways per time bin if params["time_bin_minutes"] is set
+
+    Args:
+        gtfs (dict): the feed, not unified nor filtered
+        unified (pd.DataFrame, optional): of unify(), counted by unified stops
+
+    Returns:
+        dict: data sources of time_bins_routes and time_bins_stops
+    """
+    bin_minutes = params.get("time_bin_minutes", 0)
+    if not bin_minutes:
+        return {"time_bins_routes": "", "time_bins_stops": ""}
+
+    output_format = params.get("output_format", "GeoJSON")
+    precision = params.get("precision", GEOJSON_COORDINATE_PRECISION)
+    written_files = {
+        "time_bins_routes": layer_uri(
+            output_dir, "time_bins_routes" + suffix, output_format
+        ),
+        "time_bins_stops": layer_uri(
+            output_dir, "time_bins_stops" + suffix, output_format
+        ),
+    }
+    # one compact of the feed for every date, filtered by masks
+    compact = feed_stop_times(gtfs, params, unified)
+    gtfs = unified_feed(gtfs, params, unified)
+    mask = None
+    if yyyymmdd:
+        with stage(report, "date_filter", date=yyyymmdd) as record:
+            # trips are filtered by the cached calendar index of the feed
+            running = trips_running(gtfs, compact.trip_ids, yyyymmdd)
+            mask = running[compact.trip_codes()]
+            record["counts"]["trips"] = int(running.sum())
+    time_filter = {
+        "yyyymmdd": yyyymmdd,
+        "begin_time": params["begin_time"],
+        "end_time": params["end_time"],
+        "compact": compact,
+        "mask": mask,
+    }
+    with stage(report, "time_bins", date=yyyymmdd) as record:
+        record["counts"]["stop_features"] = write_features(
+            written_files["time_bins_stops"],
+            read_binned_stops(gtfs, bin_minutes, **time_filter),
+            output_format,
+            precision=precision,
+        )
+        record["counts"]["route_features"] = write_features(
+            written_files["time_bins_routes"],
+            simplify_features(
+                read_binned_routes(gtfs, bin_minutes, segments=segments, **time_filter),
+                params.get("simplify_tolerance", SIMPLIFY_TOLERANCE_DEGREE),
+            ),
+            output_format,
+            precision=precision,
+        )
+    return written_files
+
+
+def write_result(result, output_dir: str, output_format: str, report=None) -> str:
+    """
+    Args:
+        result (pd.DataFrame): stop_id, stop_name, similar_stop_id, similar_stop_name
+
+    Returns:
+        str: data source of the result table
+    """
+    with stage(report, "result") as record:
+        record["counts"]["rows"] = len(result)
+        if output_format in ("GPKG", MEMORY_FORMAT):
+            # GeoPackage and memory layers hold tables without geometry as well
+            uri = layer_uri(output_dir, "result", output_format)
+            write_table(uri, result, output_format)
+            return uri
+
+        path = os.path.join(output_dir, "result.csv")
+        with open(path, mode="w", encoding="cp932", errors="ignore") as f:
+            result.to_csv(f, index=False)
+        return path
+
+
+def write_aggregated(
+    aggregator,
+    result,
+    output_dir: str,
+    output_format: str,
+    precision=None,
+    simplify_tolerance=SIMPLIFY_TOLERANCE_DEGREE,
+    report=None,
+    yyyymmdd="",
+    tiles=False,
+    workers=1,
+    segments=None,
+) -> dict:
+    """
+    Returns:
+        dict: data sources of aggregated_routes, aggregated_stops and aggregated_csv
+    """
+    written_files = write_aggregated_layers(
+        aggregator,
+        output_dir,
+        output_format,
+        precision=precision,
+        simplify_tolerance=simplify_tolerance,
+        report=report,
+        yyyymmdd=yyyymmdd,
+        tiles=tiles,
+        workers=workers,
+        segments=segments,
+    )
+    written_files["aggregated_csv"] = write_result(
+        result, output_dir, output_format, report=report
+    )
+    return written_files
+
+
+def aggregate_and_write(
+    gtfs: dict, params: dict, output_dir: str, is_canceled=None, enter=None, report=None
+) -> dict:
+    """
+    aggregate and write all aggregated outputs, module-level so that it can be
+    sent to a worker process
+
+    Returns:
+        dict: data sources of written files
+    """
+    if len(params.get("dates") or []) > 1:
+        return aggregate_dates(
+            gtfs,
+            params,
+            output_dir,
+            is_canceled=is_canceled,
+            enter=enter,
+            report=report,
+        )
+
+    with stage(report, "unify") as record:
+        unified = unify(gtfs, params)
+        record["counts"]["stops"] = unified_stops_count(gtfs, unified)
+    with stage(report, "segments"):
+        # segments are of the whole feed, cached regardless of the date
+        segments = segments_of(gtfs, params, unified)
+    with stage(report, "aggregator") as record:
+        aggregator = make_aggregator(gtfs, params, unified, params["yyyymmdd"])
+        record["counts"]["stop_times"] = counted_stop_times(aggregator)
+
+    if enter is not None:
+        enter("write")
+    written_files = write_aggregated(
+        aggregator,
+        result_table(aggregator, unified),
+        output_dir,
+        params.get("output_format", "GeoJSON"),
+        params.get("precision", GEOJSON_COORDINATE_PRECISION),
+        simplify_tolerance=params.get("simplify_tolerance", SIMPLIFY_TOLERANCE_DEGREE),
+        report=report,
+        yyyymmdd=params["yyyymmdd"],
+        tiles=params.get("tiles", False),
+        workers=params.get("workers", 1),
+        segments=segments if route_segments_used(params, unified) else None,
+    )
+    written_files.update(
+        write_time_bins(
+            gtfs,
+            params,
+            output_dir,
+            params["yyyymmdd"],
+            unified=unified,
+            segments=segments,
+            report=report,
+        )
+    )
+    return written_files
+
+
+def aggregate_in_worker(gtfs: dict, params: dict, output_dir: str):
+    """
+    aggregate_and_write() in a worker process
+
+    Returns:
+        tuple: written files and stages of the run report
+    """
+    report = RunReport("")
+    written_files = aggregate_and_write(gtfs, params, output_dir, report=report)
+    return written_files, report.stages
+
+
+def aggregate_in_subprocess(
+    gtfs: dict,
+    params: dict,
+    output_dir: str,
+    is_canceled=None,
+    enter=None,
+    report=None,
+) -> dict:
+    """
+    aggregate_and_write() in a worker process of the feed, stopped when the
+    run is canceled without stopping the workers of other feeds
+    """
+    # not of the shared executor: a running task of it can't be stopped alone
+    executor = make_process_executor(1)
+    try:
+        future = executor.submit(aggregate_in_worker, gtfs, params, output_dir)
+    except BrokenProcessPool:
+        # worker processes can't be spawned in this environment
+        shutdown_executor(executor)
+        return aggregate_and_write(
+            gtfs,
+            params,
+            output_dir,
+            is_canceled=is_canceled,
+            enter=enter,
+            report=report,
+        )
+    try:
+        with stage(report, "aggregate_in_subprocess"):
+            while not wait([future], timeout=0.5).done:
+                if is_canceled is not None and is_canceled():
+                    # the worker would keep on writing the outputs
+                    shutdown_executor(executor, terminate=True)
+                    remove_layers(
+                        output_dir,
+                        AGGREGATED_PREFIXES,
+                        params.get("output_format", "GeoJSON"),
+                    )
+                    raise CanceledError("aggregate")
+            written_files, stages = future.result()
+    finally:
+        shutdown_executor(executor)
+    if report is not None:
+        report.extend_worker(stages)
+    return written_files
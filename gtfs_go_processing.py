@@ -0,0 +1,276 @@
+"""
+QGIS Processing algorithms of GTFS-GO, with the same options as the CLI.
+
+Feeds are given as text, a path or URL of GTFS zip per line, so that many
+feeds are processed by one algorithm run; batch mode of Processing works too.
+"""
+
+import os
+
+from qgis.core import (
+    QgsProcessingAlgorithm,
+    QgsProcessingException,
+    QgsProcessingParameterBoolean,
+    QgsProcessingParameterEnum,
+    QgsProcessingParameterFolderDestination,
+    QgsProcessingParameterNumber,
+    QgsProcessingParameterString,
+    QgsProcessingProvider,
+)
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.PyQt.QtGui import QIcon
+
+from .gtfs_go_settings import (
+    OUTPUT_FORMATS,
+    PROCESSING_WORKERS,
+    PROCESSING_WORKERS_MAX,
+)
+
+
+class GTFSGoAlgorithm(QgsProcessingAlgorithm):
+    FEEDS = "FEEDS"
+    OUTPUT_DIR = "OUTPUT_DIR"
+    OUTPUT_FORMAT = "OUTPUT_FORMAT"
+    WORKERS = "WORKERS"
+
+    # run() options of this algorithm
+    AGGREGATE = False
+
+    def tr(self, message: str) -> str:
+        return QCoreApplication.translate("GTFSGoAlgorithm", message)
+
+    def createInstance(self):
+        return type(self)()
+
+    def group(self) -> str:
+        return ""
+
+    def groupId(self) -> str:
+        return ""
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(
+            QgsProcessingParameterString(
+                self.FEEDS,
+                self.tr("GTFS zip paths or URLs, one per line"),
+                multiLine=True,
+            )
+        )
+        self.init_options()
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.OUTPUT_FORMAT,
+                self.tr("Output format"),
+                options=list(OUTPUT_FORMATS),
+                defaultValue=0,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.WORKERS,
+                self.tr("Parallel feeds"),
+                minValue=1,
+                maxValue=PROCESSING_WORKERS_MAX,
+                defaultValue=PROCESSING_WORKERS,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFolderDestination(
+                self.OUTPUT_DIR, self.tr("Output directory")
+            )
+        )
+
+    def init_options(self):
+        pass
+
+    def get_options(self, parameters, context) -> dict:
+        return {}
+
+    def processAlgorithm(self, parameters, context, feedback):
+        # pandas and gtfs_parser load on the first run, not on QGIS startup
+        from . import gtfs_go_pipeline
+
+        paths = [
+            line.strip()
+            for line in self.parameterAsString(parameters, self.FEEDS, context).split(
+                "\n"
+            )
+            if line.strip()
+        ]
+        if not paths:
+            raise QgsProcessingException(self.tr("No feeds given"))
+        output_dir = self.parameterAsString(parameters, self.OUTPUT_DIR, context)
+        params = gtfs_go_pipeline.make_params(
+            output_dir,
+            aggregate=self.AGGREGATE,
+            simple=not self.AGGREGATE,
+            workers=self.parameterAsInt(parameters, self.WORKERS, context),
+            output_format=OUTPUT_FORMATS[
+                self.parameterAsEnum(parameters, self.OUTPUT_FORMAT, context)
+            ],
+            **self.get_options(parameters, context)
+        )
+
+        feed_infos = gtfs_go_pipeline.make_feed_infos(paths)
+        percents = {feed_info["group"]: 0.0 for feed_info in feed_infos}
+
+        def progress(feed_info: dict, stage: str, percent: float):
+            # called from worker threads, feedback is thread safe
+            if percents[feed_info["group"]] == 0.0 or percent >= 100.0:
+                feedback.pushInfo(feed_info["group"] + ": " + stage)
+            percents[feed_info["group"]] = percent
+            feedback.setProgress(sum(percents.values()) / len(percents))
+
+        try:
+            results = gtfs_go_pipeline.run_batch(
+                feed_infos, params, progress=progress, is_canceled=feedback.isCanceled
+            )
+        except gtfs_go_pipeline.CanceledError:
+            return {self.OUTPUT_DIR: output_dir}
+
+        for feed_info, _written_files, exception in results:
+            if exception is not None:
+                feedback.reportError(feed_info["group"] + ": " + str(exception))
+        if all(exception is not None for _, _, exception in results):
+            raise QgsProcessingException(self.tr("All feeds failed"))
+        return {self.OUTPUT_DIR: output_dir}
+
+
+class ExportFeedsAlgorithm(GTFSGoAlgorithm):
+    IGNORE_SHAPES = "IGNORE_SHAPES"
+    IGNORE_NO_ROUTE = "IGNORE_NO_ROUTE"
+
+    def name(self) -> str:
+        return "export_feeds"
+
+    def displayName(self) -> str:
+        return self.tr("Export routes and stops")
+
+    def shortHelpString(self) -> str:
+        return self.tr("Write routes and stops of GTFS feeds")
+
+    def init_options(self):
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.IGNORE_SHAPES, self.tr("Ignore shapes.txt"), defaultValue=False
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.IGNORE_NO_ROUTE,
+                self.tr("Ignore stops without routes"),
+                defaultValue=False,
+            )
+        )
+
+    def get_options(self, parameters, context) -> dict:
+        return {
+            "ignore_shapes": self.parameterAsBool(
+                parameters, self.IGNORE_SHAPES, context
+            ),
+            "ignore_no_route": self.parameterAsBool(
+                parameters, self.IGNORE_NO_ROUTE, context
+            ),
+        }
+
+
+class AggregateFrequencyAlgorithm(GTFSGoAlgorithm):
+    UNIFY = "UNIFY"
+    DELIMITER = "DELIMITER"
+    DATE = "DATE"
+    END_DATE = "END_DATE"
+    BEGIN_TIME = "BEGIN_TIME"
+    END_TIME = "END_TIME"
+    TIME_BIN = "TIME_BIN"
+    TILES = "TILES"
+
+    AGGREGATE = True
+
+    def name(self) -> str:
+        return "aggregate_frequency"
+
+    def displayName(self) -> str:
+        return self.tr("Aggregate route frequency")
+
+    def shortHelpString(self) -> str:
+        return self.tr(
+            "Aggregate frequency of routes and stops of GTFS feeds. "
+            "Dates are YYYYMMDD, each date from date to end date is aggregated "
+            "to its own layers. Times are HH:MM:SS."
+        )
+
+    def init_options(self):
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.UNIFY, self.tr("Unify similar stops"), defaultValue=True
+            )
+        )
+        for name, description in (
+            (self.DELIMITER, "stop_id delimiter"),
+            (self.DATE, "Filter by date"),
+            (self.END_DATE, "End date"),
+            (self.BEGIN_TIME, "Begin time"),
+            (self.END_TIME, "End time"),
+        ):
+            self.addParameter(
+                QgsProcessingParameterString(
+                    name, self.tr(description), defaultValue="", optional=True
+                )
+            )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.TIME_BIN,
+                self.tr("Time bins in minutes, 0 to skip"),
+                minValue=0,
+                defaultValue=0,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.TILES,
+                self.tr("Also write vector tiles (MBTiles)"),
+                defaultValue=False,
+            )
+        )
+
+    def get_options(self, parameters, context) -> dict:
+        from .gtfs_go_calendar import date_range
+
+        unify = self.parameterAsBool(parameters, self.UNIFY, context)
+        date = self.parameterAsString(parameters, self.DATE, context)
+        end_date = self.parameterAsString(parameters, self.END_DATE, context)
+        dates = []
+        if date:
+            dates = date_range(date, end_date) if end_date else [date]
+        return {
+            "unify": unify,
+            "delimiter": (
+                self.parameterAsString(parameters, self.DELIMITER, context)
+                if unify
+                else ""
+            ),
+            "dates": dates,
+            "begin_time": self.parameterAsString(
+                parameters, self.BEGIN_TIME, context
+            ).replace(":", ""),
+            "end_time": self.parameterAsString(
+                parameters, self.END_TIME, context
+            ).replace(":", ""),
+            "time_bin_minutes": self.parameterAsInt(parameters, self.TIME_BIN, context),
+            "tiles": self.parameterAsBool(parameters, self.TILES, context),
+        }
+
+
+class GTFSGoProvider(QgsProcessingProvider):
+    def id(self) -> str:
+        return "gtfsgo"
+
+    def name(self) -> str:
+        return "GTFS GO"
+
+    def icon(self):
+        return QIcon(os.path.join(os.path.dirname(__file__), "imgs", "busstop.png"))
+
+    def loadAlgorithms(self):
+        self.addAlgorithm(ExportFeedsAlgorithm())
+        self.addAlgorithm(AggregateFrequencyAlgorithm())
@@ -1,3 +1,5 @@
+import zlib
+
 from qgis.PyQt.QtCore import Qt
 from qgis.core import *
 from qgis.PyQt.QtGui import QColor
@@ -12,11 +14,53 @@ from .gtfs_go_settings import (
     ROUTES_OUTLINE_COLOR
 )
 
+# color of each route key, stable across layers and sessions
+_route_colors = {}
+# renderer and labeling of each QML file, cloned onto layers of the style
+_named_styles = {}
+
+
+def get_route_color(key, route_color=None):
+    """
+    color of a route: route_color of GTFS if valid,
+    otherwise picked from ROUTES_COLOR_LIST by a hash of key
+    """
+    if route_color:
+        color = QColor("#" + str(route_color).lstrip("#"))
+        if color.isValid():
+            return color
+    key = str(key)
+    if key not in _route_colors:
+        index = zlib.crc32(key.encode("utf-8")) % len(ROUTES_COLOR_LIST)
+        _route_colors[key] = QColor(ROUTES_COLOR_LIST[index])
+    return QColor(_route_colors[key])
 
-def get_random_color():
-    import random
-    random_index = random.randrange(0, len(ROUTES_COLOR_LIST) - 1, 1)
-    return QColor(ROUTES_COLOR_LIST[random_index])
+
+def apply_named_style(layer, qml_path):
+    """
+    style of a QML file on layer, as loadNamedStyle() but the file is read
+    and parsed once: later layers get clones of the renderer and labeling
+    """
+    style = _named_styles.get(qml_path)
+    if style is None:
+        layer.loadNamedStyle(qml_path)
+        if layer.renderer() is None:
+            # e.g. invalid layer, read again for the next one
+            return
+        _named_styles[qml_path] = {
+            "renderer": layer.renderer().clone(),
+            "labeling": layer.labeling().clone() if layer.labeling() else None,
+            "labels_enabled": layer.labelsEnabled(),
+            "blend_mode": layer.blendMode(),
+            "feature_blend_mode": layer.featureBlendMode(),
+        }
+        return
+    layer.setRenderer(style["renderer"].clone())
+    if style["labeling"] is not None:
+        layer.setLabeling(style["labeling"].clone())
+    layer.setLabelsEnabled(style["labels_enabled"])
+    layer.setBlendMode(style["blend_mode"])
+    layer.setFeatureBlendMode(style["feature_blend_mode"])
 
 
 class Renderer:
@@ -43,22 +87,68 @@ class Renderer:
             line_layer = symbol.symbolLayer(0)
             line_layer.setPenJoinStyle(Qt.RoundJoin)
             line_layer.setWidth(ROUTES_LINE_WIDTH_MM)
-            line_layer.setColor(get_random_color())
             outline_layer = symbol.symbolLayer(0).clone()
             outline_layer.setColor(QColor(ROUTES_OUTLINE_COLOR))
             outline_layer.setWidth(ROUTES_OUTLINE_WIDTH_MM)
             symbol.insertSymbolLayer(0, outline_layer)
         return symbol
 
+    def get_category_field(self):
+        # routes layers always have route_id, colors are keyed by it
+        if self.target_layer.fields().indexOf("route_id") >= 0:
+            return "route_id"
+        return self.target_field_name
+
+    def get_route_keys(self):
+        """
+        category values, queried as unique values from the provider
+        without iterating features
+
+        Returns:
+            list: sorted values of the category field, NULL excluded
+        """
+        index = self.target_layer.fields().indexOf(self.get_category_field())
+        values = self.target_layer.uniqueValues(index)
+        return sorted(str(value) for value in values
+                      if value is not None and value != NULL)
+
+    def get_route_colors(self):
+        """
+        route_color of each category value, written to routes layers from
+        the routes table of GTFS; only the two attributes are read
+
+        Returns:
+            dict: value: route_color, empty if the layer has no route_color
+        """
+        fields = self.target_layer.fields()
+        if fields.indexOf("route_color") < 0:
+            return {}
+        category_field = self.get_category_field()
+        request = QgsFeatureRequest()
+        request.setFlags(QgsFeatureRequest.NoGeometry)
+        request.setSubsetOfAttributes([category_field, "route_color"], fields)
+        route_colors = {}
+        for feature in self.target_layer.getFeatures(request):
+            route_color = feature.attribute("route_color")
+            if route_color is not None and route_color != NULL:
+                route_colors[str(feature.attribute(category_field))] = route_color
+        return route_colors
+
     def make_categories_by(self):
         categories = []
-        # get all target field value with removing dupulicates
-        target_field_values = set([feature.attribute(self.target_field_name)
-                                   for feature in self.target_layer.getFeatures()])
-        for value in target_field_values:
-            symbol = self.make_symbol()
+        route_colors = self.get_route_colors()
+        # symbols are cloned from one prototype, only the line color differs
+        prototype = self.make_symbol()
+        for value in self.get_route_keys():
+            symbol = prototype.clone()
+            symbol.symbolLayer(1).setColor(
+                get_route_color(value, route_colors.get(value)))
             category = QgsRendererCategory(value, symbol, value)
             categories.append(category)
+        # features without a value, e.g. shapes not used by any route
+        symbol = prototype.clone()
+        symbol.symbolLayer(1).setColor(get_route_color(""))
+        categories.append(QgsRendererCategory("", symbol, ""))
         return categories
 
     def make_renderer(self):
@@ -67,5 +157,5 @@ class Renderer:
         else:
             categories = self.make_categories_by()
             renderer = QgsCategorizedSymbolRenderer(
-                self.target_field_name, categories)
+                self.get_category_field(), categories)
         return renderer
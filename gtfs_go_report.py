@@ -0,0 +1,196 @@
+"""
+Per-stage timing and memory of a run, written as a report next to outputs.
+
+Each stage records wall time, peak RSS of the process while it ran (sampled
+by a thread) and counts such as rows or written features. With profile on,
+the whole run is captured by cProfile and dumped beside the report.
+"""
+
+import contextlib
+import cProfile
+import json
+import os
+import pstats
+import threading
+import time
+import uuid
+
+from .gtfs_go_settings import MEMORY_SAMPLING_INTERVAL_SEC, PROFILE_TOP_FUNCTIONS
+
+REPORT_FILENAME = "run_report.json"
+PROFILE_FILENAME = "run_profile.prof"
+
+
+def current_rss() -> int:
+    """resident set size of this process in bytes, 0 if unknown"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        # bundled with QGIS on Windows and macOS
+        import psutil
+
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        return 0
+
+
+class PeakRSS:
+    """max RSS while in the with block"""
+
+    def __init__(self, interval=MEMORY_SAMPLING_INTERVAL_SEC):
+        self.interval = interval
+        self.peak = 0
+
+    def __enter__(self):
+        self.peak = current_rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+
+class RunReport:
+    def __init__(self, name: str, profile=False):
+        """
+        Args:
+            name (str): name of the feed
+            profile (bool, optional): capture the run with cProfile
+        """
+        self.name = name
+        self.stages = []
+        self.profile = profile
+        self.profiler = None
+        self.profile_error = ""
+        self.begin = time.time()
+
+    @contextlib.contextmanager
+    def stage(self, name: str, **details):
+        """
+        time a stage, yields its record where counts of the stage are set
+        e.g. record["counts"]["features"] = 100
+
+        Args:
+            name (str): stage name, may repeat e.g. for each date
+            details: written to the stage if not empty, e.g. date
+        """
+        record = dict(name=name, **{k: v for k, v in details.items() if v})
+        record["counts"] = {}
+        self.stages.append(record)
+        begin = time.perf_counter()
+        rss = PeakRSS()
+        try:
+            with rss:
+                yield record
+        except BaseException as e:
+            record["error"] = type(e).__name__
+            raise
+        finally:
+            record["seconds"] = round(time.perf_counter() - begin, 4)
+            record["peak_rss_mb"] = round(rss.peak / 2**20, 1)
+
+    def extend_worker(self, stages: list):
+        """add stages recorded by a worker process, within the current stage"""
+        for stage in stages:
+            self.stages.append(dict(stage, worker=True))
+
+    def start_profile(self):
+        if not self.profile:
+            return
+        self.profiler = cProfile.Profile()
+        try:
+            self.profiler.enable()
+        except ValueError as e:
+            # only one profiler runs at a time, e.g. of another feed
+            self.profiler = None
+            self.profile_error = str(e)
+
+    def stop_profile(self):
+        if self.profiler is not None:
+            self.profiler.disable()
+
+    def profile_summary(self) -> list:
+        """functions of the longest cumulative time"""
+        stats = pstats.Stats(self.profiler).sort_stats("cumulative")
+        summary = []
+        for function in stats.fcn_list[:PROFILE_TOP_FUNCTIONS]:
+            _, calls, total, cumulative, _ = stats.stats[function]
+            summary.append(
+                {
+                    "function": pstats.func_std_string(function),
+                    "calls": calls,
+                    "tottime": round(total, 4),
+                    "cumtime": round(cumulative, 4),
+                }
+            )
+        return summary
+
+    def to_dict(self) -> dict:
+        report = {
+            "name": self.name,
+            "started_at": time.strftime(
+                "%Y-%m-%dT%H:%M:%S", time.localtime(self.begin)
+            ),
+            # stages of worker processes are within a stage of this process
+            "seconds": round(
+                sum(s.get("seconds", 0) for s in self.stages if not s.get("worker")),
+                4,
+            ),
+            "peak_rss_mb": max([s.get("peak_rss_mb", 0) for s in self.stages] + [0]),
+            "stages": self.stages,
+        }
+        if self.profiler is not None:
+            report["profile"] = self.profile_summary()
+        elif self.profile_error:
+            report["profile_error"] = self.profile_error
+        return report
+
+    def write(self, output_dir: str) -> str:
+        """
+        write the report, and the profile if captured, to output_dir
+
+        Returns:
+            str: path of the report
+        """
+        path = os.path.join(output_dir, REPORT_FILENAME)
+        report = self.to_dict()
+        if self.profiler is not None:
+            report["profile_path"] = os.path.join(output_dir, PROFILE_FILENAME)
+            self.profiler.dump_stats(report["profile_path"])
+        tmp_path = path + "." + uuid.uuid4().hex
+        with open(tmp_path, mode="w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+        return path
+
+    def summary_lines(self) -> list:
+        """one line per stage, for the message log"""
+        lines = []
+        for stage in self.stages:
+            counts = ", ".join(f"{k}={v}" for k, v in stage["counts"].items())
+            date = " " + stage["date"] if "date" in stage else ""
+            lines.append(
+                f"{self.name}: {stage['name']}{date} "
+                f"{stage.get('seconds', 0):.2f}s "
+                f"{stage.get('peak_rss_mb', 0):.0f}MB"
+                + (f" ({counts})" if counts else "")
+            )
+        return lines
+
+
+def stage(report, name: str, **details):
+    """report.stage() or a no-op context when report is None"""
+    if report is None:
+        return contextlib.nullcontext({"counts": {}})
+    return report.stage(name, **details)
@@ -0,0 +1,252 @@
+"""
+Geometry of segments between consecutive stops.
+
+Stops are snapped onto the shape of their trips by linear referencing,
+vectorized over all stops and shape edges of a shape, and the shape is
+sliced between the measures of consecutive stops. Trips without a shape get
+a straight line. Segments are computed once per feed and cached next to the
+parsed tables, and line geometries can be simplified by Douglas-Peucker.
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from .gtfs_go_feed import read_cached_table, write_table
+from .gtfs_go_stoptimes import CompactStopTimes, count_keys
+
+SEGMENTS_TABLE = "segments"
+
+
+def snap_to_shape(shape: np.ndarray, points: np.ndarray) -> np.ndarray:
+    """
+    Args:
+        shape (np.ndarray): (n, 2) vertices of a shape
+        points (np.ndarray): (k, 2) points to snap
+
+    Returns:
+        np.ndarray: distance along the shape of the nearest point of each
+    """
+    starts = shape[:-1]
+    edges = shape[1:] - starts
+    lengths = np.hypot(edges[:, 0], edges[:, 1])
+    measures = np.concatenate([[0.0], np.cumsum(lengths)])
+    if len(edges) == 0:
+        return np.zeros(len(points))
+
+    # (k, n-1): position of each point projected on each edge
+    relative = points[:, None, :] - starts[None, :, :]
+    squared = np.maximum(lengths**2, 1e-24)
+    t = np.clip((relative * edges[None, :, :]).sum(axis=2) / squared, 0.0, 1.0)
+    nearest = starts[None, :, :] + t[:, :, None] * edges[None, :, :]
+    distances = ((points[:, None, :] - nearest) ** 2).sum(axis=2)
+    edge = distances.argmin(axis=1)
+    return measures[edge] + t[np.arange(len(points)), edge] * lengths[edge]
+
+
+def slice_shape(shape: np.ndarray, measures: np.ndarray, begin: float, end: float):
+    """vertices of shape between begin and end measures, as a list of [lon, lat]"""
+    inner = shape[(measures > begin) & (measures < end)]
+    ends = np.array(
+        [
+            [np.interp(m, measures, shape[:, 0]), np.interp(m, measures, shape[:, 1])]
+            for m in (begin, end)
+        ]
+    )
+    return np.vstack([ends[:1], inner, ends[1:]]).tolist()
+
+
+def simplify(coordinates: list, tolerance: float) -> list:
+    """
+    Douglas-Peucker simplification of a line
+
+    Args:
+        coordinates (list): [lon, lat] of the line
+        tolerance (float): max distance of removed vertices, in degrees
+    """
+    points = np.asarray(coordinates, dtype=float)
+    if tolerance <= 0 or len(points) < 3:
+        return coordinates
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        edge = points[last] - points[first]
+        relative = points[first + 1 : last] - points[first]
+        length = np.hypot(edge[0], edge[1])
+        if length == 0:
+            distances = np.hypot(relative[:, 0], relative[:, 1])
+        else:
+            distances = (
+                np.abs(edge[0] * relative[:, 1] - edge[1] * relative[:, 0]) / length
+            )
+        farthest = int(distances.argmax())
+        if distances[farthest] > tolerance:
+            index = first + 1 + farthest
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return points[keep].tolist()
+
+
+def simplify_features(features, tolerance: float):
+    """yield features with their LineString or MultiLineString simplified"""
+    for feature in features:
+        geometry = feature.get("geometry") or {}
+        if tolerance > 0 and geometry.get("type") == "LineString":
+            geometry["coordinates"] = simplify(geometry["coordinates"], tolerance)
+        elif tolerance > 0 and geometry.get("type") == "MultiLineString":
+            geometry["coordinates"] = [
+                simplify(line, tolerance) for line in geometry["coordinates"]
+            ]
+        yield feature
+
+
+def build_segments(gtfs, compact=None) -> pd.DataFrame:
+    """
+    Args:
+        compact (CompactStopTimes, optional): of gtfs["stop_times"], built if None
+
+    Returns:
+        pd.DataFrame: prev_stop_id, next_stop_id, trips and coordinates as
+            JSON text, one geometry per pair of stops from its most used shape
+    """
+    trips = gtfs["trips"]
+    if compact is None:
+        compact = CompactStopTimes.from_feed(gtfs)
+    from_codes, to_codes, _ = compact.segments()
+
+    # shape of each segment by its trip, -1 if none
+    shape_ids = trips.set_index("trip_id")["shape_id"] if "shape_id" in trips else None
+    if shape_ids is None or "shapes" not in gtfs:
+        shape_codes = np.full(compact.n_trips, -1)
+        shape_names = np.array([])
+    else:
+        shape_of_trip = pd.Series(compact.trip_ids).map(shape_ids)
+        shape_codes, shape_names = pd.factorize(shape_of_trip)
+    trip_codes = compact.trip_codes()[compact.has_next()]
+    segment_shapes = shape_codes[trip_codes]
+
+    # one geometry per pair of stops, from the shape used by most trips
+    (from_codes, to_codes, segment_shapes), trips_count = count_keys(
+        [from_codes, to_codes, segment_shapes + 1],
+        [compact.n_stops, compact.n_stops, len(shape_names) + 1],
+    )
+    segment_shapes = segment_shapes - 1
+    order = np.lexsort((-trips_count, to_codes, from_codes))
+    first = np.ones(len(order), dtype=bool)
+    pairs = from_codes[order] * compact.n_stops + to_codes[order]
+    first[1:] = pairs[1:] != pairs[:-1]
+    selected = order[first]
+
+    stops = gtfs["stops"].drop_duplicates("stop_id").set_index("stop_id")
+    stops = stops.reindex(compact.stop_ids)
+    lonlat = stops[["stop_lon", "stop_lat"]].values.astype(float)
+
+    segments = pd.DataFrame(
+        {
+            "from_code": from_codes[selected],
+            "to_code": to_codes[selected],
+            "shape_code": segment_shapes[selected],
+            "trips": trips_count[selected],
+        }
+    )
+    segments["coordinates"] = [
+        [lonlat[f].tolist(), lonlat[t].tolist()]
+        for f, t in zip(segments["from_code"], segments["to_code"])
+    ]
+
+    if len(shape_names) > 0:
+        shapes = gtfs["shapes"].sort_values(["shape_id", "shape_pt_sequence"])
+        shape_lonlat = shapes[["shape_pt_lon", "shape_pt_lat"]].values.astype(float)
+        shape_rows = shapes.groupby("shape_id").indices
+        for shape_code, rows in segments[segments["shape_code"] >= 0].groupby(
+            "shape_code"
+        ):
+            vertices = shape_lonlat[
+                shape_rows.get(shape_names[shape_code], np.array([], dtype=int))
+            ]
+            if len(vertices) < 2:
+                continue
+            edges = np.diff(vertices, axis=0)
+            measures = np.concatenate(
+                [[0.0], np.cumsum(np.hypot(edges[:, 0], edges[:, 1]))]
+            )
+            begins = snap_to_shape(vertices, lonlat[rows["from_code"].values])
+            ends = snap_to_shape(vertices, lonlat[rows["to_code"].values])
+            for index, begin, end in zip(rows.index, begins, ends):
+                # backwards on the shape e.g. a loop, straight line is kept
+                if begin < end:
+                    segments.at[index, "coordinates"] = slice_shape(
+                        vertices, measures, begin, end
+                    )
+
+    return pd.DataFrame(
+        {
+            "prev_stop_id": compact.stop_ids[segments["from_code"].values],
+            "next_stop_id": compact.stop_ids[segments["to_code"].values],
+            "trips": segments["trips"].values,
+            "coordinates": [json.dumps(c) for c in segments["coordinates"]],
+        }
+    )
+
+
+def get_segments(gtfs, cache_key="", compact=None) -> pd.DataFrame:
+    """
+    segments of the feed, read from or written to the parsed feed cache
+
+    Args:
+        cache_key (str, optional): distinguishes segments of the same feed
+            with stops unified differently
+        compact (CompactStopTimes, optional): of gtfs["stop_times"], built if None
+    """
+    table_dir = getattr(gtfs, "table_dir", None)
+    name = SEGMENTS_TABLE + ("_" + cache_key if cache_key else "")
+    if table_dir is not None and os.path.exists(table_dir):
+        segments = read_cached_table(table_dir, name)
+        if segments is not None:
+            return segments
+
+    segments = build_segments(gtfs, compact)
+    if table_dir is not None:
+        try:
+            write_table(segments, table_dir, name)
+        except OSError:
+            pass
+    return segments
+
+
+def segment_coordinates(segments: pd.DataFrame) -> dict:
+    """
+    Returns:
+        dict: (prev_stop_id, next_stop_id): coordinates
+    """
+    return {
+        (prev_stop_id, next_stop_id): json.loads(coordinates)
+        for prev_stop_id, next_stop_id, coordinates in zip(
+            segments["prev_stop_id"], segments["next_stop_id"], segments["coordinates"]
+        )
+    }
+
+
+def with_segments(features, segments: dict):
+    """
+    yield LineString features between two stops with the geometry of their
+    segment, as they are if the segment is not found
+
+    Args:
+        segments (dict): of segment_coordinates()
+    """
+    for feature in features:
+        properties = feature["properties"]
+        coordinates = segments.get(
+            (properties["prev_stop_id"], properties["next_stop_id"])
+        )
+        if coordinates is not None:
+            feature["geometry"]["coordinates"] = coordinates
+        yield feature
@@ -12,8 +12,7 @@ STOPS_LABEL_MINUMUM_VISIBLE_SCALE = 50000
 STOPS_MINIMUM_VISIBLE_SCALE = 100000
 STOPS_ICON_SIZE_MM = 6
 STOPS_ICON_HALO_WIDTH_MM = 0.8
-STOPS_SVG_PATH = os.path.join(
-    os.path.dirname(__file__), "imgs", "busstop.svg")
+STOPS_SVG_PATH = os.path.join(os.path.dirname(__file__), "imgs", "busstop.svg")
 
 ROUTES_LINE_WIDTH_MM = 1.2
 ROUTES_OUTLINE_WIDTH_MM = 2.0
@@ -33,5 +32,73 @@ ROUTES_COLOR_LIST = [
     "lightpink",
     "royalblue",
     "palevioletred",
-    "gold"
+    "gold",
 ]
+
+# number of feeds processed concurrently (default value of workersSpinBox)
+PROCESSING_WORKERS = max(1, (os.cpu_count() or 1) // 2)
+PROCESSING_WORKERS_MAX = 16
+# run Aggregator in worker processes so that feeds aggregate on multiple cores
+AGGREGATE_IN_SUBPROCESS = True
+
+# persistent cache of downloaded feeds
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "GTFSGo")
+FEED_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+# features added to a memory layer, or saved from it, at once
+MEMORY_BATCH_SIZE = 10000
+# .ui files compiled to python, imported instead of parsing the XML each time
+UI_CACHE_DIR = os.path.join(CACHE_DIR, "ui")
+# parsed tables of recently used feeds, to skip re-parsing on reruns
+PARSED_CACHE_MAX_FEEDS = 8
+# file formats of outputs, written by gtfs_go_writer
+OUTPUT_FORMATS = ("GeoJSON", "GPKG", "FlatGeobuf")
+# QGIS memory layers instead of files, for the dialog only: see gtfs_go_memory
+MEMORY_FORMAT = "Memory"
+MEMORY_URI_PREFIX = "memory:"
+# decimal places of coordinates in written GeoJSON, 6 is about 0.1m
+GEOJSON_COORDINATE_PRECISION = 6
+# Japan DPF search responses are reused for this period
+DPF_CACHE_TTL_SEC = 60 * 60
+# stops of feeds fetched at once when syncing the Japan DPF catalog
+DPF_SYNC_WORKERS = 8
+# unify similar stops once per feed (vectorized) and count frequencies in the
+# plugin, as Aggregator does; Aggregator of gtfs_parser is used if False
+VECTORIZED_STOP_UNIFICATION = True
+# number of dates of a date range aggregated in one run
+AGGREGATION_DATES_MAX = 31
+# default length of time bins of hourly profile outputs
+TIME_BIN_MINUTES = 60
+# Douglas-Peucker tolerance of written lines in degrees, 0 to keep all vertices
+SIMPLIFY_TOLERANCE_DEGREE = 0.0
+# interval of sampling memory use of stages for run reports
+MEMORY_SAMPLING_INTERVAL_SEC = 0.01
+# functions of the longest cumulative time listed in run reports when profiled
+PROFILE_TOP_FUNCTIONS = 30
+# memory of stage results kept for reruns in the session, e.g. unified stops
+STAGE_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+# threads parsing members of a feed and chunks of large members
+INGEST_WORKERS = os.cpu_count() or 1
+# tables parsed at once when a feed is loaded, if the enabled stages read
+# them whole; others are read on first use
+PRELOAD_TABLES = (
+    "agency",
+    "stops",
+    "routes",
+    "trips",
+    "stop_times",
+    "calendar",
+    "calendar_dates",
+    "shapes",
+)
+# vector tiles of aggregated layers, zoom levels of MBTiles
+TILES_MIN_ZOOM = 4
+TILES_MAX_ZOOM = 14
+# resolution of a tile and the margin around it, in tile units
+TILE_EXTENT = 4096
+TILE_BUFFER = 64
+# features of a layer in a tile, less frequent ones are dropped at small scales
+TILE_MAX_FEATURES = 2000
+# simplification tolerance of each zoom, in pixels of 256 pixel tiles
+TILES_SIMPLIFY_PIXELS = 1.0
+# tiles encoded by a worker process at once
+TILES_PER_JOB = 64
@@ -0,0 +1,146 @@
+"""
+Content-keyed results of pipeline stages, reused by reruns.
+
+A stage result is keyed by the sha256 of the feed and the inputs of the
+stage, e.g. unified stops by the delimiter, so that a rerun changing only the
+time filter recomputes only the stages after the date filter. Results are
+kept in memory for the session, least recently used ones are dropped over
+STAGE_CACHE_MAX_BYTES. Tabular results are also written next to the parsed
+tables of the feed, to be reused by later sessions. Feeds themselves are not
+kept: a batch of feeds holds only the results derived from them.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from .gtfs_go_feed import file_sha256, load_gtfs, read_cached_table, write_table
+from .gtfs_go_settings import STAGE_CACHE_MAX_BYTES
+
+# shared by feeds processed in parallel threads
+_lock = threading.Lock()
+# (sha256 of feed, stage key): result, least recently used first
+_results = OrderedDict()
+
+
+def feed_key(gtfs) -> str:
+    """sha256 of the feed, empty if the feed is not cached on disk"""
+    table_dir = getattr(gtfs, "table_dir", None)
+    return "" if table_dir is None else os.path.basename(table_dir)
+
+
+def stage_key(gtfs, stage: str, *inputs) -> str:
+    """
+    Args:
+        gtfs: feed the stage runs on
+        stage (str): stage name
+        inputs: JSON serializable inputs of the stage
+
+    Returns:
+        str: key of the result, empty if the result must not be cached
+    """
+    if not feed_key(gtfs):
+        return ""
+    digest = hashlib.sha256(json.dumps(inputs).encode("utf-8")).hexdigest()
+    return stage + "_" + digest[:16]
+
+
+def estimate_bytes(value, depth=0) -> int:
+    """approximate memory of tables and arrays held by a stage result"""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=False, deep=True).sum())
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if depth > 2:
+        return 0
+    if isinstance(value, dict):
+        return sum(estimate_bytes(v, depth + 1) for v in value.values())
+    if isinstance(value, (tuple, list)):
+        return sum(estimate_bytes(v, depth + 1) for v in value)
+    if hasattr(value, "__dict__"):
+        return sum(estimate_bytes(v, depth + 1) for v in vars(value).values())
+    return 0
+
+
+def get_result(feed: str, key: str):
+    with _lock:
+        if (feed, key) not in _results:
+            return None
+        _results.move_to_end((feed, key))
+        return _results[(feed, key)]
+
+
+def put_result(feed: str, key: str, value):
+    with _lock:
+        _results[(feed, key)] = value
+        _results.move_to_end((feed, key))
+        # estimated on every put: tables of a feed are loaded after it's cached
+        sizes = OrderedDict((k, estimate_bytes(v)) for k, v in _results.items())
+        total = sum(sizes.values())
+        # the newest result is kept even if it's larger than the limit
+        for k, size in sizes.items():
+            if total <= STAGE_CACHE_MAX_BYTES or k == (feed, key):
+                break
+            del _results[k]
+            total -= size
+
+
+def clear():
+    with _lock:
+        _results.clear()
+
+
+def cached(gtfs, key: str, compute):
+    """
+    result of a stage from memory, or of compute() kept in memory
+
+    Args:
+        key (str): from stage_key(), compute() runs every time if empty
+        compute (callable): computes the result of the stage
+    """
+    if not key:
+        return compute()
+    value = get_result(feed_key(gtfs), key)
+    if value is None:
+        value = compute()
+        put_result(feed_key(gtfs), key, value)
+    return value
+
+
+def cached_table(gtfs, key: str, compute) -> pd.DataFrame:
+    """cached() for a table, also read from or written to the feed cache"""
+    table_dir = getattr(gtfs, "table_dir", None)
+    if not key:
+        return compute()
+
+    def read_or_compute():
+        if table_dir is not None and os.path.exists(table_dir):
+            df = read_cached_table(table_dir, key)
+            if df is not None:
+                return df
+        df = compute()
+        if table_dir is not None:
+            try:
+                write_table(df, table_dir, key)
+            except OSError:
+                pass
+        return df
+
+    return cached(gtfs, key, read_or_compute)
+
+
+def load_feed(zip_path: str, cache_dir: str, max_feeds: int):
+    """
+    load_gtfs() of a run, not kept in memory after it: tables of the same
+    content are read from cache_dir by later runs, and stage results derived
+    from them are kept by their keys
+
+    Returns:
+        GTFSFeed: of the run
+    """
+    return load_gtfs(zip_path, cache_dir, max_feeds, digest=file_sha256(zip_path))
@@ -0,0 +1,221 @@
+"""
+Compact, integer-encoded stop_times for counting trips.
+
+trip_id and stop_id are coded to int32, times to int32 seconds from midnight
+(past 24:00 as they are) and stop times are sorted by trip and stop_sequence
+so that each trip is a slice given by CSR-style offsets. Counting is done
+with np.unique over int64 keys packed from several code arrays, e.g.
+(from stop, to stop) of segments, instead of groupby over string columns.
+"""
+
+import numpy as np
+import pandas as pd
+
+from .gtfs_go_feed import read_table, time_to_seconds
+
+# columns of stop_times read by from_feed()
+STOP_TIMES_COLUMNS = [
+    "trip_id",
+    "stop_id",
+    "stop_sequence",
+    "arrival_time",
+    "departure_time",
+]
+
+
+def pack_keys(codes: list, sizes: list) -> np.ndarray:
+    """
+    pack code arrays into one int64 key, mixed-radix by sizes
+
+    Args:
+        codes (list): int arrays of the same length, 0 <= codes[i] < sizes[i]
+        sizes (list): number of distinct values of each code array
+    """
+    if np.prod([float(size) for size in sizes]) >= 2**63:
+        raise OverflowError("too many distinct values to pack into int64")
+    keys = np.zeros(len(codes[0]), dtype="int64")
+    for code, size in zip(codes, sizes):
+        keys = keys * size + code
+    return keys
+
+
+def unpack_keys(keys: np.ndarray, sizes: list) -> list:
+    codes = []
+    for size in reversed(sizes):
+        codes.append(keys % size)
+        keys = keys // size
+    return codes[::-1]
+
+
+def count_keys(codes: list, sizes: list):
+    """
+    Returns:
+        tuple: distinct combinations of codes as a list of arrays, and counts
+    """
+    keys, counts = np.unique(pack_keys(codes, sizes), return_counts=True)
+    return unpack_keys(keys, sizes), counts
+
+
+def seconds_of(times: pd.Series) -> np.ndarray:
+    if pd.api.types.is_integer_dtype(times):
+        return times.values
+    return time_to_seconds(times).values
+
+
+class CompactStopTimes:
+    def __init__(
+        self,
+        trip_ids: np.ndarray,
+        stop_ids: np.ndarray,
+        offsets: np.ndarray,
+        stop_codes: np.ndarray,
+        seconds: np.ndarray,
+    ):
+        """
+        Args:
+            trip_ids (np.ndarray): trip_id of each trip code
+            stop_ids (np.ndarray): stop_id of each stop code
+            offsets (np.ndarray): stop times of trip i are offsets[i]:offsets[i+1]
+            stop_codes (np.ndarray): int32 stop code of each stop time
+            seconds (np.ndarray): int32 departure, or arrival if blank, -1 if both
+        """
+        self.trip_ids = trip_ids
+        self.stop_ids = stop_ids
+        self.offsets = offsets
+        self.stop_codes = stop_codes
+        self.seconds = seconds
+
+    @classmethod
+    def from_feed(cls, gtfs):
+        """from the columns of stop_times needed only, in compact dtypes"""
+        return cls.from_table(
+            read_table(gtfs, "stop_times", STOP_TIMES_COLUMNS, compact=True)
+        )
+
+    @classmethod
+    def from_table(cls, stop_times: pd.DataFrame):
+        """
+        Args:
+            stop_times (pd.DataFrame): as parsed, or with times in int seconds
+                by compact_dtypes()
+        """
+        stop_times = stop_times[
+            stop_times["trip_id"].notna() & stop_times["stop_id"].notna()
+        ]
+        trip_codes, trip_ids = pd.factorize(stop_times["trip_id"], sort=True)
+        stop_codes, stop_ids = pd.factorize(stop_times["stop_id"], sort=True)
+        stop_sequence = pd.to_numeric(stop_times["stop_sequence"]).values
+        order = np.lexsort((stop_sequence, trip_codes))
+
+        seconds = seconds_of(stop_times["departure_time"])
+        if "arrival_time" in stop_times.columns:
+            # departure_time may be blank when arrival_time is given
+            seconds = np.where(
+                seconds < 0, seconds_of(stop_times["arrival_time"]), seconds
+            )
+
+        offsets = np.zeros(len(trip_ids) + 1, dtype="int64")
+        np.cumsum(np.bincount(trip_codes, minlength=len(trip_ids)), out=offsets[1:])
+        return cls(
+            np.asarray(trip_ids),
+            np.asarray(stop_ids),
+            offsets,
+            stop_codes[order].astype("int32"),
+            seconds[order].astype("int32"),
+        )
+
+    def remap_stops(self, stop_ids: np.ndarray):
+        """
+        Args:
+            stop_ids (np.ndarray): new stop_id of each stop code, e.g. of the
+                unified stop, stops of the same new stop_id share a code
+
+        Returns:
+            CompactStopTimes: of the same trips and times
+        """
+        codes, new_stop_ids = pd.factorize(pd.Series(stop_ids, dtype=object), sort=True)
+        return CompactStopTimes(
+            self.trip_ids,
+            np.asarray(new_stop_ids),
+            self.offsets,
+            codes[self.stop_codes].astype("int32"),
+            self.seconds,
+        )
+
+    def __len__(self) -> int:
+        return len(self.stop_codes)
+
+    @property
+    def n_trips(self) -> int:
+        return len(self.trip_ids)
+
+    @property
+    def n_stops(self) -> int:
+        return len(self.stop_ids)
+
+    def trip_codes(self) -> np.ndarray:
+        return np.repeat(np.arange(self.n_trips, dtype="int32"), np.diff(self.offsets))
+
+    def has_next(self) -> np.ndarray:
+        """True for stop times followed by another stop of the same trip"""
+        has_next = np.ones(len(self), dtype=bool)
+        # last stop time of each non-empty trip
+        ends = self.offsets[1:][np.diff(self.offsets) > 0] - 1
+        has_next[ends] = False
+        return has_next
+
+    def time_mask(self, begin_seconds=None, end_seconds=None) -> np.ndarray:
+        """stop times with a known time in [begin_seconds, end_seconds)"""
+        valid = self.seconds >= 0
+        if begin_seconds is not None:
+            valid &= self.seconds >= begin_seconds
+        if end_seconds is not None:
+            valid &= self.seconds < end_seconds
+        return valid
+
+    def segments(self, mask=None):
+        """
+        consecutive pairs of stops of each trip
+
+        Args:
+            mask (np.ndarray, optional): bool by stop time, of the from stop
+
+        Returns:
+            tuple: from stop codes, to stop codes and departure seconds at from
+        """
+        is_from = self.has_next()
+        if mask is not None:
+            is_from &= mask
+        from_index = np.flatnonzero(is_from)
+        return (
+            self.stop_codes[from_index],
+            self.stop_codes[from_index + 1],
+            self.seconds[from_index],
+        )
+
+    def stop_counts(self, mask=None) -> pd.DataFrame:
+        """
+        Returns:
+            pd.DataFrame: stop_id and number of stop times
+        """
+        stop_codes = self.stop_codes if mask is None else self.stop_codes[mask]
+        counts = np.bincount(stop_codes, minlength=self.n_stops)
+        used = np.flatnonzero(counts)
+        return pd.DataFrame({"stop_id": self.stop_ids[used], "trips": counts[used]})
+
+    def segment_counts(self, mask=None) -> pd.DataFrame:
+        """
+        Returns:
+            pd.DataFrame: prev_stop_id, next_stop_id and number of trips
+        """
+        from_codes, to_codes, _ = self.segments(mask)
+        (from_codes, to_codes), counts = count_keys(
+            [from_codes, to_codes], [self.n_stops, self.n_stops]
+        )
+        return pd.DataFrame(
+            {
+                "prev_stop_id": self.stop_ids[from_codes],
+                "next_stop_id": self.stop_ids[to_codes],
+                "trips": counts,
+            }
+        )
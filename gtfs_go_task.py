@@ -0,0 +1,62 @@
+from qgis.core import Qgis, QgsMessageLog, QgsTask
+
+from . import gtfs_go_pipeline
+from .gtfs_go_report import RunReport
+
+MESSAGE_TAG = "GTFS-GO"
+
+
+class GTFSGoTask(QgsTask):
+    """
+    Run the pipeline of a feed in the background,
+    layers are registered by the caller on taskCompleted (main thread)
+    """
+
+    def __init__(self, feed_info: dict, params: dict):
+        super().__init__("GTFS-GO: " + feed_info["group"], QgsTask.CanCancel)
+        self.feed_info = feed_info
+        self.params = params
+        self.stage = ""
+        self.written_files = None
+        self.exception = None
+        # stages of the pipeline, and of adding layers by the caller
+        self.report = RunReport(
+            feed_info["group"], profile=params.get("profile", False)
+        )
+
+    def on_progress(self, stage: str, percent: float):
+        if stage != self.stage:
+            self.stage = stage
+            QgsMessageLog.logMessage(
+                f"{self.feed_info['group']}: {stage}", MESSAGE_TAG, Qgis.Info
+            )
+        self.setProgress(percent)
+
+    def run(self):
+        try:
+            self.written_files = gtfs_go_pipeline.run(
+                dict(self.feed_info),
+                self.params,
+                progress=self.on_progress,
+                is_canceled=self.isCanceled,
+                report=self.report,
+            )
+        except gtfs_go_pipeline.CanceledError:
+            return False
+        except Exception as e:
+            self.exception = e
+            return False
+        return True
+
+    def finished(self, result: bool):
+        if self.exception is not None:
+            QgsMessageLog.logMessage(
+                f"{self.feed_info['group']}: failed at {self.stage}: {self.exception}",
+                MESSAGE_TAG,
+                Qgis.Critical,
+            )
+            self.log_report()
+
+    def log_report(self):
+        for line in self.report.summary_lines():
+            QgsMessageLog.logMessage(line, MESSAGE_TAG, Qgis.Info)
@@ -0,0 +1,694 @@
+"""
+Vector tiles of aggregated layers, written to an MBTiles archive.
+
+Features are projected to Web Mercator once, then for each zoom simplified by
+TILES_SIMPLIFY_PIXELS, dropped if smaller than that, and assigned to the
+tiles their bounding box touches. Tiles are clipped and encoded as Mapbox
+Vector Tiles in jobs of TILES_PER_JOB tiles, which may run in worker
+processes. Each layer of a tile keeps at most TILE_MAX_FEATURES features,
+most frequent first, so that low zoom tiles of large areas stay light.
+
+The encoder covers what the aggregated layers need: points and lines with
+string, number and boolean attributes.
+"""
+
+import gzip
+import json
+import math
+import os
+import sqlite3
+import struct
+import uuid
+
+from .gtfs_go_segments import simplify
+from .gtfs_go_settings import (
+    TILE_BUFFER,
+    TILE_EXTENT,
+    TILE_MAX_FEATURES,
+    TILES_MAX_ZOOM,
+    TILES_MIN_ZOOM,
+    TILES_PER_JOB,
+    TILES_SIMPLIFY_PIXELS,
+)
+
+# features of a layer are ranked by this field, the rest rank 0
+RANK_FIELDS = {"aggregated_routes": "frequency", "aggregated_stops": "count"}
+
+# geometry types of MVT
+POINT = 1
+LINESTRING = 2
+
+# latitude of the square Web Mercator world
+MAX_LATITUDE = 85.0511287798
+
+
+def project(lon: float, lat: float) -> tuple:
+    """Web Mercator of the world as 0-1, y downward"""
+    lat = max(min(lat, MAX_LATITUDE), -MAX_LATITUDE)
+    sin = math.sin(math.radians(lat))
+    return (
+        (lon + 180.0) / 360.0,
+        0.5 - math.log((1 + sin) / (1 - sin)) / (4 * math.pi),
+    )
+
+
+def prepare(features, rank_field=None) -> tuple:
+    """
+    Args:
+        features (iterable): GeoJSON features of points or lines
+
+    Returns:
+        tuple: list of (type, parts of projected points, properties, rank),
+            bounds of the features in degrees or None
+    """
+    prepared = []
+    lons, lats = [], []
+    for feature in features:
+        geometry = feature.get("geometry") or {}
+        if geometry.get("type") == "Point":
+            geometry_type, lines = POINT, [[geometry["coordinates"]]]
+        elif geometry.get("type") == "MultiPoint":
+            geometry_type, lines = POINT, [geometry["coordinates"]]
+        elif geometry.get("type") == "LineString":
+            geometry_type, lines = LINESTRING, [geometry["coordinates"]]
+        elif geometry.get("type") == "MultiLineString":
+            geometry_type, lines = LINESTRING, geometry["coordinates"]
+        else:
+            continue
+        for line in lines:
+            lons.extend(c[0] for c in line)
+            lats.extend(c[1] for c in line)
+        properties = feature.get("properties") or {}
+        rank = properties.get(rank_field) if rank_field else None
+        prepared.append(
+            (
+                geometry_type,
+                [[project(c[0], c[1]) for c in line] for line in lines],
+                properties,
+                rank if isinstance(rank, (int, float)) else 0,
+            )
+        )
+    bounds = (min(lons), min(lats), max(lons), max(lats)) if lons else None
+    return prepared, bounds
+
+
+def zoom_jobs(layers: dict, z: int, tiles_per_job=TILES_PER_JOB):
+    """
+    yield jobs of encode_tiles() for a zoom
+
+    Args:
+        layers (dict): features of prepare() by layer name
+    """
+    n = 2**z
+    # 256 pixels a tile as of web maps
+    tolerance = TILES_SIMPLIFY_PIXELS / (256 * n)
+    buffer = TILE_BUFFER / TILE_EXTENT
+    tiles = {}
+    for name, features in layers.items():
+        for geometry_type, parts, properties, rank in features:
+            if geometry_type == LINESTRING:
+                parts = [
+                    simplify(part, tolerance) if len(part) > 2 else part
+                    for part in parts
+                ]
+            xs = [p[0] for part in parts for p in part]
+            ys = [p[1] for part in parts for p in part]
+            if (
+                geometry_type == LINESTRING
+                and max(xs) - min(xs) < tolerance
+                and max(ys) - min(ys) < tolerance
+            ):
+                # smaller than a pixel at this zoom
+                continue
+            feature = (geometry_type, parts, properties, rank)
+            for x in range(
+                max(0, int(math.floor(min(xs) * n - buffer))),
+                min(n - 1, int(math.floor(max(xs) * n + buffer))) + 1,
+            ):
+                for y in range(
+                    max(0, int(math.floor(min(ys) * n - buffer))),
+                    min(n - 1, int(math.floor(max(ys) * n + buffer))) + 1,
+                ):
+                    tiles.setdefault((x, y), {}).setdefault(name, []).append(feature)
+
+    for tile_layers in tiles.values():
+        for features in tile_layers.values():
+            # most frequent first, the rest is dropped before sending to workers
+            features.sort(key=lambda feature: -feature[3])
+            del features[TILE_MAX_FEATURES:]
+    items = sorted(tiles.items())
+    for i in range(0, len(items), tiles_per_job):
+        yield z, items[i : i + tiles_per_job]
+
+
+def clip_segment(x0, y0, x1, y1, low: float, high: float):
+    """Liang-Barsky clipping of a segment to a square, None if outside"""
+    t0, t1 = 0.0, 1.0
+    dx, dy = x1 - x0, y1 - y0
+    for p, q in ((-dx, x0 - low), (dx, high - x0), (-dy, y0 - low), (dy, high - y0)):
+        if p == 0:
+            if q < 0:
+                return None
+            continue
+        t = q / p
+        if p < 0:
+            if t > t1:
+                return None
+            t0 = max(t0, t)
+        else:
+            if t < t0:
+                return None
+            t1 = min(t1, t)
+    # ends inside are returned as is, to join with the next segment
+    start = (x0, y0) if t0 == 0 else (x0 + t0 * dx, y0 + t0 * dy)
+    end = (x1, y1) if t1 == 1 else (x0 + t1 * dx, y0 + t1 * dy)
+    return start, end
+
+
+def clip_line(points: list, low: float, high: float) -> list:
+    """parts of a line inside a square"""
+    pieces = []
+    current = []
+    for (x0, y0), (x1, y1) in zip(points, points[1:]):
+        clipped = clip_segment(x0, y0, x1, y1, low, high)
+        if clipped is None:
+            continue
+        start, end = clipped
+        if not current or current[-1] != start:
+            if len(current) > 1:
+                pieces.append(current)
+            current = [start]
+        current.append(end)
+    if len(current) > 1:
+        pieces.append(current)
+    return pieces
+
+
+def tile_points(points: list, low: float, high: float) -> list:
+    """points inside a tile, in integer tile coordinates"""
+    return [
+        (int(round(px)), int(round(py)))
+        for px, py in points
+        if low <= px <= high and low <= py <= high
+    ]
+
+
+def tile_lines(points: list, low: float, high: float) -> list:
+    """parts of a line inside a tile, in integer tile coordinates"""
+    lines = []
+    for piece in clip_line(points, low, high):
+        line = []
+        for px, py in piece:
+            point = (int(round(px)), int(round(py)))
+            if not line or line[-1] != point:
+                line.append(point)
+        if len(line) > 1:
+            lines.append(line)
+    return lines
+
+
+def point_commands(points: list) -> list:
+    commands = []
+    cursor = (0, 0)
+    if points:
+        commands.append(command(1, len(points)))
+    for point in points:
+        commands.extend(delta(cursor, point))
+        cursor = point
+    return commands
+
+
+def line_commands(lines: list) -> list:
+    commands = []
+    cursor = (0, 0)
+    for line in lines:
+        commands.append(command(1, 1))
+        commands.extend(delta(cursor, line[0]))
+        commands.append(command(2, len(line) - 1))
+        for a, b in zip(line, line[1:]):
+            commands.extend(delta(a, b))
+        cursor = line[-1]
+    return commands
+
+
+def tile_geometry(geometry_type: int, parts: list, x: int, y: int, n: int) -> list:
+    """
+    geometry commands of a feature in a tile
+
+    Returns:
+        list: MVT commands and zigzag parameters, empty if outside the tile
+    """
+    low, high = -TILE_BUFFER, TILE_EXTENT + TILE_BUFFER
+    parts = [
+        [((p[0] * n - x) * TILE_EXTENT, (p[1] * n - y) * TILE_EXTENT) for p in part]
+        for part in parts
+    ]
+    if geometry_type == POINT:
+        return point_commands(
+            [point for part in parts for point in tile_points(part, low, high)]
+        )
+    return line_commands(
+        [line for part in parts for line in tile_lines(part, low, high)]
+    )
+
+
+def command(command_id: int, count: int) -> int:
+    return (command_id & 0x7) | (count << 3)
+
+
+def zigzag(n: int) -> int:
+    return n << 1 if n >= 0 else (-n << 1) - 1
+
+
+def delta(a: tuple, b: tuple) -> list:
+    return [zigzag(b[0] - a[0]), zigzag(b[1] - a[1])]
+
+
+def varint(n: int) -> bytes:
+    out = bytearray()
+    while True:
+        bits = n & 0x7F
+        n >>= 7
+        if n:
+            out.append(bits | 0x80)
+        else:
+            out.append(bits)
+            return bytes(out)
+
+
+def message(field: int, data: bytes) -> bytes:
+    """length-delimited field"""
+    return varint(field << 3 | 2) + varint(len(data)) + data
+
+
+def packed(field: int, values: list) -> bytes:
+    return message(field, b"".join(varint(v) for v in values))
+
+
+def encode_value(value) -> bytes:
+    """Value message of MVT"""
+    if isinstance(value, bool):
+        return varint(7 << 3) + varint(int(value))
+    if isinstance(value, int):
+        if value >= 0:
+            return varint(5 << 3) + varint(value)
+        return varint(6 << 3) + varint(zigzag(value))
+    if isinstance(value, float):
+        return varint(3 << 3 | 1) + struct.pack("<d", value)
+    if not isinstance(value, str):
+        value = json.dumps(value, ensure_ascii=False)
+    return message(1, value.encode("utf-8"))
+
+
+class LayerEncoder:
+    def __init__(self, name: str):
+        self.name = name
+        self.keys = {}
+        self.values = {}
+        self.features = []
+
+    def add(self, geometry_type: int, geometry: bytes, properties: dict):
+        """
+        Args:
+            geometry (bytes): packed commands of the geometry
+        """
+        tags = []
+        for key, value in properties.items():
+            if value is None:
+                continue
+            # True and 1 are different values
+            value_key = (type(value).__name__, value)
+            if isinstance(value, (list, dict)):
+                value_key = ("json", json.dumps(value, ensure_ascii=False))
+            tags.append(self.keys.setdefault(key, len(self.keys)))
+            tags.append(self.values.setdefault(value_key, len(self.values)))
+        self.features.append(
+            packed(2, tags)
+            + varint(3 << 3)
+            + varint(geometry_type)
+            + message(4, geometry)
+        )
+
+    def encode(self) -> bytes:
+        return b"".join(
+            [varint(15 << 3) + varint(2), message(1, self.name.encode("utf-8"))]
+            + [message(2, feature) for feature in self.features]
+            + [message(3, key.encode("utf-8")) for key in self.keys]
+            + [message(4, encode_value(value)) for _, value in self.values]
+            + [varint(5 << 3) + varint(TILE_EXTENT)]
+        )
+
+
+def encode_tile(z: int, x: int, y: int, layers: dict) -> bytes:
+    """
+    Args:
+        layers (dict): features of prepare() by layer name, most frequent first
+    """
+    n = 2**z
+    data = []
+    for name, features in layers.items():
+        encoder = LayerEncoder(name)
+        for geometry_type, parts, properties, _ in features:
+            commands = tile_geometry(geometry_type, parts, x, y, n)
+            if commands:
+                geometry = b"".join(varint(c) for c in commands)
+                encoder.add(geometry_type, geometry, properties)
+        if encoder.features:
+            data.append(message(3, encoder.encode()))
+    return b"".join(data)
+
+
+def encode_tiles(job: tuple) -> list:
+    """
+    encode a job of zoom_jobs(), module-level to run in worker processes
+
+    Returns:
+        list: (z, x, y, gzipped tile) of non-empty tiles
+    """
+    z, tiles = job
+    encoded = []
+    for (x, y), layers in tiles:
+        data = encode_tile(z, x, y, layers)
+        if data:
+            encoded.append((z, x, y, gzip.compress(data, compresslevel=6)))
+    return encoded
+
+
+def read_varint(data: bytes, pos: int) -> tuple:
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def read_fields(data: bytes):
+    """yield (field, value) of a message, bytes for length-delimited fields"""
+    pos = 0
+    while pos < len(data):
+        key, pos = read_varint(data, pos)
+        wire_type = key & 0x7
+        if wire_type == 0:
+            value, pos = read_varint(data, pos)
+        elif wire_type == 1:
+            value, pos = data[pos : pos + 8], pos + 8
+        elif wire_type == 2:
+            length, pos = read_varint(data, pos)
+            value, pos = data[pos : pos + length], pos + length
+        elif wire_type == 5:
+            value, pos = data[pos : pos + 4], pos + 4
+        else:
+            raise ValueError("unsupported wire type: %d" % wire_type)
+        yield key >> 3, value
+
+
+def decode_value(data: bytes):
+    for field, value in read_fields(data):
+        if field == 1:
+            return value.decode("utf-8")
+        if field == 2:
+            return struct.unpack("<f", value)[0]
+        if field == 3:
+            return struct.unpack("<d", value)[0]
+        if field in (4, 5):
+            return value
+        if field == 6:
+            return (value >> 1) ^ -(value & 1)
+        if field == 7:
+            return bool(value)
+    return None
+
+
+def decode_feature(feature: bytes, keys: list, values: list) -> tuple:
+    """
+    Returns:
+        tuple: type, packed geometry and properties of a feature
+    """
+    tags, geometry_type, geometry = [], 0, b""
+    for field, value in read_fields(feature):
+        if field == 2:
+            pos = 0
+            while pos < len(value):
+                tag, pos = read_varint(value, pos)
+                tags.append(tag)
+        elif field == 3:
+            geometry_type = value
+        elif field == 4:
+            geometry = value
+    properties = {
+        keys[tags[i]]: values[tags[i + 1]] for i in range(0, len(tags) - 1, 2)
+    }
+    return geometry_type, geometry, properties
+
+
+def decode_layer(layer: bytes) -> tuple:
+    """
+    Returns:
+        tuple: name and decode_feature() of each feature of a layer
+    """
+    name = ""
+    keys, values, features = [], [], []
+    for field, value in read_fields(layer):
+        if field == 1:
+            name = value.decode("utf-8")
+        elif field == 2:
+            features.append(value)
+        elif field == 3:
+            keys.append(value.decode("utf-8"))
+        elif field == 4:
+            values.append(decode_value(value))
+    return name, [decode_feature(feature, keys, values) for feature in features]
+
+
+def decode_tile(data: bytes) -> dict:
+    """
+    Returns:
+        dict: list of (type, packed geometry, properties) by layer name
+    """
+    layers = {}
+    for field, layer in read_fields(data):
+        if field == 3:
+            name, features = decode_layer(layer)
+            layers.setdefault(name, []).extend(features)
+    return layers
+
+
+def layer_fields(layers: dict) -> list:
+    """vector_layers of MBTiles metadata"""
+    vector_layers = []
+    for name, features in layers.items():
+        fields = {}
+        for feature in features:
+            for key, value in feature[2].items():
+                if isinstance(value, bool):
+                    fields.setdefault(key, "Boolean")
+                elif isinstance(value, (int, float)):
+                    fields.setdefault(key, "Number")
+                elif value is not None:
+                    fields[key] = "String"
+        vector_layers.append({"id": name, "fields": fields})
+    return vector_layers
+
+
+class MBTilesWriter:
+    def __init__(self, path: str):
+        self.path = path
+        self.tmp_path = path + "." + uuid.uuid4().hex
+        self.connection = None
+        self.count = 0
+
+    def __enter__(self):
+        self.connection = sqlite3.connect(self.tmp_path)
+        self.connection.executescript(
+            "CREATE TABLE metadata (name TEXT, value TEXT);"
+            "CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER,"
+            " tile_row INTEGER, tile_data BLOB);"
+        )
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.connection.execute(
+                "CREATE UNIQUE INDEX tile_index"
+                " ON tiles (zoom_level, tile_column, tile_row)"
+            )
+            self.connection.commit()
+        self.connection.close()
+        if exc_type is None:
+            os.replace(self.tmp_path, self.path)
+        else:
+            os.remove(self.tmp_path)
+
+    def write(self, z: int, x: int, y: int, data: bytes):
+        # rows of MBTiles are numbered from the south (TMS)
+        self.connection.execute(
+            "INSERT INTO tiles VALUES (?, ?, ?, ?)", (z, x, 2**z - 1 - y, data)
+        )
+        self.count += 1
+
+    def write_metadata(
+        self, name: str, min_zoom: int, max_zoom: int, bounds, vector_layers: list
+    ):
+        west, south, east, north = bounds or (-180.0, -85.0, 180.0, 85.0)
+        metadata = {
+            "name": name,
+            "format": "pbf",
+            "type": "overlay",
+            "minzoom": str(min_zoom),
+            "maxzoom": str(max_zoom),
+            "bounds": "%f,%f,%f,%f" % (west, south, east, north),
+            "center": "%f,%f,%d"
+            % ((west + east) / 2, (south + north) / 2, (min_zoom + max_zoom) // 2),
+            "json": json.dumps(
+                {
+                    "vector_layers": [
+                        dict(layer, minzoom=min_zoom, maxzoom=max_zoom)
+                        for layer in vector_layers
+                    ]
+                },
+                ensure_ascii=False,
+            ),
+        }
+        self.connection.executemany(
+            "INSERT INTO metadata VALUES (?, ?)", metadata.items()
+        )
+
+
+def write_mbtiles(
+    path: str,
+    layers: dict,
+    min_zoom=TILES_MIN_ZOOM,
+    max_zoom=TILES_MAX_ZOOM,
+    map_func=map,
+) -> int:
+    """
+    write layers as vector tiles to an MBTiles archive
+
+    Args:
+        layers (dict): GeoJSON features by layer name
+        map_func (callable, optional): maps encode_tiles() over jobs, e.g.
+            map of a ProcessPoolExecutor
+
+    Returns:
+        int: number of tiles
+    """
+    prepared = {}
+    bounds = []
+    for name, features in layers.items():
+        prepared[name], layer_bounds = prepare(features, RANK_FIELDS.get(name))
+        if layer_bounds is not None:
+            bounds.append(layer_bounds)
+    vector_layers = layer_fields(prepared)
+
+    with MBTilesWriter(path) as writer:
+        for z in range(min_zoom, max_zoom + 1):
+            for encoded in map_func(encode_tiles, zoom_jobs(prepared, z)):
+                for tile in encoded:
+                    writer.write(*tile)
+        writer.write_metadata(
+            os.path.splitext(os.path.basename(path))[0],
+            min_zoom,
+            max_zoom,
+            (
+                min(b[0] for b in bounds),
+                min(b[1] for b in bounds),
+                max(b[2] for b in bounds),
+                max(b[3] for b in bounds),
+            )
+            if bounds
+            else None,
+            vector_layers,
+        )
+    return writer.count
+
+
+def rank_of(rank_field):
+    """sort key of decoded features, most frequent first"""
+
+    def rank(feature):
+        value = feature[2].get(rank_field) if rank_field else None
+        return -value if isinstance(value, (int, float)) else 0
+
+    return rank
+
+
+def merge_tile(blobs: list) -> bytes:
+    """one tile of features of tiles, most frequent first in each layer"""
+    layers = {}
+    for blob in blobs:
+        for name, features in decode_tile(gzip.decompress(blob)).items():
+            layers.setdefault(name, []).extend(features)
+    data = []
+    for name, features in layers.items():
+        encoder = LayerEncoder(name)
+        for geometry_type, geometry, properties in sorted(
+            features, key=rank_of(RANK_FIELDS.get(name))
+        )[:TILE_MAX_FEATURES]:
+            encoder.add(geometry_type, geometry, properties)
+        data.append(message(3, encoder.encode()))
+    return gzip.compress(b"".join(data), compresslevel=6)
+
+
+def merge_mbtiles(path: str, sources: list) -> str:
+    """
+    merge MBTiles of write_mbtiles(), e.g. of each feed, into one; tiles of
+    more than one source are decoded and merged by layer
+
+    Returns:
+        str: path
+    """
+    connections = [sqlite3.connect(source) for source in sources]
+    try:
+        tiles = {}
+        for i, connection in enumerate(connections):
+            for tile in connection.execute(
+                "SELECT zoom_level, tile_column, tile_row FROM tiles"
+            ):
+                tiles.setdefault(tile, []).append(i)
+
+        metadata = [
+            dict(connection.execute("SELECT name, value FROM metadata"))
+            for connection in connections
+        ]
+        bounds = [[float(v) for v in m["bounds"].split(",")] for m in metadata]
+        vector_layers = {}
+        for m in metadata:
+            for layer in json.loads(m["json"])["vector_layers"]:
+                merged = vector_layers.setdefault(
+                    layer["id"], {"id": layer["id"], "fields": {}}
+                )
+                merged["fields"].update(layer["fields"])
+
+        with MBTilesWriter(path) as writer:
+            for (z, x, row), indices in sorted(tiles.items()):
+                blobs = [
+                    connections[i]
+                    .execute(
+                        "SELECT tile_data FROM tiles WHERE zoom_level = ?"
+                        " AND tile_column = ? AND tile_row = ?",
+                        (z, x, row),
+                    )
+                    .fetchone()[0]
+                    for i in indices
+                ]
+                data = blobs[0] if len(blobs) == 1 else merge_tile(blobs)
+                writer.write(z, x, 2**z - 1 - row, data)
+            writer.write_metadata(
+                os.path.splitext(os.path.basename(path))[0],
+                min(int(m["minzoom"]) for m in metadata),
+                max(int(m["maxzoom"]) for m in metadata),
+                (
+                    min(b[0] for b in bounds),
+                    min(b[1] for b in bounds),
+                    max(b[2] for b in bounds),
+                    max(b[3] for b in bounds),
+                ),
+                list(vector_layers.values()),
+            )
+    finally:
+        for connection in connections:
+            connection.close()
+    return path
@@ -0,0 +1,175 @@
+"""
+Trip counts and headways of route segments and stops per time bin.
+
+All bins are computed in one vectorized pass over compact stop_times instead
+of one Aggregator run per time window. Outputs are long tables, a feature per
+segment or stop and bin, with begin and end datetimes of the bin so that the
+layers can be animated by the temporal controller of QGIS.
+"""
+
+import numpy as np
+import pandas as pd
+
+from .gtfs_go_stoptimes import CompactStopTimes, count_keys
+
+# date of bins when not filtered by date, the temporal controller needs one
+DEFAULT_DATE = "19700101"
+
+
+def hhmmss_to_seconds(hhmmss: str):
+    # time filter of the dialog, HHMMSS without colons, None if not given
+    if not hhmmss:
+        return None
+    return int(hhmmss[:2]) * 3600 + int(hhmmss[2:4]) * 60 + int(hhmmss[4:6])
+
+
+def count_by_bin(codes: list, sizes: list, seconds: np.ndarray, bin_minutes: int):
+    """
+    Returns:
+        tuple: distinct codes, bin of each and number of trips
+    """
+    bins = seconds // (bin_minutes * 60)
+    n_bins = int(bins.max()) + 1 if len(bins) > 0 else 1
+    unique_codes, counts = count_keys(codes + [bins], sizes + [n_bins])
+    return unique_codes[:-1], unique_codes[-1], counts
+
+
+def with_bin_properties(counts: pd.DataFrame, bin_minutes: int, yyyymmdd):
+    """add begin, datetimes and headway of each bin"""
+    minutes = counts["bin"].values * bin_minutes
+    begin = pd.Timestamp(yyyymmdd or DEFAULT_DATE) + pd.to_timedelta(
+        minutes, unit="min"
+    )
+    end = begin + pd.Timedelta(minutes=bin_minutes)
+    return counts.assign(
+        bin_begin=["{:02d}:{:02d}".format(m // 60, m % 60) for m in minutes.tolist()],
+        time_begin=begin.strftime("%Y-%m-%dT%H:%M:%S"),
+        time_end=end.strftime("%Y-%m-%dT%H:%M:%S"),
+        headway_min=(bin_minutes / counts["trips"]).round(1),
+    ).drop(columns="bin")
+
+
+def read_binned_stops(
+    gtfs,
+    bin_minutes: int,
+    yyyymmdd="",
+    begin_time="",
+    end_time="",
+    compact=None,
+    mask=None,
+):
+    """
+    Args:
+        compact (CompactStopTimes, optional): of gtfs["stop_times"], built if None
+        mask (np.ndarray, optional): bool by stop times of compact, e.g. of
+            trips running on yyyymmdd, all if None
+
+    Returns:
+        generator: Point features of stop and bin with trips and headway
+    """
+    if compact is None:
+        compact = CompactStopTimes.from_feed(gtfs)
+    valid = compact.time_mask(
+        hhmmss_to_seconds(begin_time), hhmmss_to_seconds(end_time)
+    )
+    if mask is not None:
+        valid &= mask
+    (stop_codes,), bins, trips = count_by_bin(
+        [compact.stop_codes[valid]],
+        [compact.n_stops],
+        compact.seconds[valid],
+        bin_minutes,
+    )
+    counts = pd.DataFrame(
+        {"stop_id": compact.stop_ids[stop_codes], "bin": bins, "trips": trips}
+    )
+    stops = gtfs["stops"].drop_duplicates("stop_id").set_index("stop_id")
+    counts = counts[counts["stop_id"].isin(stops.index)]
+    stops = stops.loc[counts["stop_id"]]
+
+    counts.insert(1, "stop_name", stops["stop_name"].values)
+    table = with_bin_properties(counts, bin_minutes, yyyymmdd)
+    for lon, lat, properties in zip(
+        stops["stop_lon"].tolist(),
+        stops["stop_lat"].tolist(),
+        table.to_dict(orient="records"),
+    ):
+        yield {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [lon, lat]},
+            "properties": properties,
+        }
+
+
+def read_binned_routes(
+    gtfs,
+    bin_minutes: int,
+    yyyymmdd="",
+    begin_time="",
+    end_time="",
+    segments=None,
+    compact=None,
+    mask=None,
+):
+    """
+    Args:
+        segments (dict, optional): (prev_stop_id, next_stop_id): coordinates
+            as from segment_coordinates(), straight lines between stops if None
+        compact (CompactStopTimes, optional): of gtfs["stop_times"], built if None
+        mask (np.ndarray, optional): bool by stop times of compact, e.g. of
+            trips running on yyyymmdd, all if None
+
+    Returns:
+        generator: LineString features of segment between consecutive stops
+            and bin with trips and headway
+    """
+    if compact is None:
+        compact = CompactStopTimes.from_feed(gtfs)
+    valid = compact.time_mask(
+        hhmmss_to_seconds(begin_time), hhmmss_to_seconds(end_time)
+    )
+    if mask is not None:
+        valid &= mask
+    from_codes, to_codes, seconds = compact.segments(valid)
+    (from_codes, to_codes), bins, trips = count_by_bin(
+        [from_codes, to_codes],
+        [compact.n_stops, compact.n_stops],
+        seconds,
+        bin_minutes,
+    )
+    counts = pd.DataFrame(
+        {
+            "stop_id": compact.stop_ids[from_codes],
+            "next_stop_id": compact.stop_ids[to_codes],
+            "bin": bins,
+            "trips": trips,
+        }
+    )
+    stops = gtfs["stops"].drop_duplicates("stop_id").set_index("stop_id")
+    counts = counts[
+        counts["stop_id"].isin(stops.index) & counts["next_stop_id"].isin(stops.index)
+    ]
+    prev_stops = stops.loc[counts["stop_id"]]
+    next_stops = stops.loc[counts["next_stop_id"]]
+
+    counts = counts.rename(columns={"stop_id": "prev_stop_id"})
+    counts.insert(1, "prev_stop_name", prev_stops["stop_name"].values)
+    counts.insert(3, "next_stop_name", next_stops["stop_name"].values)
+    table = with_bin_properties(counts, bin_minutes, yyyymmdd)
+    segments = segments or {}
+    for prev_lon, prev_lat, next_lon, next_lat, properties in zip(
+        prev_stops["stop_lon"].tolist(),
+        prev_stops["stop_lat"].tolist(),
+        next_stops["stop_lon"].tolist(),
+        next_stops["stop_lat"].tolist(),
+        table.to_dict(orient="records"),
+    ):
+        coordinates = segments.get(
+            (properties["prev_stop_id"], properties["next_stop_id"]),
+            [[prev_lon, prev_lat], [next_lon, next_lat]],
+        )
+        yield {
+            "type": "Feature",
+            "geometry": {"type": "LineString", "coordinates": coordinates},
+            "properties": properties,
+        }
@@ -0,0 +1,281 @@
+"""
+Vectorized unification of similar stops.
+
+Rules, in order of priority (see README), the same as
+gtfs_parser.aggregate.Aggregator applies stop by stop:
+1. parent_station: stops are unified into their parent station
+2. stop_id prefix: stop_ids sharing the part before the last delimiter are
+   unified, the prefix is the new stop_id
+3. stop_name and distance: stops of the same name within max_distance_degree
+   are unified, the first of them is the new stop_id
+
+Proximity is searched on a grid of max_distance_degree cells, so only stops
+of the same name in the 3x3 neighboring cells are compared and the cost
+grows near-linearly with stops.
+"""
+
+import numpy as np
+import pandas as pd
+
+MAX_DISTANCE_DEGREE = 0.01
+
+RESULT_COLUMNS = ["stop_id", "stop_name", "similar_stop_id", "similar_stop_name"]
+UNIFIED_COLUMNS = RESULT_COLUMNS + ["similar_stop_lon", "similar_stop_lat"]
+
+
+def has_value(series: pd.Series) -> pd.Series:
+    # gtfs_parser fills missing parent_station with the string "nan"
+    return series.notna() & (series != "") & (series != "nan")
+
+
+def latlon_to_str(lon: float, lat: float) -> str:
+    """position of a unified stop, as gtfs_parser.aggregate.latlon_to_str"""
+    return str(round(float(lon), 4)) + str(round(float(lat), 4))
+
+
+def position_ids(unified: pd.DataFrame) -> pd.Series:
+    """
+    Returns:
+        pd.Series: position of each similar stop, stops of the same
+            position are counted and drawn as one
+    """
+    return pd.Series(
+        [
+            latlon_to_str(lon, lat)
+            for lon, lat in zip(
+                unified["similar_stop_lon"], unified["similar_stop_lat"]
+            )
+        ],
+        index=unified.index,
+        dtype=object,
+    )
+
+
+def unify_by_name(
+    stops: pd.DataFrame, todo: np.ndarray, pool: np.ndarray, max_distance_degree
+):
+    """
+    for each stop of todo, the first stop of pool of the same name within
+    max_distance_degree and the centroid of all of them
+
+    Args:
+        stops (pd.DataFrame): stops with RangeIndex
+        todo (np.ndarray): rows of stops to unify
+        pool (np.ndarray): rows of stops to unify with, in order of priority
+
+    Returns:
+        tuple: row of the new stop_id, centroid lon and lat by todo
+    """
+
+    def grid_of(rows: np.ndarray) -> pd.DataFrame:
+        return pd.DataFrame(
+            {
+                "row": rows,
+                "stop_name": stops["stop_name"].values[rows],
+                "lon": stops["stop_lon"].values[rows],
+                "lat": stops["stop_lat"].values[rows],
+                "cx": np.floor(
+                    stops["stop_lon"].values[rows] / max_distance_degree
+                ).astype("int64"),
+                "cy": np.floor(
+                    stops["stop_lat"].values[rows] / max_distance_degree
+                ).astype("int64"),
+            }
+        )
+
+    targets = grid_of(todo).assign(target=np.arange(len(todo)))
+    candidates = grid_of(pool).assign(rank=np.arange(len(pool)))
+    pairs = []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            neighbors = candidates.assign(
+                cx=candidates["cx"] - dx, cy=candidates["cy"] - dy
+            )
+            pairs.append(
+                targets.merge(
+                    neighbors, on=["stop_name", "cx", "cy"], suffixes=("", "_near")
+                )
+            )
+    pairs = pd.concat(pairs, ignore_index=True)
+    distance = (pairs["lon_near"] - pairs["lon"]) ** 2 + (
+        pairs["lat_near"] - pairs["lat"]
+    ) ** 2
+    pairs = pairs[distance < max_distance_degree**2].sort_values(["target", "rank"])
+
+    # summed in order of the pool, as Aggregator does
+    starts = np.flatnonzero(
+        np.append(True, pairs["target"].values[1:] != pairs["target"].values[:-1])
+    )
+    counts = np.diff(np.append(starts, len(pairs)))
+    found = pairs["target"].values[starts]
+
+    similar_row = todo.copy()
+    lon = stops["stop_lon"].values[todo].astype(float)
+    lat = stops["stop_lat"].values[todo].astype(float)
+    if len(pairs) > 0:
+        similar_row[found] = pairs["row_near"].values[starts]
+        lon[found] = np.add.reduceat(pairs["lon_near"].values, starts) / counts
+        lat[found] = np.add.reduceat(pairs["lat_near"].values, starts) / counts
+    return similar_row, lon, lat
+
+
+def unify_stops(
+    stops: pd.DataFrame, delimiter="", max_distance_degree=MAX_DISTANCE_DEGREE
+) -> pd.DataFrame:
+    """
+    Args:
+        stops (pd.DataFrame): stops table of GTFS
+        delimiter (str, optional): stop_id delimiter, prefix rule is off if empty
+        max_distance_degree (float, optional): distance of name rule in lonlat
+
+    Returns:
+        pd.DataFrame: stop_id, stop_name, similar_stop_id, similar_stop_name,
+            similar_stop_lon, similar_stop_lat; in order of stops
+    """
+    stops = stops.reset_index(drop=True)
+    stop_ids = stops["stop_id"].to_numpy(dtype=object)
+    stop_names = stops["stop_name"].to_numpy(dtype=object)
+    similar_id = stop_ids.copy()
+    similar_name = stop_names.copy()
+    similar_lon = stops["stop_lon"].values.astype(float)
+    similar_lat = stops["stop_lat"].values.astype(float)
+    # stops whose similar stop is decided by a rule
+    done = np.zeros(len(stops), dtype=bool)
+
+    # 1. parent_station: parents are similar stops of themselves
+    if "parent_station" in stops.columns:
+        parent_station = stops["parent_station"]
+        done |= stops["stop_id"].isin(parent_station[has_value(parent_station)]).values
+        # first of duplicated stop_ids in stop_id order, as Aggregator looks up
+        row_of = pd.Series(np.arange(len(stops)), index=stop_ids).iloc[
+            np.argsort(stop_ids, kind="stable")
+        ]
+        row_of = row_of[~row_of.index.duplicated()]
+        parent_row = row_of.reindex(parent_station.values).values
+        # children of unknown parents are unified by the other rules
+        is_child = ~done & has_value(parent_station).values & ~np.isnan(parent_row)
+        parent_row = parent_row[is_child].astype("int64")
+        similar_id[is_child] = stop_ids[parent_row]
+        similar_name[is_child] = stop_names[parent_row]
+        similar_lon[is_child] = stops["stop_lon"].values[parent_row]
+        similar_lat[is_child] = stops["stop_lat"].values[parent_row]
+        done |= is_child
+
+    # 2. stop_id prefix before the last delimiter
+    delimited = np.zeros(len(stops), dtype=bool)
+    if delimiter:
+        prefix = stops["stop_id"].str.rsplit(delimiter, n=1).str[0]
+        delimited = (prefix != stops["stop_id"]).values
+        # centroid of all stops of the prefix, named after the first delimited
+        centroid = stops.groupby(prefix)[["stop_lon", "stop_lat"]].mean()
+        names = pd.Series(stop_names[delimited], index=prefix.values[delimited])
+        names = names[~names.index.duplicated()]
+        todo = ~done & delimited
+        similar_id[todo] = prefix.values[todo]
+        similar_name[todo] = names.reindex(prefix.values[todo]).values
+        similar_lon[todo] = centroid["stop_lon"].reindex(prefix.values[todo]).values
+        similar_lat[todo] = centroid["stop_lat"].reindex(prefix.values[todo]).values
+        done |= todo
+
+    # 3. stop_name and distance, among stops of no delimiter in order of
+    # stops if the prefix rule is on, among all stops in stop_id order if not
+    todo = np.flatnonzero(~done & stops["stop_name"].notna().values)
+    if len(todo) > 0:
+        if delimiter:
+            pool = np.flatnonzero(~delimited)
+        else:
+            pool = np.argsort(stop_ids, kind="stable")
+        similar_row, lon, lat = unify_by_name(stops, todo, pool, max_distance_degree)
+        similar_id[todo] = stop_ids[similar_row]
+        similar_lon[todo] = lon
+        similar_lat[todo] = lat
+
+    return pd.DataFrame(
+        {
+            "stop_id": stop_ids,
+            "stop_name": stop_names,
+            "similar_stop_id": similar_id,
+            "similar_stop_name": similar_name,
+            "similar_stop_lon": similar_lon,
+            "similar_stop_lat": similar_lat,
+        }
+    )
+
+
+def keep_stops(stops: pd.DataFrame) -> pd.DataFrame:
+    """
+    every stop as its own similar stop, when stops are not unified
+
+    Returns:
+        pd.DataFrame: columns of unify_stops(), in order of stops
+    """
+    return pd.DataFrame(
+        {
+            "stop_id": stops["stop_id"].values,
+            "stop_name": stops["stop_name"].values,
+            "similar_stop_id": stops["stop_id"].values,
+            "similar_stop_name": stops["stop_name"].values,
+            "similar_stop_lon": stops["stop_lon"].values.astype(float),
+            "similar_stop_lat": stops["stop_lat"].values.astype(float),
+        }
+    )
+
+
+def unified_stops(unified: pd.DataFrame) -> pd.DataFrame:
+    """
+    Returns:
+        pd.DataFrame: stops table of unified stops, the first of each
+            similar_stop_id
+    """
+    stops = (
+        unified.drop_duplicates("similar_stop_id")[
+            [
+                "similar_stop_id",
+                "similar_stop_name",
+                "similar_stop_lon",
+                "similar_stop_lat",
+            ]
+        ]
+        .rename(
+            columns={
+                "similar_stop_id": "stop_id",
+                "similar_stop_name": "stop_name",
+                "similar_stop_lon": "stop_lon",
+                "similar_stop_lat": "stop_lat",
+            }
+        )
+        .reset_index(drop=True)
+    )
+    stops["parent_station"] = "nan"
+    return stops
+
+
+def similar_stop_ids(unified: pd.DataFrame, stop_ids: np.ndarray) -> np.ndarray:
+    """
+    Returns:
+        np.ndarray: similar_stop_id of each of stop_ids, stop_ids missing from
+            stops are kept as they are
+    """
+    unified = unified.drop_duplicates("stop_id")
+    codes = pd.Categorical(stop_ids, categories=unified["stop_id"].values).codes
+    return np.where(
+        codes >= 0,
+        unified["similar_stop_id"].to_numpy(dtype=object)[codes],
+        np.asarray(stop_ids, dtype=object),
+    )
+
+
+def apply_unification(gtfs, unified: pd.DataFrame):
+    """
+    replace stops with unified stops and remap stop_times to them
+
+    Returns:
+        copy of gtfs with stops and stop_times replaced
+    """
+    stop_times = gtfs["stop_times"].copy()
+    stop_times["stop_id"] = similar_stop_ids(unified, stop_times["stop_id"].values)
+
+    gtfs = gtfs.copy()
+    gtfs["stops"] = unified_stops(unified)
+    gtfs["stop_times"] = stop_times
+    return gtfs
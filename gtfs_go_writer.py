@@ -0,0 +1,426 @@
+"""
+Incremental feature writers: features are serialized one by one as they are
+produced instead of dumping a whole FeatureCollection at once.
+
+Besides GeoJSON, outputs can be written through GDAL/OGR as GeoPackage (all
+layers of a feed in one file) or FlatGeobuf (one file per layer), both with a
+spatial index and typed fields.
+"""
+
+import json
+import os
+import uuid
+from xml.etree import ElementTree
+
+from .gtfs_go_settings import MEMORY_FORMAT, MEMORY_URI_PREFIX
+
+try:
+    from osgeo import ogr, osr
+except ImportError:
+    # GDAL is always available in QGIS, GeoJSON output works without it
+    ogr = None
+
+GPKG_FILENAME = "gtfs_go.gpkg"
+# layers of a feed merged across feeds, aggregated_dates are merged by date
+MERGED_KINDS = (
+    "routes",
+    "stops",
+    "aggregated_routes",
+    "aggregated_stops",
+    "aggregated_csv",
+    "time_bins_routes",
+    "time_bins_stops",
+    "aggregated_tiles",
+)
+# layers written by aggregation, removed when it is canceled
+AGGREGATED_PREFIXES = ("aggregated", "time_bins_", "result")
+# number of features buffered to infer field types and geometry type
+SCHEMA_SAMPLE_SIZE = 1000
+
+
+def round_coordinates(coordinates, precision: int):
+    if isinstance(coordinates, (list, tuple)):
+        return [round_coordinates(c, precision) for c in coordinates]
+    return round(coordinates, precision)
+
+
+class GeoJSONWriter:
+    def __init__(self, path: str, precision=None):
+        """
+        Args:
+            path (str): output path
+            precision (int, optional): decimal places of coordinates, as is if None
+        """
+        self.path = path
+        self.precision = precision
+        self.count = 0
+        self.f = None
+        # written under a temporary name: an output file is always complete
+        self.tmp_path = path + "." + str(uuid.uuid4())
+
+    def __enter__(self):
+        self.f = open(self.tmp_path, mode="w", encoding="utf-8")
+        self.f.write('{"type": "FeatureCollection", "features": [')
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.f.close()
+            os.remove(self.tmp_path)
+            return
+        self.f.write("]}")
+        self.f.close()
+        os.replace(self.tmp_path, self.path)
+
+    def write(self, feature: dict):
+        if self.precision is not None and feature.get("geometry"):
+            feature = dict(feature)
+            feature["geometry"] = dict(feature["geometry"])
+            feature["geometry"]["coordinates"] = round_coordinates(
+                feature["geometry"]["coordinates"], self.precision
+            )
+        if self.count > 0:
+            self.f.write(",\n")
+        self.f.write(json.dumps(feature, ensure_ascii=False))
+        self.count += 1
+
+
+def write_geojson(path: str, features, precision=None) -> int:
+    """
+    write features to a GeoJSON file
+
+    Args:
+        path (str): output path
+        features (iterable): GeoJSON features, e.g. a generator
+        precision (int, optional): decimal places of coordinates
+
+    Returns:
+        int: number of written features
+    """
+    with GeoJSONWriter(path, precision=precision) as writer:
+        for feature in features:
+            writer.write(feature)
+    return writer.count
+
+
+def layer_uri(output_dir: str, name: str, output_format: str) -> str:
+    """
+    Returns:
+        str: data source of the layer, as accepted by the ogr provider of QGIS
+    """
+    if output_format == "GPKG":
+        return os.path.join(output_dir, GPKG_FILENAME) + "|layername=" + name
+    if output_format == MEMORY_FORMAT:
+        return MEMORY_URI_PREFIX + os.path.join(output_dir, name)
+    if output_format == "FlatGeobuf":
+        return os.path.join(output_dir, name + ".fgb")
+    return os.path.join(output_dir, name + ".geojson")
+
+
+def layer_name(uri: str) -> str:
+    if "|layername=" in uri:
+        return uri.split("|layername=")[1]
+    return os.path.basename(uri).split(".")[0]
+
+
+def value_type(values: list) -> type:
+    """
+    Returns:
+        type: bool, int, float or str, the narrowest of values but None
+    """
+    values = [v for v in values if v is not None]
+    if values and all(isinstance(v, bool) for v in values):
+        return bool
+    if values and all(isinstance(v, int) and not isinstance(v, bool) for v in values):
+        return int
+    if values and all(
+        isinstance(v, (int, float)) and not isinstance(v, bool) for v in values
+    ):
+        return float
+    return str
+
+
+def infer_schema(features: list) -> list:
+    """
+    fields of sampled features, typed the same by every output format
+
+    Args:
+        features (list): up to SCHEMA_SAMPLE_SIZE first features of a layer
+
+    Returns:
+        list: (key, value_type()) of properties in order of appearance, keys
+            missing from the sampled features are not written
+    """
+    keys = {}
+    for feature in features:
+        keys.update(dict.fromkeys(feature.get("properties", {})))
+    return [
+        (key, value_type([f.get("properties", {}).get(key) for f in features]))
+        for key in keys
+    ]
+
+
+def field_type(python_type: type):
+    """OGR field type of a value_type()"""
+    return {
+        bool: ogr.OFTInteger,
+        int: ogr.OFTInteger64,
+        float: ogr.OFTReal,
+    }.get(python_type, ogr.OFTString)
+
+
+class OGRWriter:
+    def __init__(self, uri: str, output_format: str, precision=None):
+        if ogr is None:
+            raise RuntimeError(output_format + " output requires GDAL (osgeo)")
+        self.path = uri.split("|")[0]
+        self.name = layer_name(uri)
+        self.output_format = output_format
+        self.precision = precision
+        self.count = 0
+        self.ds = None
+        self.layer = None
+        self.fields = []
+        self.buffer = []
+
+    def __enter__(self):
+        driver = ogr.GetDriverByName(self.output_format)
+        if self.output_format == "GPKG" and os.path.exists(self.path):
+            # layers of a feed share one GeoPackage
+            self.ds = ogr.Open(self.path, 1)
+            for i in range(self.ds.GetLayerCount() if self.ds else 0):
+                if self.ds.GetLayerByIndex(i).GetName() == self.name:
+                    self.ds.DeleteLayer(i)
+                    break
+        else:
+            if os.path.exists(self.path):
+                driver.DeleteDataSource(self.path)
+            self.ds = driver.CreateDataSource(self.path)
+        if self.ds is None:
+            raise RuntimeError("can't open " + self.path)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.discard()
+            return
+        if self.layer is None:
+            self.create_layer()
+        self.flush()
+        self.layer.CommitTransaction()
+        self.layer = None
+        self.ds = None
+
+    def discard(self):
+        """remove the partial layer, or its file unless shared by other layers"""
+        if self.layer is not None:
+            self.layer.RollbackTransaction()
+        self.layer = None
+        if self.output_format == "GPKG":
+            for i in range(self.ds.GetLayerCount()):
+                if self.ds.GetLayerByIndex(i).GetName() == self.name:
+                    self.ds.DeleteLayer(i)
+                    break
+            self.ds = None
+        else:
+            self.ds = None
+            ogr.GetDriverByName(self.output_format).DeleteDataSource(self.path)
+
+    def create_layer(self):
+        geometry_types = set(
+            f["geometry"]["type"] for f in self.buffer if f.get("geometry")
+        )
+        if len(geometry_types) == 0:
+            geometry_type = ogr.wkbNone
+        elif len(geometry_types) == 1:
+            geometry_type = ogr.CreateGeometryFromJson(
+                json.dumps(self.buffer[0]["geometry"])
+            ).GetGeometryType()
+        else:
+            geometry_type = ogr.wkbUnknown
+
+        srs = None
+        if geometry_type != ogr.wkbNone:
+            srs = osr.SpatialReference()
+            srs.ImportFromEPSG(4326)
+            srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+
+        self.layer = self.ds.CreateLayer(
+            self.name, srs, geometry_type, ["SPATIAL_INDEX=YES"]
+        )
+        schema = infer_schema(self.buffer)
+        self.fields = [key for key, _ in schema]
+        for key, key_type in schema:
+            self.layer.CreateField(ogr.FieldDefn(key, field_type(key_type)))
+        self.layer.StartTransaction()
+
+    def flush(self):
+        defn = self.layer.GetLayerDefn()
+        for feature in self.buffer:
+            ogr_feature = ogr.Feature(defn)
+            for key, value in feature.get("properties", {}).items():
+                if value is None or key not in self.fields:
+                    # keys missing from the sampled features are dropped
+                    continue
+                if isinstance(value, (list, dict)):
+                    value = json.dumps(value, ensure_ascii=False)
+                ogr_feature.SetField(key, value)
+            if feature.get("geometry"):
+                geometry = feature["geometry"]
+                if self.precision is not None:
+                    geometry = dict(geometry)
+                    geometry["coordinates"] = round_coordinates(
+                        geometry["coordinates"], self.precision
+                    )
+                ogr_feature.SetGeometry(
+                    ogr.CreateGeometryFromJson(json.dumps(geometry))
+                )
+            self.layer.CreateFeature(ogr_feature)
+        self.buffer = []
+
+    def write(self, feature: dict):
+        self.buffer.append(feature)
+        self.count += 1
+        if len(self.buffer) >= SCHEMA_SAMPLE_SIZE:
+            if self.layer is None:
+                self.create_layer()
+            self.flush()
+
+
+def write_features(uri: str, features, output_format: str, precision=None) -> int:
+    """
+    write features to uri given by layer_uri()
+
+    Args:
+        uri (str): layer data source
+        features (iterable): GeoJSON features, e.g. a generator
+        output_format (str): one of OUTPUT_FORMATS
+        precision (int, optional): decimal places of coordinates
+
+    Returns:
+        int: number of written features
+    """
+    if output_format == "GeoJSON":
+        return write_geojson(uri, features, precision=precision)
+    if output_format == MEMORY_FORMAT:
+        # requires QGIS, not imported by the CLI
+        from .gtfs_go_memory import write_memory_layer
+
+        return write_memory_layer(uri, features)
+    with OGRWriter(uri, output_format, precision=precision) as writer:
+        for feature in features:
+            writer.write(feature)
+    return writer.count
+
+
+def write_table(uri: str, df, output_format: str) -> int:
+    """write a DataFrame as a layer without geometry"""
+    features = (
+        {"properties": {k: (None if v != v else v) for k, v in row.items()}}
+        for row in df.to_dict(orient="records")
+    )
+    if output_format == MEMORY_FORMAT:
+        from .gtfs_go_memory import write_memory_layer
+
+        return write_memory_layer(uri, features)
+    with OGRWriter(uri, output_format) as writer:
+        for feature in features:
+            writer.write(feature)
+    return writer.count
+
+
+def remove_layers(output_dir: str, prefixes: tuple, output_format: str) -> int:
+    """
+    remove layers and files of output_dir whose names start with prefixes,
+    e.g. partial outputs of a canceled run
+
+    Returns:
+        int: number of removed layers and files
+    """
+    removed = 0
+    for filename in os.listdir(output_dir):
+        path = os.path.join(output_dir, filename)
+        if filename.startswith(prefixes) and os.path.isfile(path):
+            os.remove(path)
+            removed += 1
+
+    gpkg_path = os.path.join(output_dir, GPKG_FILENAME)
+    if output_format == "GPKG" and ogr is not None and os.path.exists(gpkg_path):
+        ds = ogr.Open(gpkg_path, 1)
+        for i in reversed(range(ds.GetLayerCount() if ds else 0)):
+            if ds.GetLayerByIndex(i).GetName().startswith(prefixes):
+                ds.DeleteLayer(i)
+                removed += 1
+        ds = None
+    return removed
+
+
+def write_union_vrt(path: str, name: str, uris: dict) -> str:
+    """
+    write a VRT of layers of the same kind, read by OGR as one layer with the
+    name of the source feed in "feed" field; no features are copied
+
+    Args:
+        path (str): output path of .vrt
+        name (str): name of the union layer
+        uris (dict): layer uri by feed name
+
+    Returns:
+        str: uri of the union layer
+    """
+    root = ElementTree.Element("OGRVRTDataSource")
+    union = ElementTree.SubElement(root, "OGRVRTUnionLayer", name=name)
+    ElementTree.SubElement(union, "SourceLayerFieldName").text = "feed"
+    # fields of all feeds, e.g. optional columns of GTFS
+    ElementTree.SubElement(union, "FieldStrategy").text = "Union"
+    for feed, uri in uris.items():
+        source = ElementTree.SubElement(union, "OGRVRTLayer", name=feed)
+        ElementTree.SubElement(source, "SrcDataSource").text = uri.split("|")[0]
+        ElementTree.SubElement(source, "SrcLayer").text = layer_name(uri)
+    ElementTree.ElementTree(root).write(path, encoding="utf-8", xml_declaration=True)
+    return path
+
+
+def write_merged_layers(output_dir: str, feeds: dict) -> dict:
+    """
+    one union layer per kind of layer written by feeds, and one MBTiles of
+    vector tiles of all feeds
+
+    Args:
+        output_dir (str): where .vrt files are written
+        feeds (dict): written_files of run() by feed name
+
+    Returns:
+        dict: written_files of the union layers, as of a feed
+    """
+    uris = {}
+    for feed, written_files in feeds.items():
+        for kind in MERGED_KINDS:
+            if written_files.get(kind):
+                uris.setdefault(("", kind), {})[feed] = written_files[kind]
+        for yyyymmdd, date_files in written_files.get("aggregated_dates", {}).items():
+            for kind in MERGED_KINDS:
+                if date_files.get(kind):
+                    uris.setdefault((yyyymmdd, kind), {})[feed] = date_files[kind]
+
+    merged = {kind: "" for kind in MERGED_KINDS}
+    merged["aggregated_dates"] = {}
+    for (yyyymmdd, kind), kind_uris in uris.items():
+        # named as the layers of a feed, e.g. aggregated_stops_20240105
+        name = layer_name(next(iter(kind_uris.values())))
+        if kind == "aggregated_tiles":
+            # tiles of more than one feed are merged by decoding them
+            from .gtfs_go_tiles import merge_mbtiles
+
+            uri = merge_mbtiles(
+                os.path.join(output_dir, name + ".mbtiles"), list(kind_uris.values())
+            )
+        else:
+            uri = write_union_vrt(
+                os.path.join(output_dir, name + ".vrt"), name, kind_uris
+            )
+        if yyyymmdd:
+            merged["aggregated_dates"].setdefault(yyyymmdd, {})[kind] = uri
+        else:
+            merged[kind] = uri
+    return merged
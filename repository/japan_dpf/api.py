@@ -1,4 +1,7 @@
 import json
+import os
+import time
+import uuid
 
 # QGIS-API
 from PyQt5.QtCore import *
@@ -9,7 +12,64 @@ from qgis.core import *
 from qgis.gui import *
 from qgis.utils import iface
 
-DPF_API_URL = "https://api.gtfs-data.jp/v2"
+from ...gtfs_go_settings import CACHE_DIR, DPF_CACHE_TTL_SEC
+
+# overridable to run against a local stand-in server
+DPF_API_URL = os.environ.get("GTFS_GO_DPF_API_URL", "https://api.gtfs-data.jp/v2")
+
+RESPONSE_CACHE_PATH = os.path.join(CACHE_DIR, "dpf", "responses.json")
+
+# url: {"time": float, "body": dict}, loaded from RESPONSE_CACHE_PATH once
+_response_cache = None
+# replies in flight, referenced until finished
+_replies = []
+
+
+def load_response_cache() -> dict:
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = {}
+        if os.path.exists(RESPONSE_CACHE_PATH):
+            try:
+                with open(RESPONSE_CACHE_PATH, encoding="utf-8") as f:
+                    _response_cache = json.load(f)
+            except (OSError, ValueError):
+                pass
+    return _response_cache
+
+
+def get_cached_response(url: str):
+    cached = load_response_cache().get(url)
+    if cached is None or time.time() - cached["time"] > DPF_CACHE_TTL_SEC:
+        return None
+    return cached["body"]
+
+
+def set_cached_response(url: str, body: dict):
+    cache = load_response_cache()
+    now = time.time()
+    for key in [k for k, v in cache.items() if now - v["time"] > DPF_CACHE_TTL_SEC]:
+        del cache[key]
+    cache[url] = {"time": now, "body": body}
+    try:
+        os.makedirs(os.path.dirname(RESPONSE_CACHE_PATH), exist_ok=True)
+        tmp_path = RESPONSE_CACHE_PATH + "." + str(uuid.uuid4())
+        with open(tmp_path, mode="w", encoding="utf-8") as f:
+            json.dump(cache, f, ensure_ascii=False)
+        os.replace(tmp_path, RESPONSE_CACHE_PATH)
+    except OSError:
+        # in-memory cache still works for this session
+        pass
+
+
+def read_reply(reply: QNetworkReply) -> dict:
+    if reply.error() == QNetworkReply.NoError:
+        text_stream = QTextStream(reply)
+        text_stream.setCodec("UTF-8")
+        text = text_stream.readAll()
+        return json.loads(text)
+    else:
+        raise Exception(reply.error())
 
 
 def fetch(url: str) -> dict:
@@ -32,21 +92,66 @@ def fetch(url: str) -> dict:
     reply = networkAccessManager.get(req)
     reply.finished.connect(eventLoop.quit)
     eventLoop.exec_()
-    if reply.error() == QNetworkReply.NoError:
-        text_stream = QTextStream(reply)
-        text_stream.setCodec("UTF-8")
-        text = text_stream.readAll()
-        return json.loads(text)
-    else:
-        raise Exception(reply.error())
+    return read_reply(reply)
 
 
-def get_feeds(target_date: str, extent=None, pref=None):
+def fetch_async(url: str, on_success, on_error):
+    """
+    Fetch JSON via http without blocking, callbacks run on the main thread
+
+    Args:
+        url (str): URL
+        on_success (callable): called with decoded JSON as dict
+        on_error (callable): called with the Exception
+    """
+    reply = QgsNetworkAccessManager.instance().get(QNetworkRequest(QUrl(url)))
+    _replies.append(reply)
+
+    def on_finished():
+        _replies.remove(reply)
+        try:
+            res = read_reply(reply)
+        except Exception as e:
+            on_error(e)
+        else:
+            on_success(res)
+        finally:
+            reply.deleteLater()
+
+    reply.finished.connect(on_finished)
+
+
+def make_feeds_url(target_date: str, extent=None, pref=None) -> str:
     url = DPF_API_URL + "/files?"
     url += f"target_date={target_date}"
     url += "" if extent is None else "&extent=" + extent
     url += "" if pref is None else f"&pref={pref}"
+    return url
+
 
-    res = fetch(url)
+def get_feeds(target_date: str, extent=None, pref=None):
+    url = make_feeds_url(target_date, extent=extent, pref=pref)
+    res = get_cached_response(url)
+    if res is None:
+        res = fetch(url)
+        set_cached_response(url, res)
     feeds = res.get("body", [])
     return feeds
+
+
+def get_feeds_async(on_success, on_error, target_date: str, extent=None, pref=None):
+    """
+    same as get_feeds() but returns immediately,
+    on_success is called with the list of feeds
+    """
+    url = make_feeds_url(target_date, extent=extent, pref=pref)
+    res = get_cached_response(url)
+    if res is not None:
+        on_success(res.get("body", []))
+        return
+
+    def on_fetched(res: dict):
+        set_cached_response(url, res)
+        on_success(res.get("body", []))
+
+    fetch_async(url, on_fetched, on_error)
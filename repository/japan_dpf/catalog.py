@@ -0,0 +1,216 @@
+"""
+Local copy of the Japan DPF file catalog for offline search.
+
+Files are stored in SQLite with indexes on prefecture and validity dates and
+an R-tree over the bounding box of each feed's stops, so get_feeds() answers
+the same queries as the /files API without a request. The API lists no
+bounding box, so stops of new or updated feeds are fetched to compute it.
+"""
+
+import json
+import os
+import sqlite3
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from ...gtfs_go_settings import CACHE_DIR, DPF_SYNC_WORKERS
+from . import api
+
+CATALOG_PATH = os.path.join(CACHE_DIR, "dpf", "catalog.sqlite")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    file_uid TEXT UNIQUE NOT NULL,
+    feed_pref_id INTEGER,
+    file_from_date TEXT,
+    file_to_date TEXT,
+    file_last_updated_at TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_pref ON files (feed_pref_id);
+CREATE INDEX IF NOT EXISTS files_dates ON files (file_from_date, file_to_date);
+CREATE VIRTUAL TABLE IF NOT EXISTS files_bbox USING rtree (
+    id, min_lon, max_lon, min_lat, max_lat
+);
+"""
+
+
+def to_yyyymmdd(date) -> str:
+    # dates are compared as yyyymmdd whether given as yyyy-mm-dd or not
+    return "".join(c for c in str(date or "") if c.isdigit())[:8]
+
+
+def fetch_json(url: str) -> dict:
+    # runs in a background task, where the Qt event loop of fetch() can't be used
+    with urllib.request.urlopen(url) as res:
+        return json.loads(res.read().decode("utf-8"))
+
+
+def get_stops_bbox(stops_url: str):
+    """
+    Returns:
+        tuple: (min_lon, max_lon, min_lat, max_lat) or None when the feed
+            has no stops
+
+    Raises:
+        Exception: stops couldn't be fetched
+    """
+    if not stops_url:
+        return None
+    geojson = fetch_json(stops_url)
+    lons = []
+    lats = []
+    for feature in geojson.get("features", []):
+        geometry = feature.get("geometry") or {}
+        if geometry.get("type") == "Point":
+            lons.append(geometry["coordinates"][0])
+            lats.append(geometry["coordinates"][1])
+    if not lons:
+        return None
+    return min(lons), max(lons), min(lats), max(lats)
+
+
+class Catalog:
+    def __init__(self, path=CATALOG_PATH):
+        self.path = path
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def connect(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path)
+        conn.executescript(SCHEMA)
+        return conn
+
+    def sync(self, is_canceled=None, workers=DPF_SYNC_WORKERS) -> tuple:
+        """
+        download the catalog, only new or updated files are fetched in detail
+
+        Args:
+            is_canceled (callable, optional): returns True to stop syncing
+            workers (int, optional): stops of feeds fetched at once
+
+        Returns:
+            tuple: number of added or updated files, and of files whose stops
+                couldn't be fetched; these are listed without bbox and
+                fetched again by the next sync
+        """
+        files = fetch_json(api.DPF_API_URL + "/files").get("body", [])
+
+        conn = self.connect()
+        try:
+            known = dict(
+                conn.execute("SELECT file_uid, file_last_updated_at FROM files")
+            )
+            changed = [
+                f
+                for f in files
+                if f["file_uid"] not in known
+                or known[f["file_uid"]] is None
+                or known[f["file_uid"]] != f.get("file_last_updated_at")
+            ]
+            updated = 0
+            failed = 0
+            canceled = False
+            # fetched by threads, written to sqlite by this thread only
+            with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+                futures = {
+                    executor.submit(get_stops_bbox, f.get("file_stop_url")): f
+                    for f in changed
+                }
+                for future in as_completed(futures):
+                    if is_canceled is not None and is_canceled():
+                        canceled = True
+                        for pending in futures:
+                            pending.cancel()
+                        break
+                    try:
+                        self.upsert(conn, futures[future], future.result())
+                        updated += 1
+                    except Exception:
+                        # listed without bbox, unsynced to be retried
+                        self.upsert(conn, futures[future], None, synced=False)
+                        failed += 1
+                    conn.commit()
+            if not canceled:
+                # files removed from the repository
+                removed = set(known.keys()) - set(f["file_uid"] for f in files)
+                for uid in removed:
+                    self.delete(conn, uid)
+                conn.commit()
+        finally:
+            conn.close()
+        return updated, failed
+
+    @staticmethod
+    def delete(conn: sqlite3.Connection, file_uid: str):
+        row = conn.execute(
+            "SELECT id FROM files WHERE file_uid = ?", (file_uid,)
+        ).fetchone()
+        if row is None:
+            return
+        conn.execute("DELETE FROM files_bbox WHERE id = ?", row)
+        conn.execute("DELETE FROM files WHERE id = ?", row)
+
+    @staticmethod
+    def upsert(conn: sqlite3.Connection, file: dict, bbox, synced=True):
+        """
+        Args:
+            synced (bool, optional): False to store file_last_updated_at as
+                NULL, the file is fetched again by the next sync
+        """
+        Catalog.delete(conn, file["file_uid"])
+        cursor = conn.execute(
+            """
+            INSERT INTO files (
+                file_uid, feed_pref_id, file_from_date, file_to_date,
+                file_last_updated_at, data
+            ) VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (
+                file["file_uid"],
+                file.get("feed_pref_id"),
+                to_yyyymmdd(file.get("file_from_date")),
+                to_yyyymmdd(file.get("file_to_date")),
+                file.get("file_last_updated_at") if synced else None,
+                json.dumps(file, ensure_ascii=False),
+            ),
+        )
+        if bbox is not None:
+            conn.execute(
+                "INSERT INTO files_bbox VALUES (?, ?, ?, ?, ?)",
+                (cursor.lastrowid,) + tuple(bbox),
+            )
+
+    def get_feeds(self, target_date: str, extent=None, pref=None) -> list:
+        """
+        same as api.get_feeds() but from the local catalog,
+        files of unknown bbox are excluded from extent search
+        """
+        sql = """
+            SELECT files.data FROM files
+            WHERE file_from_date <= :target_date
+            AND (file_to_date = '' OR :target_date <= file_to_date)
+        """
+        values = {"target_date": to_yyyymmdd(target_date)}
+        if pref is not None:
+            sql += " AND feed_pref_id = :pref"
+            values["pref"] = pref
+        if extent is not None:
+            xmin, ymin, xmax, ymax = [float(v) for v in extent.split(",")]
+            sql += """
+                AND files.id IN (
+                    SELECT id FROM files_bbox
+                    WHERE min_lon <= :xmax AND max_lon >= :xmin
+                    AND min_lat <= :ymax AND max_lat >= :ymin
+                )
+            """
+            values.update({"xmin": xmin, "ymin": ymin, "xmax": xmax, "ymax": ymax})
+
+        conn = self.connect()
+        try:
+            return [json.loads(row[0]) for row in conn.execute(sql, values)]
+        finally:
+            conn.close()
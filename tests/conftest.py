@@ -0,0 +1,204 @@
+"""
+Fixtures of the test suite: the plugin imported as a package, as QGIS does,
+and a small GTFS feed covering the stop unification rules, date exceptions
+and times past midnight. Modules requiring QGIS are not tested here.
+"""
+
+import importlib
+import io
+import os
+import sys
+import zipfile
+
+import pandas as pd
+import pytest
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# stops in feed order, not sorted by stop_id
+STOPS = [
+    # stop_id, stop_name, stop_lon, stop_lat, parent_station
+    ("S0", "Central", 139.7000, 35.6800, ""),
+    ("C_2", "Central", 139.6995, 35.6798, "S0"),
+    ("C_1", "Central", 139.7005, 35.6802, "S0"),
+    ("B_x_2", "Bay East", 139.7100, 35.6900, ""),
+    ("B_x_1", "Bay West", 139.7090, 35.6901, ""),
+    ("B_y", "Bay", 139.7110, 35.6910, ""),
+    ("H2", "Hill", 139.7200, 35.7000, ""),
+    ("H1", "Hill", 139.7205, 35.7003, ""),
+    ("H3", "Hill", 139.7600, 35.7300, ""),
+    ("Z", "Lone", 139.7300, 35.7100, ""),
+    ("U", "Unused", 139.7400, 35.7200, ""),
+]
+
+# route_id: stop_ids of its trips
+PATTERNS = {
+    "R1": ["C_1", "B_x_1", "H1", "Z"],
+    "R2": ["Z", "H2", "B_x_2", "C_2"],
+    "R3": ["C_1", "B_y", "H3"],
+}
+
+# route_id, service_id, first departure of each trip
+TRIPS = [
+    ("R1", "WK", ["06:00:00", "07:00:00", "08:00:00", "12:00:00", "18:00:00"]),
+    ("R1", "WK", ["25:10:00"]),
+    ("R1", "SU", ["09:00:00", "15:00:00"]),
+    ("R2", "WK", ["06:30:00", "08:30:00", "17:30:00"]),
+    ("R2", "SU", ["10:30:00"]),
+    ("R3", "WK", ["07:15:00", "22:00:00"]),
+]
+
+
+def csv_text(df: pd.DataFrame) -> str:
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False)
+    return buffer.getvalue()
+
+
+def fixture_tables() -> dict:
+    """tables of the fixture feed as DataFrames of str"""
+    stops = pd.DataFrame(
+        STOPS,
+        columns=["stop_id", "stop_name", "stop_lon", "stop_lat", "parent_station"],
+    )
+    stops["location_type"] = ["1"] + [""] * (len(stops) - 1)
+
+    trips = []
+    stop_times = []
+    for route_id, service_id, departures in TRIPS:
+        for departure in departures:
+            trip_id = "%s_%s_%s" % (route_id, service_id, departure.replace(":", ""))
+            trips.append(
+                (route_id, service_id, trip_id, "SH1" if route_id == "R1" else "")
+            )
+            hours, minutes, seconds = [int(v) for v in departure.split(":")]
+            begin = hours * 3600 + minutes * 60 + seconds
+            for i, stop_id in enumerate(PATTERNS[route_id]):
+                # 5 minutes between stops
+                t = begin + i * 300
+                time = "%02d:%02d:%02d" % (t // 3600, t // 60 % 60, t % 60)
+                stop_times.append((trip_id, time, time, stop_id, str(i + 1)))
+
+    return {
+        "agency": pd.DataFrame(
+            {
+                "agency_id": ["A1"],
+                "agency_name": ["Agency One"],
+                "agency_url": ["https://example.com"],
+                "agency_timezone": ["Asia/Tokyo"],
+            }
+        ),
+        "routes": pd.DataFrame(
+            {
+                "route_id": ["R1", "R2", "R3"],
+                "agency_id": ["A1", "A1", "A1"],
+                "route_short_name": ["1", "", "3"],
+                "route_long_name": ["Main", "Loop", "Branch"],
+                "route_type": ["3", "3", "3"],
+                "route_color": ["FF0000", "", ""],
+            }
+        ),
+        "stops": stops.astype(str),
+        "trips": pd.DataFrame(
+            trips, columns=["route_id", "service_id", "trip_id", "shape_id"]
+        ),
+        "stop_times": pd.DataFrame(
+            stop_times,
+            columns=[
+                "trip_id",
+                "arrival_time",
+                "departure_time",
+                "stop_id",
+                "stop_sequence",
+            ],
+        ),
+        "calendar": pd.DataFrame(
+            {
+                "service_id": ["WK", "SU"],
+                "monday": ["1", "0"],
+                "tuesday": ["1", "0"],
+                "wednesday": ["1", "0"],
+                "thursday": ["1", "0"],
+                "friday": ["1", "0"],
+                "saturday": ["0", "0"],
+                "sunday": ["0", "1"],
+                "start_date": ["20240101", "20240101"],
+                "end_date": ["20241231", "20241231"],
+            }
+        ),
+        # new year's holiday runs on sunday timetable
+        "calendar_dates": pd.DataFrame(
+            {
+                "service_id": ["WK", "SU"],
+                "date": ["20240102", "20240102"],
+                "exception_type": ["2", "1"],
+            }
+        ),
+        # past the stops of R1 with a detour between B_x_1 and H1
+        "shapes": pd.DataFrame(
+            {
+                "shape_id": ["SH1"] * 6,
+                "shape_pt_lat": [
+                    "35.6800",
+                    "35.6802",
+                    "35.6901",
+                    "35.6990",
+                    "35.7003",
+                    "35.7100",
+                ],
+                "shape_pt_lon": [
+                    "139.6990",
+                    "139.7005",
+                    "139.7090",
+                    "139.7120",
+                    "139.7205",
+                    "139.7300",
+                ],
+                "shape_pt_sequence": ["1", "2", "3", "4", "5", "6"],
+            }
+        ),
+    }
+
+
+def write_feed(path: str, tables=None) -> str:
+    """write tables, the fixture feed by default, as a GTFS zip"""
+    tables = fixture_tables() if tables is None else tables
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as z:
+        for name, df in tables.items():
+            z.writestr(name + ".txt", csv_text(df))
+    return path
+
+
+def import_plugin(module: str):
+    """import a module of the plugin directory as a package, as QGIS does"""
+    if os.path.dirname(PLUGIN_DIR) not in sys.path:
+        sys.path.insert(0, os.path.dirname(PLUGIN_DIR))
+    package = importlib.import_module(os.path.basename(PLUGIN_DIR))
+    return importlib.import_module(package.__name__ + "." + module)
+
+
+def import_gtfs_parser():
+    """gtfs_parser of the submodule, the test is skipped if not checked out"""
+    try:
+        return import_plugin("gtfs_parser.gtfs_parser")
+    except ImportError:
+        pytest.skip("gtfs_parser submodule not checked out")
+
+
+@pytest.fixture
+def plugin():
+    return import_plugin
+
+
+@pytest.fixture
+def feed_zip(tmp_path) -> str:
+    return write_feed(str(tmp_path / "feed.zip"))
+
+
+@pytest.fixture
+def stage_cache(plugin):
+    """in-memory stage results are cleared around each test"""
+    stages = plugin("gtfs_go_stages")
+    stages.clear()
+    yield stages
+    stages.clear()
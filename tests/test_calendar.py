@@ -0,0 +1,97 @@
+import numpy as np
+from conftest import fixture_tables, import_plugin
+
+calendar = import_plugin("gtfs_go_calendar")
+feed = import_plugin("gtfs_go_feed")
+
+
+def build_index():
+    tables = fixture_tables()
+    return calendar.CalendarIndex.build(tables["calendar"], tables["calendar_dates"])
+
+
+def running(index, yyyymmdd):
+    return set(index.service_ids[index.running_on(yyyymmdd)].tolist())
+
+
+def test_running_on_weekdays_and_exceptions():
+    index = build_index()
+    assert running(index, "20240105") == {"WK"}
+    assert running(index, "20240106") == set()
+    assert running(index, "20240107") == {"SU"}
+    # holiday: weekday service removed, sunday service added
+    assert running(index, "20240102") == {"SU"}
+    # out of the validity range of the feed
+    assert running(index, "20250105") == set()
+
+
+def test_save_and_load(tmp_path):
+    index = build_index()
+    path = str(tmp_path / calendar.INDEX_FILENAME)
+    index.save(path)
+    loaded = calendar.CalendarIndex.load(path)
+    assert loaded.service_ids.tolist() == index.service_ids.tolist()
+    assert loaded.first_day == index.first_day
+    assert np.array_equal(loaded.bits, index.bits)
+
+
+def test_build_without_tables():
+    index = calendar.CalendarIndex.build()
+    assert index.n_days == 0
+    assert not index.running_on("20240105").any()
+
+
+def test_date_range():
+    assert calendar.date_range("20231230", "20240102") == [
+        "20231230",
+        "20231231",
+        "20240101",
+        "20240102",
+    ]
+
+
+def test_filter_by_date():
+    gtfs = fixture_tables()
+    filtered = calendar.filter_by_date(gtfs, "20240102")
+    assert set(filtered["trips"]["service_id"]) == {"SU"}
+    assert set(filtered["stop_times"]["trip_id"]) == set(filtered["trips"]["trip_id"])
+    # the given feed is not changed
+    assert set(gtfs["trips"]["service_id"]) == {"WK", "SU"}
+
+
+def test_trip_counts():
+    counts = calendar.trip_counts(fixture_tables(), "20240101", "20240107")
+    by_date = dict(zip(counts["date"], counts["trips"]))
+    assert by_date["20240102"] == 3
+    assert by_date["20240105"] == 11
+    assert by_date["20240106"] == 0
+    assert counts["weekday"].tolist()[0] == "monday"
+
+
+def test_trips_running():
+    gtfs = fixture_tables()
+    trip_ids = gtfs["trips"]["trip_id"].values[::-1]
+    running = calendar.trips_running(gtfs, trip_ids, "20240102")
+    assert set(trip_ids[running]) == set(
+        calendar.filter_by_date(gtfs, "20240102")["trips"]["trip_id"]
+    )
+
+
+def test_index_is_loaded_once(stage_cache, feed_zip, tmp_path, monkeypatch):
+    gtfs = feed.load_gtfs(feed_zip, str(tmp_path / "parsed"), 2)
+    # built and written to the feed cache
+    calendar.get_calendar_index(gtfs)
+    stage_cache.clear()
+
+    loads = []
+    load = calendar.CalendarIndex.load
+
+    def counted(path):
+        loads.append(path)
+        return load(path)
+
+    monkeypatch.setattr(calendar.CalendarIndex, "load", staticmethod(counted))
+    for yyyymmdd in ("20240102", "20240105"):
+        calendar.trips_running(gtfs, gtfs["trips"]["trip_id"].values, yyyymmdd)
+        calendar.filter_by_date(gtfs, yyyymmdd)
+    assert len(loads) == 1
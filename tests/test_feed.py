@@ -0,0 +1,130 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import fixture_tables, import_gtfs_parser, import_plugin, write_feed
+
+feed = import_plugin("gtfs_go_feed")
+
+
+def test_tables_are_loaded_on_access(feed_zip, tmp_path):
+    gtfs = feed.load_gtfs(feed_zip, str(tmp_path / "parsed"), 2)
+    assert "stop_times" in gtfs
+    assert gtfs.tables == {}
+
+    stops = gtfs["stops"]
+    assert list(gtfs.tables) == ["stops"]
+    assert stops["stop_lon"].dtype == float
+    assert stops["stop_id"].tolist()[:3] == ["S0", "C_2", "C_1"]
+    # parsed tables are cached next to each other
+    assert any(name.startswith("stops.") for name in os.listdir(gtfs.table_dir))
+
+
+def test_parsed_tables_match_pandas(feed_zip, tmp_path):
+    gtfs = feed.load_gtfs(feed_zip, str(tmp_path / "parsed"), 2)
+    gtfs.preload(list(gtfs))
+    expected = fixture_tables()["stop_times"]
+    stop_times = gtfs["stop_times"]
+    assert stop_times["trip_id"].tolist() == expected["trip_id"].tolist()
+    assert stop_times["stop_sequence"].tolist() == [
+        int(v) for v in expected["stop_sequence"]
+    ]
+
+
+def test_cached_tables_are_read_by_a_new_feed(feed_zip, tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / "parsed")
+    feed.load_gtfs(feed_zip, cache_dir, 2)["trips"]
+
+    def fail(self, name, columns=None):
+        raise AssertionError("parsed again")
+
+    monkeypatch.setattr(feed.GTFSFeed, "read_csv", fail)
+    assert len(feed.load_gtfs(feed_zip, cache_dir, 2)["trips"]) == 14
+
+
+def test_copy_doesnt_replace_tables_of_feed(feed_zip, tmp_path):
+    gtfs = feed.load_gtfs(feed_zip, str(tmp_path / "parsed"), 2)
+    copied = gtfs.copy()
+    copied["trips"] = gtfs["trips"].head(1)
+    assert len(gtfs["trips"]) == 14
+
+
+def test_evict_parsed_feeds(tmp_path):
+    cache_dir = str(tmp_path / "parsed")
+    for i in range(3):
+        tables = fixture_tables()
+        tables["agency"]["agency_name"] = ["Agency %d" % i]
+        feed.load_gtfs(write_feed(str(tmp_path / ("%d.zip" % i)), tables), cache_dir, 2)
+    assert len(os.listdir(cache_dir)) == 2
+
+
+def test_time_to_seconds():
+    times = pd.Series(["06:00:00", " 7:05:09", "25:10:00", None, ""])
+    assert feed.time_to_seconds(times).tolist() == [21600, 25509, 90600, -1, -1]
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_read_csv_chunked(workers, monkeypatch):
+    monkeypatch.setattr(feed, "CSV_CHUNK_MIN_BYTES", 0)
+    data = b"a,b\n" + b"".join(b"%d,x%d\n" % (i, i) for i in range(1000))
+    df = feed.read_csv_chunked(data, columns=["a"], workers=workers)
+    assert list(df.columns) == ["a"]
+    assert df["a"].tolist() == [str(i) for i in range(1000)]
+
+
+def test_split_lines():
+    data = b"h\n" + b"1\n22\n333\n4444\n"
+    ranges = feed.split_lines(data, 3)
+    assert b"".join(data[b:e] for b, e in ranges) == data[2:]
+    assert all(data[e - 1 : e] == b"\n" for _, e in ranges)
+    assert np.all(np.diff([b for b, _ in ranges]) > 0)
+
+
+def test_compact_dtypes():
+    df = feed.compact_dtypes(
+        pd.DataFrame(
+            {
+                "trip_id": ["t1", "t1"],
+                "direction_id": ["1", None],
+                "stop_sequence": ["1", "2"],
+                "departure_time": ["06:00:00", "25:00:00"],
+            }
+        )
+    )
+    assert df["trip_id"].dtype == "category"
+    assert df["direction_id"].tolist() == [1, -1]
+    assert df["direction_id"].dtype == "int32"
+    assert df["departure_time"].tolist() == [21600, 90000]
+
+
+def test_table_reads_columns_without_keeping_them(feed_zip, tmp_path):
+    cache_dir = str(tmp_path / "parsed")
+    for _ in range(2):
+        # parsed on the first run, read from the cache on the second
+        gtfs = feed.load_gtfs(feed_zip, cache_dir, 2)
+        trips = gtfs.table("trips", ["trip_id", "direction_id"], compact=True)
+        assert list(trips.columns) == ["trip_id"]
+        assert trips["trip_id"].dtype == "category"
+        assert len(trips) == 14
+        assert gtfs.tables == {}
+
+
+def test_read_table_of_dict():
+    tables = fixture_tables()
+    stop_times = feed.read_table(tables, "stop_times", ["trip_id", "departure_time"])
+    assert list(stop_times.columns) == ["trip_id", "departure_time"]
+    assert len(feed.read_table(tables, "frequencies")) == 0
+
+
+def test_tables_without_rows_are_skipped(tmp_path):
+    tables = fixture_tables()
+    tables["shapes"] = tables["shapes"].head(0)
+    gtfs = feed.GTFSFeed(write_feed(str(tmp_path / "feed.zip"), tables))
+    # as gtfs_parser.GTFS(), routes are drawn by stops without shapes
+    assert "shapes" not in gtfs
+    assert gtfs.get("shapes") is None
+    assert len(feed.read_table(gtfs, "shapes")) == 0
+
+    gtfs_parser = import_gtfs_parser()
+    assert len(list(gtfs_parser.parse.read_routes(gtfs))) == 3
@@ -0,0 +1,82 @@
+import http.server
+import os
+import threading
+import urllib.error
+
+import pytest
+from conftest import import_plugin
+
+feed_cache = import_plugin("gtfs_go_feed_cache")
+
+LAST_MODIFIED = "Fri, 05 Jan 2024 00:00:00 GMT"
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    files = {}
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(self.path)
+        if self.headers.get("If-Modified-Since") == LAST_MODIFIED:
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = self.files.get(self.path)
+        if body is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Last-Modified", LAST_MODIFIED)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    Handler.files = {"/a.zip": b"a" * 100, "/b.zip": b"b" * 100}
+    Handler.requests = []
+    httpd = http.server.HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:%d" % httpd.server_port
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_download_once_per_version(server, tmp_path):
+    cache = feed_cache.FeedCache(str(tmp_path), 1000)
+    path = cache.get(server + "/a.zip", version="1")
+    with open(path, "rb") as f:
+        assert f.read() == b"a" * 100
+    assert cache.get(server + "/a.zip", version="1") == path
+    assert Handler.requests == ["/a.zip"]
+
+
+def test_unchanged_content_is_revalidated(server, tmp_path):
+    cache = feed_cache.FeedCache(str(tmp_path), 1000)
+    path = cache.get(server + "/a.zip")
+    assert cache.get(server + "/a.zip") == path
+    assert len(Handler.requests) == 2
+    assert os.listdir(cache.blobs_dir) == [os.path.basename(path)]
+
+
+def test_least_recently_used_are_evicted(server, tmp_path):
+    cache = feed_cache.FeedCache(str(tmp_path), 150)
+    a = cache.get(server + "/a.zip", version="1")
+    b = cache.get(server + "/b.zip", version="1")
+    assert not os.path.exists(a)
+    assert os.path.exists(b)
+    assert list(cache.load_index()) == [server + "/b.zip"]
+
+
+def test_failed_download_leaves_nothing(server, tmp_path):
+    cache = feed_cache.FeedCache(str(tmp_path), 1000)
+    with pytest.raises(urllib.error.HTTPError):
+        cache.get(server + "/missing.zip")
+    assert os.listdir(cache.blobs_dir) == []
+    assert cache.load_index() == {}
@@ -0,0 +1,195 @@
+import json
+import os
+import time
+from concurrent.futures import wait
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+from conftest import fixture_tables, import_gtfs_parser, import_plugin
+
+
+@pytest.fixture
+def pipeline():
+    import_gtfs_parser()
+    return import_plugin("gtfs_go_pipeline")
+
+
+def test_shutdown_stops_running_workers(pipeline):
+    executor = pipeline.get_process_executor(1)
+    future = executor.submit(time.sleep, 60)
+    while not executor._processes:
+        time.sleep(0.1)
+    processes = list(executor._processes.values())
+
+    pipeline.shutdown_process_executor(terminate=True)
+    assert not any(process.is_alive() for process in processes)
+    # failed by the executor as its process is gone
+    assert wait([future], timeout=10).done
+    assert pipeline.get_process_executor(1) is not executor
+    pipeline.shutdown_process_executor()
+
+
+def test_canceled_subprocess_leaves_no_outputs(pipeline, feed_zip, tmp_path):
+    output_dir = str(tmp_path / "out")
+    os.makedirs(output_dir)
+    # written by the worker before the run was canceled
+    for filename in ("aggregated_stops.geojson", "result.csv", "routes.geojson"):
+        with open(os.path.join(output_dir, filename), "w") as f:
+            f.write("{")
+    # a task of another feed on the shared executor
+    executor = pipeline.get_process_executor(1)
+    other = executor.submit(time.sleep, 60)
+
+    gtfs = pipeline.load_feed(feed_zip, str(tmp_path / "parsed"), 1)
+    params = pipeline.make_params(output_dir, workers=2, aggregate_in_subprocess=True)
+    try:
+        with pytest.raises(pipeline.CanceledError):
+            pipeline.aggregate_in_subprocess(
+                gtfs, params, output_dir, is_canceled=lambda: True
+            )
+        assert os.listdir(output_dir) == ["routes.geojson"]
+        assert pipeline._process_executor is executor
+        assert not other.done()
+    finally:
+        pipeline.shutdown_process_executor(terminate=True)
+
+
+def test_fallback_of_subprocess_can_be_canceled(
+    pipeline, feed_zip, tmp_path, monkeypatch
+):
+    class Unspawnable:
+        _processes = None
+
+        def submit(self, *args):
+            raise BrokenProcessPool()
+
+        def shutdown(self, **kwargs):
+            pass
+
+    monkeypatch.setattr(pipeline, "make_process_executor", lambda n: Unspawnable())
+    output_dir = str(tmp_path / "out")
+    os.makedirs(output_dir)
+    gtfs = pipeline.load_feed(feed_zip, str(tmp_path / "parsed"), 1)
+    params = pipeline.make_params(
+        output_dir,
+        simple=False,
+        aggregate=True,
+        dates=["20240105", "20240106"],
+        workers=2,
+        aggregate_in_subprocess=True,
+    )
+    with pytest.raises(pipeline.CanceledError):
+        pipeline.aggregate_in_subprocess(
+            gtfs, params, output_dir, is_canceled=lambda: True
+        )
+
+
+def aggregated_outputs(pipeline, feed_zip, tmp_path, name, **options):
+    output_dir = str(tmp_path / name)
+    os.makedirs(output_dir)
+    gtfs = pipeline.load_feed(feed_zip, str(tmp_path / "parsed"), 1)
+    window = {"yyyymmdd": "20240105", "begin_time": "060000", "end_time": "090000"}
+    window.update(options)
+    params = pipeline.make_params(
+        output_dir,
+        simple=False,
+        aggregate=True,
+        workers=1,
+        aggregate_in_subprocess=False,
+        **window
+    )
+    pipeline.aggregate_and_write(gtfs, params, output_dir)
+    outputs = {}
+    for filename in ("aggregated_stops", "aggregated_routes"):
+        with open(os.path.join(output_dir, filename + ".geojson")) as f:
+            outputs[filename] = json.load(f)["features"]
+    with open(os.path.join(output_dir, "result.csv")) as f:
+        outputs["result"] = f.read()
+    return outputs
+
+
+@pytest.mark.parametrize(
+    "options", [{}, {"delimiter": "_"}, {"unify": False}], ids=["name", "id", "off"]
+)
+def test_unified_outputs_match_legacy(
+    pipeline, stage_cache, feed_zip, tmp_path, monkeypatch, options
+):
+    # Aggregator draws straight lines between stops
+    options["ignore_shapes"] = True
+    outputs = aggregated_outputs(pipeline, feed_zip, tmp_path, "plugin", **options)
+    monkeypatch.setattr(pipeline, "VECTORIZED_STOP_UNIFICATION", False)
+    stage_cache.clear()
+    legacy = aggregated_outputs(pipeline, feed_zip, tmp_path, "legacy", **options)
+
+    assert outputs == legacy
+    if options.get("unify", True):
+        # counted by positions of unified stops, not 1 each
+        assert {f["properties"]["count"] for f in outputs["aggregated_stops"]} != {1}
+
+
+def test_aggregated_routes_follow_shapes(pipeline, stage_cache, feed_zip, tmp_path):
+    outputs = aggregated_outputs(pipeline, feed_zip, tmp_path, "shapes")
+    routes = {
+        (f["properties"]["prev_stop_id"], f["properties"]["next_stop_id"]): f
+        for f in outputs["aggregated_routes"]
+    }
+    # the detour of shape SH1 between B_x_1 and H1
+    assert [139.712, 35.699] in routes[("B_x_1", "H1")]["geometry"]["coordinates"]
+    # R2 has no shape
+    assert len(routes[("Z", "H1")]["geometry"]["coordinates"]) == 2
+
+
+@pytest.mark.parametrize("vectorized", [True, False])
+def test_narrow_window_doesnt_change_the_next_run(
+    pipeline, stage_cache, feed_zip, tmp_path, monkeypatch, vectorized
+):
+    monkeypatch.setattr(pipeline, "VECTORIZED_STOP_UNIFICATION", vectorized)
+    windows = [("", ""), ("060000", "090000"), ("", "")]
+    frequencies = []
+    for i, (begin_time, end_time) in enumerate(windows):
+        outputs = aggregated_outputs(
+            pipeline,
+            feed_zip,
+            tmp_path,
+            "run%d" % i,
+            begin_time=begin_time,
+            end_time=end_time,
+            time_bin_minutes=60,
+        )
+        frequencies.append(
+            sum(f["properties"]["frequency"] for f in outputs["aggregated_routes"])
+        )
+    assert frequencies[1] < frequencies[0]
+    assert frequencies[2] == frequencies[0]
+    # tables of the cached feed are as parsed
+    gtfs = pipeline.load_feed(feed_zip, str(tmp_path / "parsed"), 1)
+    assert len(gtfs["stop_times"]) == len(fixture_tables()["stop_times"])
+    assert "similar_stop_id" not in gtfs["stops"].columns
+
+
+def test_stop_times_are_not_loaded_whole_for_aggregation(
+    pipeline, stage_cache, feed_zip, tmp_path
+):
+    params = pipeline.make_params("", simple=False, aggregate=True)
+    assert "stop_times" not in pipeline.preload_tables(params)
+    params = pipeline.make_params("", simple=True, ignore_shapes=True)
+    assert pipeline.preload_tables(params) == ["stops", "routes", "trips", "stop_times"]
+
+    aggregated_outputs(pipeline, feed_zip, tmp_path, "out")
+    gtfs = pipeline.load_feed(feed_zip, str(tmp_path / "parsed"), 1)
+    # read by columns for counting, not kept in the feed
+    assert "stop_times" not in gtfs.tables
+
+
+def test_routes_have_route_color(pipeline, feed_zip, tmp_path):
+    gtfs = pipeline.load_feed(feed_zip, str(tmp_path / "parsed"), 1)
+    routes = pipeline.with_route_colors(
+        pipeline.gtfs_parser.parse.read_routes(gtfs, ignore_shapes=True),
+        gtfs["routes"],
+    )
+    colors = {
+        f["properties"]["route_id"]: f["properties"]["route_color"] for f in routes
+    }
+    assert colors["R1"] == "FF0000"
+    # blank route_color is left to the renderer
+    assert colors["R2"] is None
@@ -0,0 +1,77 @@
+import pandas as pd
+from conftest import import_plugin
+
+feed = import_plugin("gtfs_go_feed")
+
+
+def test_stage_key_of_uncached_feed_is_empty(stage_cache):
+    assert stage_cache.stage_key({"stops": pd.DataFrame()}, "unified", "_") == ""
+
+
+def test_cached_computes_once(stage_cache, feed_zip, tmp_path):
+    gtfs = feed.load_gtfs(feed_zip, str(tmp_path / "parsed"), 2)
+    key = stage_cache.stage_key(gtfs, "unified", True, "_")
+    assert key.startswith("unified_")
+    assert key != stage_cache.stage_key(gtfs, "unified", True, "-")
+
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return pd.DataFrame({"a": [1, 2]})
+
+    first = stage_cache.cached(gtfs, key, compute)
+    second = stage_cache.cached(gtfs, key, compute)
+    assert first is second
+    assert len(calls) == 1
+
+
+def test_cached_table_is_reused_by_later_sessions(stage_cache, feed_zip, tmp_path):
+    gtfs = feed.load_gtfs(feed_zip, str(tmp_path / "parsed"), 2)
+    key = stage_cache.stage_key(gtfs, "unified", True, "")
+    stage_cache.cached_table(gtfs, key, lambda: pd.DataFrame({"a": [1, 2]}))
+
+    # a new session: nothing in memory, the table is read from the feed cache
+    stage_cache.clear()
+
+    def fail():
+        raise AssertionError("computed again")
+
+    df = stage_cache.cached_table(gtfs, key, fail)
+    assert df["a"].tolist() == [1, 2]
+
+
+def test_results_over_limit_are_dropped(stage_cache, monkeypatch):
+    monkeypatch.setattr(stage_cache, "STAGE_CACHE_MAX_BYTES", 2000)
+    table = pd.DataFrame({"a": range(100)})
+    stage_cache.put_result("feed", "first", table)
+    stage_cache.put_result("feed", "second", table)
+    stage_cache.put_result("feed", "third", table)
+    assert stage_cache.get_result("feed", "first") is None
+    assert stage_cache.get_result("feed", "third") is table
+
+
+def test_results_are_estimated_with_strings(stage_cache):
+    ids = pd.DataFrame({"stop_id": ["stop_%d" % i for i in range(100)]}, dtype=object)
+    # object columns are counted by their strings, not by their pointers
+    assert stage_cache.estimate_bytes(ids) > 4 * ids.memory_usage(index=False).sum()
+
+
+def test_load_feed_is_not_kept(stage_cache, feed_zip, tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / "parsed")
+    gtfs = stage_cache.load_feed(feed_zip, cache_dir, 2)
+    gtfs["trips"]
+    assert stage_cache._results == {}
+
+    def fail(self, name, columns=None):
+        raise AssertionError("parsed again")
+
+    # the same content at another path is read from the parsed tables
+    copied = str(tmp_path / "copy.zip")
+    with open(feed_zip, "rb") as src, open(copied, "wb") as dst:
+        dst.write(src.read())
+    monkeypatch.setattr(feed.GTFSFeed, "read_csv", fail)
+    again = stage_cache.load_feed(copied, cache_dir, 2)
+    assert again is not gtfs
+    assert again.table_dir == gtfs.table_dir
+    assert len(again["trips"]) == 14
@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import fixture_tables, import_plugin
+
+stoptimes = import_plugin("gtfs_go_stoptimes")
+
+
+def segment_counts_by_pandas(stop_times: pd.DataFrame) -> dict:
+    stop_times = stop_times.assign(
+        stop_sequence=stop_times["stop_sequence"].astype(int)
+    ).sort_values(["trip_id", "stop_sequence"])
+    next_stop = stop_times.groupby("trip_id")["stop_id"].shift(-1)
+    pairs = pd.DataFrame(
+        {"prev_stop_id": stop_times["stop_id"], "next_stop_id": next_stop}
+    ).dropna()
+    return pairs.groupby(["prev_stop_id", "next_stop_id"]).size().to_dict()
+
+
+def test_pack_and_unpack_keys():
+    codes = [np.array([0, 2, 1]), np.array([3, 0, 4])]
+    keys = stoptimes.pack_keys(codes, [3, 5])
+    assert [c.tolist() for c in stoptimes.unpack_keys(keys, [3, 5])] == [
+        [0, 2, 1],
+        [3, 0, 4],
+    ]
+    with pytest.raises(OverflowError):
+        stoptimes.pack_keys(codes, [2**32, 2**32])
+
+
+def test_from_table_orders_trips():
+    stop_times = fixture_tables()["stop_times"].sample(frac=1, random_state=0)
+    compact = stoptimes.CompactStopTimes.from_table(stop_times)
+    assert len(compact) == len(stop_times)
+    assert compact.n_trips == stop_times["trip_id"].nunique()
+    trip = compact.trip_ids.tolist().index("R1_WK_060000")
+    begin, end = compact.offsets[trip], compact.offsets[trip + 1]
+    assert compact.stop_ids[compact.stop_codes[begin:end]].tolist() == [
+        "C_1",
+        "B_x_1",
+        "H1",
+        "Z",
+    ]
+    assert compact.seconds[begin:end].tolist() == [21600, 21900, 22200, 22500]
+
+
+def test_times_past_midnight_and_blank_departures():
+    stop_times = pd.DataFrame(
+        {
+            "trip_id": ["T", "T"],
+            "arrival_time": ["25:10:00", "25:15:00"],
+            "departure_time": ["25:10:00", None],
+            "stop_id": ["A", "B"],
+            "stop_sequence": ["1", "2"],
+        }
+    )
+    compact = stoptimes.CompactStopTimes.from_table(stop_times)
+    # blank departure falls back to arrival
+    assert compact.seconds.tolist() == [90600, 90900]
+
+
+def test_segment_counts_match_pandas():
+    stop_times = fixture_tables()["stop_times"]
+    compact = stoptimes.CompactStopTimes.from_table(stop_times)
+    counts = compact.segment_counts()
+    assert {
+        (p, n): t
+        for p, n, t in zip(
+            counts["prev_stop_id"], counts["next_stop_id"], counts["trips"]
+        )
+    } == segment_counts_by_pandas(stop_times)
+
+
+def test_stop_counts_with_time_mask():
+    stop_times = fixture_tables()["stop_times"]
+    compact = stoptimes.CompactStopTimes.from_table(stop_times)
+    mask = compact.time_mask(6 * 3600, 9 * 3600)
+    counts = compact.stop_counts(mask)
+    departures = stop_times["departure_time"]
+    expected = (
+        stop_times[(departures >= "06:00:00") & (departures < "09:00:00")]
+        .groupby("stop_id")
+        .size()
+        .to_dict()
+    )
+    assert dict(zip(counts["stop_id"], counts["trips"])) == expected
+
+
+def test_from_feed_reads_compact_columns(feed_zip, tmp_path):
+    feed = import_plugin("gtfs_go_feed")
+    gtfs = feed.load_gtfs(feed_zip, str(tmp_path / "parsed"), 2)
+    compact = stoptimes.CompactStopTimes.from_feed(gtfs)
+    expected = stoptimes.CompactStopTimes.from_table(fixture_tables()["stop_times"])
+    assert compact.trip_ids.tolist() == expected.trip_ids.tolist()
+    assert compact.stop_ids.tolist() == expected.stop_ids.tolist()
+    assert np.array_equal(compact.stop_codes, expected.stop_codes)
+    assert np.array_equal(compact.seconds, expected.seconds)
+    assert "stop_times" not in gtfs.tables
@@ -0,0 +1,158 @@
+import gzip
+import json
+import sqlite3
+
+import pytest
+from conftest import import_plugin
+
+tiles = import_plugin("gtfs_go_tiles")
+
+
+def line(lon, lat, frequency):
+    return {
+        "type": "Feature",
+        "geometry": {
+            "type": "LineString",
+            "coordinates": [[lon, lat], [lon + 0.01, lat + 0.005]],
+        },
+        "properties": {"frequency": frequency, "prev_stop_id": "S%d" % frequency},
+    }
+
+
+def point(lon, lat, count):
+    return {
+        "type": "Feature",
+        "geometry": {"type": "Point", "coordinates": [lon, lat]},
+        "properties": {"count": count, "similar_stop_name": "駅", "ok": True},
+    }
+
+
+def read_tiles(path):
+    connection = sqlite3.connect(path)
+    try:
+        metadata = dict(connection.execute("SELECT name, value FROM metadata"))
+        rows = connection.execute(
+            "SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles"
+        ).fetchall()
+    finally:
+        connection.close()
+    return metadata, {(z, x, row): data for z, x, row, data in rows}
+
+
+def decode_commands(geometry: bytes) -> list:
+    commands = []
+    pos = 0
+    while pos < len(geometry):
+        value, pos = tiles.read_varint(geometry, pos)
+        commands.append(value)
+    return commands
+
+
+def test_varint_and_zigzag():
+    assert tiles.varint(1) == b"\x01"
+    assert tiles.varint(300) == b"\xac\x02"
+    assert tiles.read_varint(b"\xac\x02", 0) == (300, 2)
+    assert [tiles.zigzag(n) for n in (0, -1, 1, -2)] == [0, 1, 2, 3]
+
+
+def test_clip_line_splits_at_bounds():
+    pieces = tiles.clip_line([(-10, 5), (5, 5), (5, 20), (5, 30)], 0, 10)
+    assert pieces == [[(0, 5), (5, 5), (5, 10)]]
+
+
+def test_value_types_round_trip():
+    encoder = tiles.LayerEncoder("layer")
+    properties = {"s": "a", "i": 3, "n": -2, "f": 1.5, "b": True, "none": None}
+    encoder.add(tiles.POINT, bytes([9, 0, 0]), properties)
+    decoded = tiles.decode_tile(tiles.message(3, encoder.encode()))
+    ((geometry_type, geometry, decoded_properties),) = decoded["layer"]
+    assert geometry_type == tiles.POINT
+    assert geometry == bytes([9, 0, 0])
+    assert decoded_properties == {"s": "a", "i": 3, "n": -2, "f": 1.5, "b": True}
+
+
+def test_write_mbtiles(tmp_path):
+    path = str(tmp_path / "aggregated.mbtiles")
+    layers = {
+        "aggregated_routes": [line(139.70, 35.68, f) for f in (1, 30, 5)],
+        "aggregated_stops": [point(139.70, 35.68, 10)],
+    }
+    count = tiles.write_mbtiles(path, layers, min_zoom=4, max_zoom=10)
+    metadata, data = read_tiles(path)
+
+    assert count == len(data)
+    assert metadata["minzoom"] == "4" and metadata["maxzoom"] == "10"
+    west, south, east, north = [float(v) for v in metadata["bounds"].split(",")]
+    assert (west, south) == pytest.approx((139.70, 35.68))
+    assert (east, north) == pytest.approx((139.71, 35.685))
+    vector_layers = {
+        layer["id"]: layer["fields"]
+        for layer in json.loads(metadata["json"])["vector_layers"]
+    }
+    assert vector_layers["aggregated_stops"] == {
+        "count": "Number",
+        "similar_stop_name": "String",
+        "ok": "Boolean",
+    }
+
+    # tile of Tokyo at z10 is x=909, y=403; rows are numbered from the south
+    decoded = tiles.decode_tile(gzip.decompress(data[(10, 909, 1023 - 403)]))
+    frequencies = [p["frequency"] for _, _, p in decoded["aggregated_routes"]]
+    assert frequencies == [30, 5, 1]
+    assert decoded["aggregated_stops"][0][2]["similar_stop_name"] == "駅"
+    for _, geometry, _ in decoded["aggregated_routes"]:
+        commands = decode_commands(geometry)
+        # MoveTo 1, LineTo n
+        assert commands[0] == tiles.command(1, 1)
+        assert commands[3] & 0x7 == 2
+
+
+def test_features_over_limit_are_dropped(tmp_path, monkeypatch):
+    monkeypatch.setattr(tiles, "TILE_MAX_FEATURES", 2)
+    path = str(tmp_path / "limited.mbtiles")
+    layers = {"aggregated_routes": [line(139.70, 35.68, f) for f in (1, 30, 5)]}
+    tiles.write_mbtiles(path, layers, min_zoom=10, max_zoom=10)
+    _, data = read_tiles(path)
+    decoded = tiles.decode_tile(gzip.decompress(data[(10, 909, 1023 - 403)]))
+    assert [p["frequency"] for _, _, p in decoded["aggregated_routes"]] == [30, 5]
+
+
+def test_merge_mbtiles(tmp_path):
+    first = str(tmp_path / "first.mbtiles")
+    second = str(tmp_path / "second.mbtiles")
+    tiles.write_mbtiles(first, {"aggregated_routes": [line(139.70, 35.68, 3)]}, 8, 9)
+    tiles.write_mbtiles(
+        second,
+        {
+            "aggregated_routes": [line(139.70, 35.68, 7)],
+            "aggregated_stops": [point(135.50, 34.70, 1)],
+        },
+        8,
+        9,
+    )
+    merged = tiles.merge_mbtiles(str(tmp_path / "merged.mbtiles"), [first, second])
+    metadata, data = read_tiles(merged)
+    _, first_data = read_tiles(first)
+    _, second_data = read_tiles(second)
+
+    assert set(data) == set(first_data) | set(second_data)
+    shared = (9, 454, 511 - 201)
+    decoded = tiles.decode_tile(gzip.decompress(data[shared]))
+    assert [p["frequency"] for _, _, p in decoded["aggregated_routes"]] == [7, 3]
+    west, _, east, _ = [float(v) for v in metadata["bounds"].split(",")]
+    assert west == pytest.approx(135.50) and east == pytest.approx(139.71)
+
+
+def test_decodable_by_mapbox_vector_tile(tmp_path):
+    mapbox_vector_tile = pytest.importorskip("mapbox_vector_tile")
+    path = str(tmp_path / "aggregated.mbtiles")
+    tiles.write_mbtiles(path, {"aggregated_stops": [point(139.70, 35.68, 10)]}, 10, 10)
+    _, data = read_tiles(path)
+    decoded = mapbox_vector_tile.decode(gzip.decompress(data[(10, 909, 1023 - 403)]))
+    feature = decoded["aggregated_stops"]["features"][0]
+    assert feature["properties"] == {
+        "count": 10,
+        "similar_stop_name": "駅",
+        "ok": True,
+    }
+    assert feature["geometry"]["type"] == "Point"
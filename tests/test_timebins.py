@@ -0,0 +1,36 @@
+from conftest import fixture_tables, import_plugin
+
+calendar = import_plugin("gtfs_go_calendar")
+stoptimes = import_plugin("gtfs_go_stoptimes")
+timebins = import_plugin("gtfs_go_timebins")
+unify = import_plugin("gtfs_go_unify")
+
+
+def test_bins_of_a_date_by_mask_of_the_feed():
+    gtfs = fixture_tables()
+    compact = stoptimes.CompactStopTimes.from_table(gtfs["stop_times"])
+    running = calendar.trips_running(gtfs, compact.trip_ids, "20240105")
+    mask = running[compact.trip_codes()]
+    filtered = calendar.filter_by_date(gtfs, "20240105")
+
+    for read in (timebins.read_binned_stops, timebins.read_binned_routes):
+        expected = list(read(filtered, 60, "20240105", "060000", "090000"))
+        features = list(
+            read(gtfs, 60, "20240105", "060000", "090000", compact=compact, mask=mask)
+        )
+        assert features == expected
+        assert len(features) > 0
+
+
+def test_bins_of_unified_stops_by_remapped_stop_codes():
+    gtfs = fixture_tables()
+    gtfs["stops"] = gtfs["stops"].astype({"stop_lon": float, "stop_lat": float})
+    unified = unify.unify_stops(gtfs["stops"], delimiter="_")
+    compact = stoptimes.CompactStopTimes.from_table(gtfs["stop_times"])
+    remapped = compact.remap_stops(unify.similar_stop_ids(unified, compact.stop_ids))
+    feed = unify.apply_unification(gtfs, unified)
+
+    for read in (timebins.read_binned_stops, timebins.read_binned_routes):
+        expected = list(read(feed, 30))
+        assert list(read(feed, 30, compact=remapped)) == expected
+        assert len(expected) > 0
@@ -0,0 +1,119 @@
+import math
+
+import pytest
+from conftest import import_gtfs_parser, import_plugin
+
+feed = import_plugin("gtfs_go_feed")
+frequency = import_plugin("gtfs_go_frequency")
+stoptimes = import_plugin("gtfs_go_stoptimes")
+unify = import_plugin("gtfs_go_unify")
+
+WINDOW = {"yyyymmdd": "20240105", "begin_time": "060000", "end_time": "090000"}
+
+
+def load(feed_zip: str) -> dict:
+    gtfs = feed.GTFSFeed(feed_zip)
+    return {name: gtfs[name].copy() for name in gtfs}
+
+
+def legacy_aggregator(
+    feed_zip: str, delimiter: str, no_unify_stops=False, window=WINDOW
+):
+    gtfs_parser = import_gtfs_parser()
+    return gtfs_parser.aggregate.Aggregator(
+        load(feed_zip), no_unify_stops=no_unify_stops, delimiter=delimiter, **window
+    )
+
+
+def plugin_frequency(feed_zip: str, delimiter: str, no_unify_stops=False):
+    gtfs = load(feed_zip)
+    if no_unify_stops:
+        unified = unify.keep_stops(gtfs["stops"])
+    else:
+        unified = unify.unify_stops(gtfs["stops"], delimiter=delimiter)
+    return unified, frequency.Frequency(
+        gtfs, unified, count_stops=not no_unify_stops, **WINDOW
+    )
+
+
+def same_count(a, b) -> bool:
+    if isinstance(a, float) and math.isnan(a):
+        return isinstance(b, float) and math.isnan(b)
+    return a == b
+
+
+def flatten(coordinates) -> list:
+    if isinstance(coordinates[0], (list, tuple)):
+        return [value for point in coordinates for value in point]
+    return list(coordinates)
+
+
+def assert_same_features(features, expected):
+    assert len(features) == len(expected)
+    for feature, legacy in zip(features, expected):
+        properties = dict(feature["properties"])
+        legacy_properties = dict(legacy["properties"])
+        assert same_count(properties.pop("count", 0), legacy_properties.pop("count", 0))
+        assert properties == legacy_properties
+        assert feature["geometry"]["type"] == legacy["geometry"]["type"]
+        assert flatten(feature["geometry"]["coordinates"]) == pytest.approx(
+            flatten(legacy["geometry"]["coordinates"])
+        )
+
+
+@pytest.mark.parametrize(
+    "delimiter,no_unify_stops", [("", False), ("_", False), ("", True)]
+)
+def test_same_as_legacy_aggregator(feed_zip, delimiter, no_unify_stops):
+    legacy = legacy_aggregator(feed_zip, delimiter, no_unify_stops)
+    unified, aggregated = plugin_frequency(feed_zip, delimiter, no_unify_stops)
+
+    result = legacy.gtfs["stops"][unify.RESULT_COLUMNS]
+    assert unified[unify.RESULT_COLUMNS].values.tolist() == result.values.tolist()
+    assert_same_features(
+        list(aggregated.read_interpolated_stops()), legacy.read_interpolated_stops()
+    )
+    assert_same_features(
+        list(aggregated.read_route_frequency()), legacy.read_route_frequency()
+    )
+
+
+def test_one_compact_serves_every_window(feed_zip):
+    gtfs = load(feed_zip)
+    unified = unify.unify_stops(gtfs["stops"])
+    compact = stoptimes.CompactStopTimes.from_feed(gtfs)
+    for window in (
+        WINDOW,
+        # new year's holiday on sunday timetable
+        {"yyyymmdd": "20240102", "begin_time": "", "end_time": ""},
+        # past midnight of all dates
+        {"yyyymmdd": "", "begin_time": "070000", "end_time": "260000"},
+    ):
+        aggregated = frequency.Frequency(gtfs, unified, compact=compact, **window)
+        legacy = legacy_aggregator(feed_zip, "", window=window)
+        assert_same_features(
+            list(aggregated.read_interpolated_stops()),
+            legacy.read_interpolated_stops(),
+        )
+        assert_same_features(
+            list(aggregated.read_route_frequency()), legacy.read_route_frequency()
+        )
+
+
+def test_unify_stops_by_rules(feed_zip):
+    stops = load(feed_zip)["stops"]
+    unified = unify.unify_stops(stops, delimiter="_").set_index("stop_id")
+    # children of a parent station
+    assert unified.loc["C_1", "similar_stop_id"] == "S0"
+    # prefix before the last delimiter, named after the first of them
+    assert unified.loc["B_x_1", "similar_stop_id"] == "B_x"
+    assert unified.loc["B_x_1", "similar_stop_name"] == "Bay East"
+    assert unified.loc["B_x_1", "similar_stop_lon"] == pytest.approx(139.7095)
+    assert unified.loc["B_y", "similar_stop_id"] == "B"
+    # same name within the distance, the first in order of stops
+    assert unified.loc["H1", "similar_stop_id"] == "H2"
+    assert unified.loc["H3", "similar_stop_id"] == "H3"
+
+    unified = unify.unify_stops(stops).set_index("stop_id")
+    # the first in order of stop_id without delimiter
+    assert unified.loc["H2", "similar_stop_id"] == "H1"
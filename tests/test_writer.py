@@ -0,0 +1,121 @@
+import json
+import os
+from xml.etree import ElementTree
+
+import pytest
+from conftest import import_plugin
+
+writer = import_plugin("gtfs_go_writer")
+
+
+def features(n):
+    for i in range(n):
+        yield {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [139.1234567, 35.7654321]},
+            "properties": {"stop_id": "S%d" % i, "route_ids": ["R1"]},
+        }
+
+
+def test_write_geojson_with_precision(tmp_path):
+    path = str(tmp_path / "stops.geojson")
+    assert writer.write_geojson(path, features(3), precision=3) == 3
+    with open(path, encoding="utf-8") as f:
+        collection = json.load(f)
+    assert collection["type"] == "FeatureCollection"
+    assert [f["properties"]["stop_id"] for f in collection["features"]] == [
+        "S0",
+        "S1",
+        "S2",
+    ]
+    assert collection["features"][0]["geometry"]["coordinates"] == [139.123, 35.765]
+
+
+def test_write_geojson_empty(tmp_path):
+    path = str(tmp_path / "empty.geojson")
+    assert writer.write_geojson(path, iter([])) == 0
+    with open(path, encoding="utf-8") as f:
+        assert json.load(f) == {"type": "FeatureCollection", "features": []}
+
+
+def test_write_geojson_failed_leaves_output_as_it_was(tmp_path):
+    path = str(tmp_path / "stops.geojson")
+    writer.write_geojson(path, features(1))
+
+    def broken():
+        yield from features(2)
+        raise ValueError("broken feed")
+
+    with pytest.raises(ValueError):
+        writer.write_geojson(path, broken())
+    assert os.listdir(str(tmp_path)) == ["stops.geojson"]
+    with open(path, encoding="utf-8") as f:
+        assert len(json.load(f)["features"]) == 1
+
+
+def test_remove_layers(tmp_path):
+    for filename in ("aggregated_stops.geojson", "result.csv", "stops.geojson"):
+        (tmp_path / filename).write_text("{}")
+    assert writer.remove_layers(str(tmp_path), ("aggregated", "result"), "GeoJSON") == 2
+    assert os.listdir(str(tmp_path)) == ["stops.geojson"]
+
+
+def test_layer_uri_and_name():
+    assert writer.layer_uri("out", "stops", "GeoJSON") == os.path.join(
+        "out", "stops.geojson"
+    )
+    assert writer.layer_uri("out", "stops", "FlatGeobuf") == os.path.join(
+        "out", "stops.fgb"
+    )
+    uri = writer.layer_uri("out", "stops", "GPKG")
+    assert uri == os.path.join("out", writer.GPKG_FILENAME) + "|layername=stops"
+    assert writer.layer_name(uri) == "stops"
+    assert writer.layer_name(os.path.join("out", "aggregated_stops.geojson")) == (
+        "aggregated_stops"
+    )
+
+
+def test_write_merged_layers(tmp_path):
+    feeds = {}
+    for feed in ("a", "b"):
+        feeds[feed] = {
+            "routes": str(tmp_path / feed / "routes.geojson"),
+            "stops": "",
+            "aggregated_dates": {
+                "20240105": {
+                    "aggregated_stops": str(
+                        tmp_path / feed / "aggregated_stops_20240105.geojson"
+                    )
+                }
+            },
+        }
+    merged = writer.write_merged_layers(str(tmp_path), feeds)
+
+    assert merged["stops"] == ""
+    assert merged["routes"] == str(tmp_path / "routes.vrt")
+    assert merged["aggregated_dates"]["20240105"]["aggregated_stops"] == str(
+        tmp_path / "aggregated_stops_20240105.vrt"
+    )
+    union = ElementTree.parse(merged["routes"]).getroot().find("OGRVRTUnionLayer")
+    assert union.get("name") == "routes"
+    assert union.find("SourceLayerFieldName").text == "feed"
+    sources = union.findall("OGRVRTLayer")
+    assert [s.get("name") for s in sources] == ["a", "b"]
+    assert sources[0].find("SrcDataSource").text == feeds["a"]["routes"]
+    assert sources[0].find("SrcLayer").text == "routes"
+
+
+def test_infer_schema():
+    sample = [
+        {"properties": {"name": "a", "count": 1, "share": 1, "flag": True}},
+        {"properties": {"name": None, "count": 2, "share": 0.5, "extra": [1]}},
+    ]
+    assert writer.infer_schema(sample) == [
+        ("name", str),
+        ("count", int),
+        ("share", float),
+        ("flag", bool),
+        ("extra", str),
+    ]
+    # fields of no value are text
+    assert writer.value_type([None, None]) is str